@@ -0,0 +1,72 @@
+class FrameReader:
+    """
+    Receive newline delimited JSON frames from one socket, the Raft peers always send JSON lines
+    to the visualization
+
+    Bytes are received with recv_into into one reusable bytearray and every complete
+    frame is handed out as a memoryview of it, bytes already scanned for the newline
+    are not scanned again and only the incomplete tail is ever moved.
+
+    """
+    # do not call recv_into with less free room than this
+    min_free_size = 4096
+    max_buffer_size = 4 * 1024 * 1024
+
+    def __init__(self, socket, buffer_size=64 * 1024):
+        self.socket = socket
+        self.buffer = bytearray(buffer_size)
+        self.buffer_view = memoryview(self.buffer)
+        # [frame_start, data_end) are received bytes not handed out yet
+        self.frame_start = 0
+        self.data_end = 0
+        # bytes in [frame_start, scan_position) have no newline
+        self.scan_position = 0
+        # size the buffer needs next time, the socket filled all of it
+        self.required_size = 0
+
+    def read_frames(self):
+        """
+        Receive once from the socket and yield every complete frame as a memoryview,
+        a frame is only valid until the next call
+
+        """
+        self.make_room()
+        received_size = self.socket.recv_into(self.buffer_view[self.data_end:])
+        # 0 means remote had closed the connection
+        if received_size == 0:
+            raise ConnectionResetError
+        self.data_end += received_size
+        # socket filled all the room we gave it, use a bigger buffer next time
+        if self.data_end == len(self.buffer) and len(self.buffer) < self.max_buffer_size:
+            self.required_size = len(self.buffer) * 2
+        while True:
+            frame_end = self.buffer.find(b"\n", self.scan_position, self.data_end)
+            if frame_end == -1:
+                self.scan_position = self.data_end
+                return
+            payload = self.buffer_view[self.frame_start:frame_end]
+            self.frame_start = frame_end + 1
+            self.scan_position = self.frame_start
+            yield payload
+
+    def make_room(self):
+        # everything handed out, start from the front again without copying anything
+        if self.frame_start == self.data_end:
+            self.frame_start = self.data_end = self.scan_position = 0
+        pending_size = self.data_end - self.frame_start
+        needed_size = max(self.required_size, pending_size + self.min_free_size)
+        if needed_size > len(self.buffer):
+            # new buffer instead of resizing, frames handed out earlier still point to the old one
+            new_buffer = bytearray(max(needed_size, len(self.buffer) * 2))
+            new_buffer[0:pending_size] = self.buffer_view[self.frame_start:self.data_end]
+            self.buffer = new_buffer
+            self.buffer_view = memoryview(self.buffer)
+        elif len(self.buffer) - self.data_end < self.min_free_size:
+            # move only the incomplete tail to the front
+            self.buffer[0:pending_size] = self.buffer[self.frame_start:self.data_end]
+        else:
+            return
+        self.scan_position -= self.frame_start
+        self.frame_start = 0
+        self.data_end = pending_size
+        self.required_size = 0
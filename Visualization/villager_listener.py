@@ -4,10 +4,12 @@ from constant import Constant
 from role import Role
 from debug_print import *
 from queue import Queue
+from frame_reader import FrameReader
 class VillagerListener(threading.Thread):
 
     def __init__(self, socket):
-        self.in_msg = ""
+        # incomplete JSON string stays in the reader buffer until its newline arrives
+        self.frame_reader = FrameReader(socket)
         threading.Thread.__init__(self)
         self.host = ""
         self.listening_port = 0
@@ -63,31 +65,16 @@ class VillagerListener(threading.Thread):
         while not self.stopped:
             try:
 
-                temp = self.socket.recv(1024).decode("utf-8")
-                # if temp == "" or None it means remote had closed the connection
-                if not temp:
-                    raise ConnectionResetError
-
-                self.in_msg += temp
-
-                if self.in_msg:
+                # turn each complete JSON frame into dictionary
+                # and put them into queues waiting for the Villager to consume them
+                for one_frame in self.frame_reader.read_frames():
+                    one_msg = bytes(one_frame).decode("utf-8")
                     debug_print("in message: .")
-                    debug_print(self.in_msg)
+                    debug_print(one_msg)
                     debug_print(".")
-                # if there is new line in accumulated bytes in 'in_msg'
-                # which means we have receive some complete JSON string messages
-                if "\n" in self.in_msg:
-                    msg_split_list = self.in_msg.split("\n")
-                    # leave the incomplete JSON string in the buffer
-                    self.in_msg = msg_split_list[-1]
-                    msg_split_list = msg_split_list[0:-1]
-                    # turn each complete JSON string into dictionary
-                    # and put them into queues waiting for the Villager to consume them
-                    while msg_split_list:
-                        one_msg = msg_split_list.pop(0)
-                        parsed = self.parse_message(one_msg)
-                        if parsed:
-                            self.request_queue.put(parsed)
+                    parsed = self.parse_message(one_msg)
+                    if parsed:
+                        self.request_queue.put(parsed)
             except ConnectionAbortedError:
                 print(self.peer_id + " connection aborted")
                 self.request_queue.put({Constant.MESSAGE_TYPE: Constant.VILLAGER_DEAD})
@@ -30,6 +30,8 @@ class AppendEntriesFollower:
         #could be one or more for efficiency, should be a list of log_data_dict
         self.new_entries = append_entries_json_data_dict["new_entries"]
         self.leader_commit_index = int(append_entries_json_data_dict["leader_commit_index"])
+        # older leaders do not send it
+        self.read_round = int(append_entries_json_data_dict.get("read_round", 0))
         #first => addr, second => port
         self.send_from = tuple(append_entries_json_data_dict["send_from"])
         self.send_to = tuple(append_entries_json_data_dict["send_to"])
@@ -43,6 +45,14 @@ class AppendEntriesFollower:
 
         result = {"log_index_start": log_index_start,
                   "log_index_end": log_index_end,
+                  # leader uses it to drop the outdated replies
+                  "prev_log_index": self.prev_log_index,
+                  # when rejected because of the log, leader jumps next index with these two
+                  # instead of decreasing it one by one
+                  "conflict_term": -1,
+                  "conflict_index": -1,
+                  # accepted or not, the reply tells the leader it is still the leader at this round
+                  "read_round": self.read_round,
                   "send_from": list(self.raft_peer_state.my_addr_port_tuple),
                   "send_to": list(self.send_from),
                   "sender_term": self.raft_peer_state.current_term,
@@ -67,18 +77,25 @@ class AppendEntriesFollower:
 
 
         #leader's prev log term does not match with follower's last entry's term
-        if self.prev_log_index != -1:
+        # logs inside the snapshot are committed so they always match the leader's
+        if self.prev_log_index >= self.raft_peer_state.snapshot_last_index:
             # prevent peer restart get into this if and get false back
-            if (len(self.raft_peer_state.state_log) - 1) < self.prev_log_index:
+            if self.raft_peer_state.last_log_index() < self.prev_log_index:
                 result["append_entries_result"] = False
+                result["conflict_index"] = self.raft_peer_state.log_length()
                 return result
 
-            if (self.raft_peer_state.state_log[self.prev_log_index].log_term != self.prev_log_term):
+            if (self.raft_peer_state.get_log_term(self.prev_log_index) != self.prev_log_term):
                 result["append_entries_result"] = False
+                # skip the whole conflicting term, it can not match the leader's log
+                result["conflict_term"] = self.raft_peer_state.get_log_term(self.prev_log_index)
+                result["conflict_index"] = max(self.raft_peer_state.first_index_of_term(result["conflict_term"]),
+                                               self.raft_peer_state.snapshot_last_index + 1)
                 return result
 
         if len(self.new_entries) == 0:
-            self.process_commit_index(self.leader_commit_index)
+            # only logs up to prev log are known to match the leader's
+            self.process_commit_index(min(self.leader_commit_index, self.prev_log_index))
             return result
 
         result["log_index_start"] = log_index_start
@@ -92,7 +109,7 @@ class AppendEntriesFollower:
 
         # self.raft_peer_state.commit_index = self.leader_commit_index
 
-        self.process_commit_index(self.leader_commit_index)
+        self.process_commit_index(min(self.leader_commit_index, log_index_end))
 
 
         return result
@@ -103,27 +120,26 @@ class AppendEntriesFollower:
             one_new_log_data = LogData(one_new_log["log_index"],
                                        one_new_log["log_term"],
                                        one_new_log["request_command_action_list"])
-            #if follower is not longer than leader
-            if prev_log_index == (len(self.raft_peer_state.state_log) - 1):
-                self.raft_peer_state.state_log.append(one_new_log_data)
+            # already compacted into snapshot
+            if one_new_log_data.log_index <= self.raft_peer_state.snapshot_last_index:
                 prev_log_index += 1
+                continue
             #if follower id longer, it can be shorter bc of above filter
-            else:
-                self.raft_peer_state.state_log[prev_log_index + 1] = one_new_log_data
-                # self.raft_peer_state.state_log = self.raft_peer_state.state_log[0:prev_log_index + 2]
-                prev_log_index += 1
+            if prev_log_index < self.raft_peer_state.last_log_index():
+                # same index and term means same log, keep ours so it is not applied twice
+                if self.raft_peer_state.get_log_term(prev_log_index + 1) == one_new_log_data.log_term:
+                    prev_log_index += 1
+                    continue
+                # conflict with leader, delete this log and all that follow it
+                self.raft_peer_state.truncate_log(prev_log_index + 1)
+            self.raft_peer_state.append_log(one_new_log_data)
+            prev_log_index += 1
 
     def process_commit_index(self, commit_index):
-        if (commit_index == -1):
-            return
-        # [include: exclude]
-        for one_log_data in self.raft_peer_state.state_log[0:commit_index+1]:
-            if one_log_data.log_applied == False:
-                self.json_message_commit_queue.put(one_log_data)
-                # self.raft_peer_state.remote_var.perform_action(one_log_data.request_command_action_list)
-                # one_log_data.log_applied = True
-        # self.raft_peer_state.last_apply = commit_index
-        # self.commit_index = commit_index
+        # only the logs in (commit_index, new commit_index] are handed to the commit thread,
+        # so heartbeat costs nothing when commit index does not move
+        for one_log_data in self.raft_peer_state.advance_commit_index(commit_index):
+            self.json_message_commit_queue.put(one_log_data)
 
     def __str__(self):
         return str(vars(self))
@@ -17,7 +17,8 @@ logger = logging.getLogger("AppendEntiesLeader")
 class AppendEntriesLeader:
     # for leader to initialize appen entry
     # assume add entry frist to raft_peer_state then create this obj
-    def __init__(self, raft_peer_state, send_to_addr_port_tuple, type = "append"):
+    # max_entries and max_bytes bound the size of one append entries, None means no limit
+    def __init__(self, raft_peer_state, send_to_addr_port_tuple, type = "append", max_entries = None, max_bytes = None):
         self.msg_type = "append_entries_leader"
         # self.raft_peer_state = raft_peer_state
         # self.append_entries_type = "leader_send"
@@ -28,7 +29,7 @@ class AppendEntriesLeader:
         if raft_peer_state.peers_next_index[send_to_addr_port_tuple] >= 1:
             # next index is the peer's next slot to store newest entry
             self.prev_log_index = raft_peer_state.peers_next_index[send_to_addr_port_tuple] - 1
-            self.prev_log_term = raft_peer_state.state_log[self.prev_log_index].log_term
+            self.prev_log_term = raft_peer_state.get_log_term(self.prev_log_index)
         else:
             #init state
             self.prev_log_index = -1
@@ -36,13 +37,32 @@ class AppendEntriesLeader:
         # could be one or more for efficiency
         if type == "append":
             # now only add one
-            self.new_entries = raft_peer_state.state_log[raft_peer_state.peers_next_index[send_to_addr_port_tuple]:len(raft_peer_state.state_log)]
+            next_index = raft_peer_state.peers_next_index[send_to_addr_port_tuple]
+            end_index = raft_peer_state.log_length()
+            if max_entries is not None:
+                end_index = min(end_index, next_index + max_entries)
+            self.new_entries = raft_peer_state.get_logs(next_index, end_index)
+            if max_bytes is not None:
+                self.new_entries = self.limit_entries_size(self.new_entries, max_bytes)
         elif type == "heartbeat":
             self.new_entries = []
         self.leader_commit_index = raft_peer_state.commit_index
+        # followers point users here
+        self.leader_user_addr = list(raft_peer_state.my_user_addr_port_tuple)
+        # echoed by the follower, confirms leadership for the reads waiting on this round
+        self.read_round = raft_peer_state.read_round
         self.send_from = list(raft_peer_state.my_addr_port_tuple)
         self.send_to = list(send_to_addr_port_tuple)
 
+    def limit_entries_size(self, new_entries, max_bytes):
+        # always keep the first log, otherwise a log bigger than max_bytes could never be sent
+        total_size = 0
+        for index, one_log in enumerate(new_entries):
+            total_size += one_log.estimate_encoded_size()
+            if total_size > max_bytes and index > 0:
+                return new_entries[0:index]
+        return new_entries
+
     def __str__(self):
         return str(vars(self))
 
@@ -0,0 +1,198 @@
+"""
+
+
+This is the asyncio version of RaftClient, for programs running on an
+event loop. Commands return asyncio futures right away and are written to
+the leader's stream without waiting for the earlier ones to be answered.
+
+    raft_client = AsyncRaftClient([("localhost", 20001), ("localhost", 20002)])
+    results = await asyncio.gather(*[raft_client.request_command(["x", "add", 1]) for i in range(1000)])
+    print(await raft_client.read_command("x"))
+    raft_client.close()
+
+Like RaftClient, commands are sent in a client session so a command resent
+after a leader change is applied only once.
+
+
+"""
+
+import asyncio
+import itertools
+import json
+import logging
+import uuid
+from collections import OrderedDict
+
+from FrameReader import FrameReader
+
+logger = logging.getLogger("AsyncRaftClient")
+
+
+class AsyncRaftClient:
+    # seconds to wait before asking the next peer when nobody knows the leader
+    retry_interval = 0.2
+    connect_timeout = 2
+
+    def __init__(self, servers_addr_port_list):
+        self.servers_addr_port_list = [(str(host), int(port)) for host, port in servers_addr_port_list]
+        self.server_index = -1
+        self.my_detail = {"host": "random host", "port": "random port", "peer_id": "async_raft_client"}
+        # commands are sent in a client session, the leader skips the ones retried after they are applied
+        self.client_id = uuid.uuid4().hex
+        self.request_ids = itertools.count(1)
+        # request_id => [asyncio.Future, message dict, stream writer it was sent on or None]
+        self.pending_requests = OrderedDict()
+        self.leader_writer = None
+        # asyncio.Task looking for the leader, None when connected or idle
+        self.connect_task = None
+        self.closed = False
+
+    def request_command(self, request_command_list):
+        """
+
+        ask the leader to perform [var_name, action, action_param]
+
+        :param request_command_list: list
+        :return: asyncio.Future, the value of the variable after the command is applied
+        """
+        return self.submit({"msg_type": "request_command", "request_command_list": list(request_command_list),
+                            "client_id": self.client_id})
+
+    def read_command(self, var_name):
+        """
+
+        read one variable from the leader without adding a log
+
+        :param var_name: str
+        :return: asyncio.Future, the value of the variable or None if it was never set
+        """
+        return self.submit({"msg_type": "read_command", "read_command_list": [str(var_name)]})
+
+    def submit(self, json_data_dict):
+        if self.closed:
+            raise ConnectionError("raft client is closed")
+        future = asyncio.get_running_loop().create_future()
+        request_id = next(self.request_ids)
+        json_data_dict["request_id"] = request_id
+        self.pending_requests[request_id] = [future, json_data_dict, None]
+        # a failed write closes the transport before the reader sees the connection is lost
+        if self.leader_writer is not None and self.leader_writer.is_closing():
+            self.switch_leader(self.leader_writer, None)
+        if self.leader_writer is not None:
+            self.send_requests([request_id])
+        else:
+            self.start_connecting(None, 0)
+        return future
+
+    def close(self):
+        self.closed = True
+        if self.leader_writer is not None:
+            self.leader_writer.close()
+            self.leader_writer = None
+        if self.connect_task is not None:
+            self.connect_task.cancel()
+        for future, json_data_dict, sent_writer in self.pending_requests.values():
+            if not future.done():
+                future.set_exception(ConnectionError("raft client is closed"))
+        self.pending_requests = OrderedDict()
+
+    def send_requests(self, request_ids):
+        frames = []
+        sockname = list(self.leader_writer.get_extra_info("sockname")[0:2])
+        peername = list(self.leader_writer.get_extra_info("peername")[0:2])
+        for request_id in request_ids:
+            one_request = self.pending_requests.get(request_id)
+            if one_request is None or one_request[2] is not None:
+                continue
+            one_request[2] = self.leader_writer
+            one_request[1]["send_from"] = sockname
+            one_request[1]["send_to"] = peername
+            if "client_id" in one_request[1]:
+                one_request[1]["client_seq"] = request_id
+                # pending requests are kept in request_id order, everything before the first one is answered
+                one_request[1]["client_ack_seq"] = next(iter(self.pending_requests)) - 1
+            frames.append(json.dumps(one_request[1]) + "\n")
+        # buffered by the transport, a lost connection is noticed by the reader
+        self.leader_writer.write(str.encode("".join(frames), "utf-8"))
+
+    def start_connecting(self, leader_hint, delay):
+        if self.connect_task is None or self.connect_task.done():
+            self.connect_task = asyncio.ensure_future(self.connect_to_leader(leader_hint, delay))
+
+    async def connect_to_leader(self, leader_hint, delay):
+        """
+        connect to the hinted leader, or to the peers in turn until one accepts,
+        then send every command that is not answered yet
+
+        :param leader_hint: [host, port] or None
+        :param delay: float, seconds to wait first
+        """
+        await asyncio.sleep(delay)
+        while not self.closed:
+            if leader_hint is not None:
+                candidate_addr_port_tuples = [(str(leader_hint[0]), int(leader_hint[1]))]
+                leader_hint = None
+            else:
+                candidate_addr_port_tuples = []
+            # the peers in turn, starting after the one connected last time
+            server_number = len(self.servers_addr_port_list)
+            candidate_addr_port_tuples += [self.servers_addr_port_list[(self.server_index + i) % server_number]
+                                           for i in range(1, server_number + 1)]
+            for one_addr_port_tuple in candidate_addr_port_tuples:
+                try:
+                    leader_reader, leader_writer = await asyncio.wait_for(
+                        asyncio.open_connection(*one_addr_port_tuple, limit=FrameReader.max_buffer_size),
+                        self.connect_timeout)
+                except (OSError, asyncio.TimeoutError) as e:
+                    logger.debug(" unable to connect " + str(one_addr_port_tuple) + " " + str(e),
+                                 extra=self.my_detail)
+                    continue
+                self.leader_writer = leader_writer
+                if one_addr_port_tuple in self.servers_addr_port_list:
+                    self.server_index = self.servers_addr_port_list.index(one_addr_port_tuple)
+                asyncio.ensure_future(self.receive_from_leader(leader_reader, leader_writer))
+                logger.debug(" connected to " + str(one_addr_port_tuple), extra=self.my_detail)
+                self.send_requests([request_id for request_id, one_request in self.pending_requests.items()
+                                    if one_request[2] is None])
+                return
+            await asyncio.sleep(self.retry_interval)
+
+    def switch_leader(self, old_leader_writer, leader_hint):
+        """
+
+        leave the peer that is not the leader, everything not answered on it is sent again
+        once the next connection is up, only the first failure of a connection does it
+
+        :param old_leader_writer: asyncio.StreamWriter
+        :param leader_hint: [host, port] or None
+        """
+        if self.leader_writer is not old_leader_writer or self.closed:
+            return
+        old_leader_writer.close()
+        self.leader_writer = None
+        for one_request in self.pending_requests.values():
+            if one_request[2] is old_leader_writer:
+                one_request[2] = None
+        # nobody knows the leader, an election is going on
+        self.start_connecting(leader_hint, self.retry_interval if leader_hint is None else 0)
+
+    async def receive_from_leader(self, leader_reader, leader_writer):
+        try:
+            while True:
+                one_line = await leader_reader.readuntil(b"\n")
+                self.process_one_reply(leader_writer, json.loads(one_line.decode("utf-8")))
+        except (OSError, ValueError, asyncio.IncompleteReadError, asyncio.LimitOverrunError) as e:
+            logger.debug(" leader connection closed " + str(e), extra=self.my_detail)
+        self.switch_leader(leader_writer, None)
+
+    def process_one_reply(self, leader_writer, reply_dict):
+        if reply_dict["msg_type"] == "request_command_reply_batch":
+            for one_reply_dict in reply_dict["replies"]:
+                self.process_one_reply(leader_writer, one_reply_dict)
+            return
+        if reply_dict["command_result"] == "not_leader":
+            self.switch_leader(leader_writer, reply_dict.get("leader_hint"))
+            return
+        one_request = self.pending_requests.pop(reply_dict.get("request_id"), None)
+        if one_request is not None and not one_request[0].done():
+            one_request[0].set_result(reply_dict["command_result"])
@@ -0,0 +1,369 @@
+"""
+
+
+This is the asyncio engine of RaftPeer.
+
+The threaded RaftPeer runs one thread for every accepted socket plus the
+send, receive, commit, connect and timer threads. This class keeps all the
+Raft handlers of RaftPeer and only replaces those threads with coroutines
+of one event loop, so peers, users and the visualization are served by
+streams and a cluster of many peers on one host does not end up with
+hundreds of threads fighting over the GIL.
+
+The frames on the wire are exactly the same as the threaded engine, so
+peers of both engines could be mixed in one cluster.
+
+The event loop is the state loop, so the timer and commit coroutines handle
+their events right away, only StateEvent put by other threads go through
+the receive batch. The logs are still applied in a worker thread.
+
+
+"""
+
+import asyncio
+import logging
+import threading
+
+from JsonCodec import JsonCodec
+from FrameReader import FrameReader
+from LoopQueue import LoopQueue
+from OutboundQueue import OutboundQueue
+from RaftPeer import RaftPeer
+from StateEvent import StateEvent
+
+logger = logging.getLogger("AsyncRaftPeer")
+
+
+class AsyncRaftPeer(RaftPeer):
+    def start_processing_threads(self):
+        """
+        Nothing is started before start_raft_peer, messages put before the event loop
+        runs are kept by the queues.
+
+        """
+        self.loop = None
+        self.thread_event_loop = None
+        self.json_message_commit_queue = LoopQueue()
+        # (function, args) called once the event loop runs
+        self.pending_loop_calls = []
+        # peers to connect once the event loop runs
+        self.connect_peer_addr_port_tuple_list = None
+        # messages read by all the streams since the last batch, handled by one loop callback
+        self.recv_batch = []
+        # the write-ahead log sync running in a worker thread, writers waiting together share it
+        self.wal_sync_future = None
+
+    def start_receive_thread(self, peer_addr_port_tuple):
+        # only the visualization socket comes here, it is turned into a stream once the event loop runs
+        return None
+
+    def start_connect_to_all_peer_thread(self, peer_addr_port_tuple_list):
+        self.connect_peer_addr_port_tuple_list = peer_addr_port_tuple_list
+
+    def start_raft_peer(self):
+        logging.getLogger("asyncio").addFilter(self.add_my_detail_to_log_record)
+        self.thread_event_loop = threading.Thread(target=asyncio.run, args=(self.async_run(),))
+        self.thread_event_loop.daemon = True
+        self.thread_event_loop.start()
+        logger.debug(" start thread => event loop ", extra=self.my_detail)
+
+    def add_my_detail_to_log_record(self, log_record):
+        # records of asyncio itself do not have the peer details the log format needs
+        for key, value in self.my_detail.items():
+            if not hasattr(log_record, key):
+                setattr(log_record, key, value)
+        return True
+
+    async def async_run(self):
+        """
+        Start listening for peers and users, then run the send, commit, timer and connect
+        coroutines forever.
+
+        """
+        self.loop = asyncio.get_running_loop()
+        self.json_message_commit_queue.bind(self.loop)
+        for function, args in self.pending_loop_calls:
+            function(*args)
+        self.pending_loop_calls = []
+
+        await asyncio.start_server(
+            lambda reader, writer: self.async_receive_from_one_stream(
+                tuple(writer.get_extra_info("peername")[:2]), reader, writer, self.peers_addr_listen_socket),
+            sock=self.socket, limit=FrameReader.max_buffer_size)
+        # listen for user.py
+        await asyncio.start_server(
+            lambda reader, writer: self.async_receive_from_one_stream(
+                tuple(writer.get_extra_info("peername")[:2]), reader, writer, self.user_addr_listen_socket),
+            sock=self.user_socket, limit=FrameReader.max_buffer_size)
+
+        if self.visualization_scoket is not None:
+            reader, writer = await asyncio.open_connection(sock=self.visualization_scoket,
+                                                           limit=FrameReader.max_buffer_size)
+            self.visualization_scoket = writer
+            asyncio.ensure_future(self.async_receive_from_one_stream(self.visualization_addr_port_tuple,
+                                                                     reader, writer, None))
+
+        coroutines = [self.async_start_processing_commits(),
+                      self.async_start_time_counter()]
+        if self.connect_peer_addr_port_tuple_list is not None:
+            coroutines.append(self.async_connect_to_all_peer(self.connect_peer_addr_port_tuple_list))
+        await asyncio.gather(*coroutines)
+
+    def put_recv_batch(self, one_recv_json_message_dict):
+        """
+        A stream keeps reading the frames already buffered without giving the loop away, so
+        the callback scheduled by the first message runs after every ready stream added its own.
+
+        :param one_recv_json_message_dict: dict
+        """
+        self.recv_batch.append(one_recv_json_message_dict)
+        if len(self.recv_batch) == 1:
+            self.loop.call_soon(self.process_recv_batch)
+        elif len(self.recv_batch) >= self.max_recv_batch:
+            self.process_recv_batch()
+
+    def process_recv_batch(self):
+        recv_json_messages = self.recv_batch
+        if len(recv_json_messages) == 0:
+            return
+        self.recv_batch = []
+        self.process_recv_json_messages(recv_json_messages)
+
+    def put_state_event(self, event_type, payload=None):
+        # the event loop is the state loop, events from other threads join the next batch
+        self.call_in_loop(self.put_recv_batch, StateEvent(event_type, payload))
+
+    def call_in_loop(self, function, *args):
+        """
+        Call function on the event loop thread, right away if we are already on it.
+
+        :param function: callable
+        """
+        if self.loop is None:
+            self.pending_loop_calls.append((function, args))
+            return
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is self.loop:
+            function(*args)
+        else:
+            self.loop.call_soon_threadsafe(function, *args)
+
+    def create_outbound_writer(self, destination_addr_port_tuple):
+        # the writer task waits on this event instead of the condition of the queue
+        wakeup_event = asyncio.Event()
+        outbound_queue = OutboundQueue(self.outbound_queue_size, lambda: self.call_in_loop(wakeup_event.set))
+        self.call_in_loop(asyncio.ensure_future,
+                          self.async_process_outbound_queue(destination_addr_port_tuple, outbound_queue, wakeup_event))
+        return outbound_queue
+
+    async def async_process_outbound_queue(self, destination_addr_port_tuple, outbound_queue, wakeup_event):
+        """
+
+        Same as process_outbound_queue, the writer waits for the stream to drain after every message,
+        so a slow destination fills its own queue instead of the memory of the transport.
+
+        :param destination_addr_port_tuple: (str, int)
+        :param outbound_queue: OutboundQueue
+        :param wakeup_event: asyncio.Event
+        """
+        while True:
+            one_json_data_dict = outbound_queue.get_nowait()
+            if one_json_data_dict is None:
+                wakeup_event.clear()
+                try:
+                    await asyncio.wait_for(wakeup_event.wait(), self.outbound_writer_idle_timeout)
+                except asyncio.TimeoutError:
+                    # users come and go, stop the writer of anything that is not a peer once it is idle
+                    if destination_addr_port_tuple not in self.peers_addr_client_socket and \
+                            self.json_message_send_queue.remove_if_idle(destination_addr_port_tuple, outbound_queue):
+                        return
+                continue
+            logger.debug(" processing one send message " + str(one_json_data_dict), extra=self.my_detail)
+            # entries and votes must be durable before anyone could see them, send_to_peer finds nothing left to sync
+            try:
+                await self.async_sync_write_ahead_log()
+            except Exception as e:
+                logger.debug(" write ahead log sync failed abort sending " + str(e), extra=self.my_detail)
+                continue
+            peer_socket = self.send_to_peer(destination_addr_port_tuple, one_json_data_dict)
+            if peer_socket is not None:
+                try:
+                    await peer_socket.drain()
+                except ConnectionError:
+                    pass
+
+    async def async_sync_write_ahead_log(self):
+        """
+
+        Same as RaftPeerState.sync_write_ahead_log but the fsync runs in a worker thread, so the
+        event loop keeps going meanwhile. A sync already running may have taken its records before
+        ours were added, so the writer waits until nothing is pending any more.
+
+        """
+        write_ahead_log = self.raft_peer_state.write_ahead_log
+        if write_ahead_log is None:
+            return
+        while True:
+            sync_future = self.wal_sync_future
+            if sync_future is None:
+                if not write_ahead_log.has_pending_records():
+                    return
+                sync_future = self.loop.run_in_executor(None, write_ahead_log.sync)
+                self.wal_sync_future = sync_future
+            try:
+                await sync_future
+            finally:
+                if self.wal_sync_future is sync_future:
+                    self.wal_sync_future = None
+
+    async def async_start_processing_commits(self):
+        while True:
+            # FIFO queue so will always commit from most left
+            one_log = await self.json_message_commit_queue.get()
+            one_pass_logs = self.take_waiting_logs(one_log)
+            # applied in a worker thread, the event loop keeps handling votes and append entries meanwhile,
+            # a failing command only gets an error result, anything else must not end the event loop either
+            try:
+                logs_applied = await self.loop.run_in_executor(None, self.apply_committed_logs, one_pass_logs)
+                self.process_logs_applied(logs_applied)
+            except Exception as e:
+                logger.debug("Error: unable to apply committed logs " + str(e), extra=self.my_detail)
+
+    async def async_start_time_counter(self):
+        """
+        Same as TimeoutCounter.start_time_counter, sleep until the deadline or until it moves earlier.
+
+        """
+        logger.debug(" counter started ", extra=self.my_detail)
+        deadline_moved_event = asyncio.Event()
+        self.timeout_counter.wakeup = lambda: self.call_in_loop(deadline_moved_event.set)
+        self.timeout_counter.reset_timeout()
+        while True:
+            remaining = self.timeout_counter.fire_if_due(self)
+            deadline_moved_event.clear()
+            try:
+                await asyncio.wait_for(deadline_moved_event.wait(), max(remaining, 0))
+            except asyncio.TimeoutError:
+                pass
+
+    async def async_connect_to_all_peer(self, peer_addr_port_tuple_list):
+        """
+
+        Same as connect_to_all_peer, take turns to connect the peers in the list, peers
+        whose stream broke are put back to the list by send_to_peer.
+
+        :param peer_addr_port_tuple_list: list of (str, int)
+        """
+        self.peer_addr_port_tuple_list = peer_addr_port_tuple_list
+        my_peer_addr_port_tuple = (str(self.my_detail['host']), int(self.my_detail['port']))
+        self.peer_addr_port_tuple_list.remove(my_peer_addr_port_tuple)
+        count = -1
+        while True:
+            count += 1
+            if len(self.peer_addr_port_tuple_list) > 0:
+                one_peer_addr, one_peer_port = peer_addr_port_tuple_list[count % len(self.peer_addr_port_tuple_list)]
+            else:
+                await asyncio.sleep(1)
+                continue
+            try:
+                await self.async_connect_to_peer((str(one_peer_addr), int(one_peer_port)))
+                peer_addr_port_tuple_list.remove((one_peer_addr, one_peer_port))
+                print("finished connect to " + str((str(one_peer_addr), int(one_peer_port))))
+            except Exception as e:
+                print("failed connect to " + str((str(one_peer_addr), int(one_peer_port))))
+                await asyncio.sleep(1)
+                continue
+            await asyncio.sleep(1)
+
+    async def async_connect_to_peer(self, peer_addr_port_tuple):
+        logger.debug("raft peer connect to " + str(peer_addr_port_tuple), extra=self.my_detail)
+        reader, writer = await asyncio.open_connection(peer_addr_port_tuple[0], peer_addr_port_tuple[1],
+                                                       limit=FrameReader.max_buffer_size)
+        if self.preferred_wire_codec == JsonCodec.codec_name:
+            self.peers_addr_codec[peer_addr_port_tuple] = self.json_codec
+        else:
+            self.peers_addr_codec[peer_addr_port_tuple] = await self.async_negotiate_wire_codec(reader, writer)
+        self.peers_addr_client_socket[peer_addr_port_tuple] = writer
+        asyncio.ensure_future(self.async_watch_client_stream(peer_addr_port_tuple, reader, writer))
+
+    async def async_negotiate_wire_codec(self, reader, writer):
+        """
+
+        Same as negotiate_wire_codec but on the streams
+
+        :param reader: StreamReader
+        :param writer: StreamWriter
+        :return: JsonCodec or BinaryCodec
+        """
+        try:
+            writer.write(self.json_codec.encode_frame(self.create_codec_hello()))
+            reply = await asyncio.wait_for(reader.readuntil(b"\n"), self.codec_hello_timeout)
+            codec_name = self.json_codec.decode(reply[:-1])["codec"]
+        except Exception as e:
+            logger.debug(" codec_hello not answered use json " + str(e), extra=self.my_detail)
+            codec_name = JsonCodec.codec_name
+        logger.debug(" negotiated wire codec " + str(codec_name), extra=self.my_detail)
+        return self.wire_codecs.get(codec_name, self.json_codec)
+
+    async def async_watch_client_stream(self, peer_addr_port_tuple, reader, writer):
+        # nothing is received on the client stream, closing it makes the next send reconnect
+        try:
+            while await reader.read(FrameReader.min_free_size):
+                pass
+        except ConnectionError:
+            pass
+        logger.debug(" client stream closed by " + str(peer_addr_port_tuple), extra=self.my_detail)
+        writer.close()
+
+    def write_frame(self, peer_socket, serialized_frame):
+        # the StreamWriter keeps the frame until the socket is writable, so this never blocks the loop
+        if peer_socket.is_closing():
+            raise ConnectionResetError("stream closed")
+        peer_socket.write(serialized_frame)
+
+    async def async_read_frame(self, reader, codec):
+        if codec.framing == "newline":
+            return (await reader.readuntil(b"\n"))[:-1]
+        header = await reader.readexactly(FrameReader.frame_length_struct.size)
+        return await reader.readexactly(FrameReader.frame_length_struct.unpack(header)[0])
+
+    async def async_receive_from_one_stream(self, peer_addr_port_tuple, reader, writer, addr_listen_socket):
+        """
+
+        Same as receive_from_one_peer_newline_delimiter but every message is handled right away
+        instead of going through the recv queue.
+
+        :param peer_addr_port_tuple: (str, int)
+        :param reader: StreamReader
+        :param writer: StreamWriter
+        :param addr_listen_socket: dict, peers_addr_listen_socket or user_addr_listen_socket, None for visualization
+        """
+        logger.debug(" recv json_data from " + str(peer_addr_port_tuple), extra=self.my_detail)
+        if addr_listen_socket is not None:
+            addr_listen_socket[peer_addr_port_tuple] = writer
+        # every connection starts with newline JSON, peers switch it with codec_hello
+        codec = self.json_codec
+        while True:
+            try:
+                payload = await self.async_read_frame(reader, codec)
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError) as e:
+                logger.debug(" one listen incoming stream closed " + str(e) + str(peer_addr_port_tuple),
+                             extra=self.my_detail)
+                if addr_listen_socket is not None:
+                    addr_listen_socket.pop(peer_addr_port_tuple, None)
+                writer.close()
+                return
+            try:
+                one_deserialized_json_data = codec.decode(payload)
+            except Exception as e:
+                logger.debug(" deserialization recv data failed " + str(e), extra=self.my_detail)
+                continue
+            if one_deserialized_json_data["msg_type"] == "codec_hello":
+                codec = self.reply_codec_hello(writer, one_deserialized_json_data)
+                continue
+            logger.debug(" put one " + codec.codec_name + " data " + one_deserialized_json_data["msg_type"],
+                         extra=self.my_detail)
+            self.put_recv_batch(one_deserialized_json_data)
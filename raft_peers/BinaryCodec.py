@@ -0,0 +1,262 @@
+"""
+
+
+This is the class to encode and decode the messages between peers in a
+compact binary format.
+
+Every frame is a 4 bytes length followed by the payload. The payload starts
+with the codec version and the message type id, then all the integer and
+boolean fields of the message packed by one fixed struct, then the variable
+fields (strings, addresses and log entries) each prefixed by its length.
+
+Messages that do not match the schema of their type (unknown types or extra
+keys) are still sent, as a JSON payload with type id 0.
+
+Nothing is encoded twice for a broadcast: log entries are encoded once and
+kept by (log_index, log_term) until every follower has them, and the part
+of a message before send_to is reused by the next message of the same type
+that only differs in send_to and the fields after it, so the heartbeats to
+all followers share one encoded body.
+
+
+"""
+
+import json
+import struct
+import threading
+
+from LogData import LogData
+
+
+class BinaryCodec:
+    codec_name = "binary_v1"
+    codec_version = 1
+    # framing used by FrameReader
+    framing = "length_prefix"
+
+    frame_length_struct = struct.Struct("!I")
+    payload_header_struct = struct.Struct("!BB")
+    string_length_struct = struct.Struct("!I")
+    address_struct = struct.Struct("!HH")
+    entry_header_struct = struct.Struct("!qqI")
+
+    json_type_id = 0
+
+    # msg_type => (type id, [(field name, kind)])
+    # kind: q => int64, ? => bool, s => str, a => [host, port], e => log entries
+    message_schemas = {
+        "append_entries_leader": (1, [("sender_term", "q"),
+                                      ("prev_log_index", "q"),
+                                      ("prev_log_term", "q"),
+                                      ("leader_commit_index", "q"),
+                                      ("read_round", "q"),
+                                      ("peer_id", "s"),
+                                      ("leader_user_addr", "a"),
+                                      ("send_from", "a"),
+                                      ("send_to", "a"),
+                                      ("new_entries", "e")]),
+        "append_entries_follower_reply": (2, [("sender_term", "q"),
+                                              ("log_index_start", "q"),
+                                              ("log_index_end", "q"),
+                                              ("prev_log_index", "q"),
+                                              ("conflict_term", "q"),
+                                              ("conflict_index", "q"),
+                                              ("read_round", "q"),
+                                              ("append_entries_result", "?"),
+                                              ("send_from", "a"),
+                                              ("send_to", "a")]),
+        "request_vote": (3, [("sender_term", "q"),
+                             ("last_log_index", "q"),
+                             ("last_log_term", "q"),
+                             ("peer_id", "s"),
+                             ("send_from", "a"),
+                             ("send_to", "a")]),
+        "request_vote_reply": (4, [("sender_term", "q"),
+                                   ("vote_granted", "?"),
+                                   ("peer_id", "s"),
+                                   ("vote_peer_id", "s"),
+                                   ("send_from", "a"),
+                                   ("send_to", "a")]),
+        "install_snapshot": (5, [("sender_term", "q"),
+                                 ("last_included_index", "q"),
+                                 ("last_included_term", "q"),
+                                 ("offset", "q"),
+                                 ("done", "?"),
+                                 ("peer_id", "s"),
+                                 ("send_from", "a"),
+                                 ("send_to", "a"),
+                                 ("data", "s")]),
+        "install_snapshot_reply": (6, [("sender_term", "q"),
+                                       ("last_included_index", "q"),
+                                       ("next_offset", "q"),
+                                       ("done", "?"),
+                                       ("send_from", "a"),
+                                       ("send_to", "a")]),
+    }
+
+    def __init__(self):
+        # msg_type => (type id, fixed struct, fixed field names, variable fields, all field names)
+        self.encoders = {}
+        # type id => (msg_type, fixed struct, fixed field names, variable fields)
+        self.decoders = {}
+        for msg_type, (type_id, fields) in self.message_schemas.items():
+            fixed_fields = [(name, kind) for name, kind in fields if kind in "q?"]
+            variable_fields = [(name, kind) for name, kind in fields if kind not in "q?"]
+            fixed_struct = struct.Struct("!" + "".join(kind for name, kind in fixed_fields))
+            fixed_field_names = [name for name, kind in fixed_fields]
+            all_field_names = set(name for name, kind in fields)
+            all_field_names.add("msg_type")
+            self.encoders[msg_type] = (type_id, fixed_struct, fixed_field_names, variable_fields, all_field_names)
+            self.decoders[type_id] = (msg_type, fixed_struct, fixed_field_names, variable_fields)
+        # msg_type => (values before send_to, their encoded bytes), one slot per type is enough for a broadcast
+        self.shared_prefix_cache = {}
+        # (log_index, log_term) => encoded entry, in the order they are encoded
+        self.entry_cache = {}
+        self.entry_cache_lock = threading.Lock()
+        # entries up to this index are never cached again, every follower has them
+        self.released_log_index = -1
+
+    def encode_frame(self, json_data_dict):
+        """
+
+        turn the message dictionary into one length prefixed binary frame
+
+        :param json_data_dict: dict
+        :return: bytes
+        """
+        payload = None
+        encoder = self.encoders.get(json_data_dict["msg_type"])
+        if encoder is not None and encoder[4] == set(json_data_dict.keys()):
+            try:
+                payload = self.encode_schema_payload(json_data_dict, encoder)
+            except (struct.error, TypeError, ValueError):
+                payload = None
+        if payload is None:
+            payload = self.payload_header_struct.pack(self.codec_version, self.json_type_id) + \
+                      str.encode(json.dumps(json_data_dict, default=self.encode_object), "utf-8")
+        return self.frame_length_struct.pack(len(payload)) + payload
+
+    def encode_schema_payload(self, json_data_dict, encoder):
+        type_id, fixed_struct, fixed_field_names, variable_fields, all_field_names = encoder
+        shared_variable_count = [name for name, kind in variable_fields].index("send_to")
+        shared_values = tuple(json_data_dict[name] for name in fixed_field_names) + \
+                        tuple(tuple(json_data_dict[name]) if kind == "a" else json_data_dict[name]
+                              for name, kind in variable_fields[:shared_variable_count])
+        cached_prefix = self.shared_prefix_cache.get(json_data_dict["msg_type"])
+        if cached_prefix is not None and cached_prefix[0] == shared_values:
+            parts = [cached_prefix[1]]
+        else:
+            parts = [self.payload_header_struct.pack(self.codec_version, type_id),
+                     fixed_struct.pack(*[json_data_dict[name] for name in fixed_field_names])]
+            self.encode_variable_fields(json_data_dict, variable_fields[:shared_variable_count], parts)
+            parts = [b"".join(parts)]
+            self.shared_prefix_cache[json_data_dict["msg_type"]] = (shared_values, parts[0])
+        self.encode_variable_fields(json_data_dict, variable_fields[shared_variable_count:], parts)
+        return b"".join(parts)
+
+    def encode_variable_fields(self, json_data_dict, variable_fields, parts):
+        for name, kind in variable_fields:
+            value = json_data_dict[name]
+            if kind == "s":
+                encoded_string = str.encode(str(value), "utf-8")
+                parts.append(self.string_length_struct.pack(len(encoded_string)))
+                parts.append(encoded_string)
+            elif kind == "a":
+                encoded_host = str.encode(str(value[0]), "utf-8")
+                parts.append(self.address_struct.pack(len(encoded_host), int(value[1])))
+                parts.append(encoded_host)
+            elif kind == "e":
+                parts.append(self.string_length_struct.pack(len(value)))
+                for one_entry in value:
+                    parts.append(self.encode_entry(one_entry))
+
+    def encode_entry(self, one_entry):
+        if isinstance(one_entry, LogData):
+            log_index, log_term, action_list = one_entry.log_index, one_entry.log_term, \
+                                               one_entry.request_command_action_list
+        else:
+            log_index, log_term, action_list = one_entry["log_index"], one_entry["log_term"], \
+                                               one_entry["request_command_action_list"]
+        encoded_entry = self.entry_cache.get((log_index, log_term))
+        if encoded_entry is not None:
+            return encoded_entry
+        encoded_action_list = str.encode(json.dumps(action_list), "utf-8")
+        encoded_entry = self.entry_header_struct.pack(log_index, log_term, len(encoded_action_list)) + \
+                        encoded_action_list
+        with self.entry_cache_lock:
+            if log_index > self.released_log_index:
+                self.entry_cache[(log_index, log_term)] = encoded_entry
+        return encoded_entry
+
+    def release_entries(self, log_index):
+        """
+
+        drop the cached entries up to log_index, every follower has them
+
+        :param log_index: int
+        """
+        with self.entry_cache_lock:
+            if log_index <= self.released_log_index:
+                return
+            self.released_log_index = log_index
+            # mostly encoded in index order, one left behind is dropped by a later release
+            while len(self.entry_cache) > 0:
+                oldest_key = next(iter(self.entry_cache))
+                if oldest_key[0] > log_index:
+                    break
+                del self.entry_cache[oldest_key]
+
+    def encode_object(self, one_object):
+        # only used by the JSON payload, LogData is sent as its wire fields
+        if isinstance(one_object, LogData):
+            return {"log_index": one_object.log_index,
+                    "log_term": one_object.log_term,
+                    "request_command_action_list": one_object.request_command_action_list}
+        if isinstance(one_object, tuple):
+            return list(one_object)
+        raise TypeError(str(type(one_object)) + " is not serializable")
+
+    def decode(self, payload):
+        """
+
+        turn one binary payload back into the message dictionary
+
+        :param payload: bytes or memoryview
+        :return: dict
+        """
+        version, type_id = self.payload_header_struct.unpack_from(payload, 0)
+        position = self.payload_header_struct.size
+        if version != self.codec_version:
+            raise ValueError("unsupported binary codec version " + str(version))
+        if type_id == self.json_type_id:
+            return json.loads(bytes(payload[position:]).decode("utf-8"))
+
+        msg_type, fixed_struct, fixed_field_names, variable_fields = self.decoders[type_id]
+        json_data_dict = dict(zip(fixed_field_names, fixed_struct.unpack_from(payload, position)))
+        json_data_dict["msg_type"] = msg_type
+        position += fixed_struct.size
+        for name, kind in variable_fields:
+            if kind == "s":
+                string_length = self.string_length_struct.unpack_from(payload, position)[0]
+                position += self.string_length_struct.size
+                json_data_dict[name] = bytes(payload[position:position + string_length]).decode("utf-8")
+                position += string_length
+            elif kind == "a":
+                host_length, port = self.address_struct.unpack_from(payload, position)
+                position += self.address_struct.size
+                json_data_dict[name] = [bytes(payload[position:position + host_length]).decode("utf-8"), port]
+                position += host_length
+            elif kind == "e":
+                entry_count = self.string_length_struct.unpack_from(payload, position)[0]
+                position += self.string_length_struct.size
+                new_entries = []
+                for i in range(entry_count):
+                    log_index, log_term, action_list_length = self.entry_header_struct.unpack_from(payload, position)
+                    position += self.entry_header_struct.size
+                    new_entries.append({"log_index": log_index,
+                                        "log_term": log_term,
+                                        "request_command_action_list": json.loads(
+                                            bytes(payload[position:position + action_list_length]).decode("utf-8"))})
+                    position += action_list_length
+                json_data_dict[name] = new_entries
+        return json_data_dict
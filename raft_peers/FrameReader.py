@@ -0,0 +1,113 @@
+"""
+
+
+This is the class to receive frames from one socket.
+
+Bytes are received with recv_into straight into one reusable bytearray and
+frames are handed out as memoryview slices of it, so received bytes are
+never copied into a string and bytes already scanned for the delimiter
+are never scanned again. Only the incomplete tail is moved to the front
+when the buffer runs out of room, and the buffer grows when a frame does
+not fit or the socket keeps filling it.
+
+Frames are either newline delimited (JSON) or prefixed by their 4 bytes
+length (binary), the framing could be switched between two frames.
+
+
+"""
+
+import struct
+
+
+class FrameReader:
+    frame_length_struct = struct.Struct("!I")
+    # do not call recv_into with less free room than this
+    min_free_size = 4096
+    max_buffer_size = 4 * 1024 * 1024
+
+    def __init__(self, peer_socket, framing="newline", buffer_size=64 * 1024):
+        self.peer_socket = peer_socket
+        # "newline" or "length_prefix"
+        self.framing = framing
+        self.buffer = bytearray(buffer_size)
+        self.buffer_view = memoryview(self.buffer)
+        # [frame_start, data_end) are received bytes not handed out yet
+        self.frame_start = 0
+        self.data_end = 0
+        # newline framing, bytes in [frame_start, scan_position) have no newline
+        self.scan_position = 0
+        # length prefix framing, size the buffer needs to hold the current frame
+        self.required_size = 0
+
+    def set_framing(self, framing):
+        self.framing = framing
+        self.scan_position = self.frame_start
+        self.required_size = 0
+
+    def read_frames(self):
+        """
+
+        receive once from the socket and yield every complete frame as a memoryview,
+        a frame is only valid until the next call, the framing could be changed while
+        iterating and the rest of the frames follow the new framing
+
+        """
+        self.make_room()
+        received_size = self.peer_socket.recv_into(self.buffer_view[self.data_end:])
+        # remote closed the connection
+        if received_size == 0:
+            raise ConnectionResetError("connection closed by remote")
+        self.data_end += received_size
+        # socket filled all the room we gave it, use a bigger buffer next time
+        if self.data_end == len(self.buffer) and len(self.buffer) < self.max_buffer_size:
+            self.required_size = max(self.required_size, len(self.buffer) * 2)
+        while True:
+            payload = self.next_frame()
+            if payload is None:
+                return
+            yield payload
+
+    def next_frame(self):
+        if self.framing == "newline":
+            frame_end = self.buffer.find(b"\n", self.scan_position, self.data_end)
+            if frame_end == -1:
+                self.scan_position = self.data_end
+                return None
+            payload = self.buffer_view[self.frame_start:frame_end]
+            self.frame_start = frame_end + 1
+            self.scan_position = self.frame_start
+            return payload
+
+        header_size = self.frame_length_struct.size
+        if self.data_end - self.frame_start < header_size:
+            return None
+        payload_length = self.frame_length_struct.unpack_from(self.buffer, self.frame_start)[0]
+        payload_start = self.frame_start + header_size
+        if self.data_end - payload_start < payload_length:
+            self.required_size = max(self.required_size, header_size + payload_length)
+            return None
+        self.frame_start = payload_start + payload_length
+        self.scan_position = self.frame_start
+        return self.buffer_view[payload_start:self.frame_start]
+
+    def make_room(self):
+        # everything handed out, start from the front again without copying anything
+        if self.frame_start == self.data_end:
+            self.frame_start = self.data_end = self.scan_position = 0
+        pending_size = self.data_end - self.frame_start
+        needed_size = max(self.required_size, pending_size + self.min_free_size)
+        if needed_size > len(self.buffer):
+            # new buffer instead of resizing, frames handed out earlier still point to the old one
+            new_buffer = bytearray(max(needed_size, len(self.buffer) * 2))
+            new_buffer[0:pending_size] = self.buffer_view[self.frame_start:self.data_end]
+            self.buffer = new_buffer
+            self.buffer_view = memoryview(self.buffer)
+        elif len(self.buffer) - self.data_end < self.min_free_size:
+            # move only the incomplete tail to the front
+            self.buffer[0:pending_size] = self.buffer[self.frame_start:self.data_end]
+        else:
+            return
+        self.scan_position -= self.frame_start
+        self.frame_start = 0
+        self.data_end = pending_size
+        self.required_size = 0
@@ -0,0 +1,71 @@
+"""
+
+
+This is the class to process the install_snapshot chunks from the leader
+
+
+
+"""
+
+import logging
+from Snapshot import Snapshot
+
+logger = logging.getLogger("InstallSnapshotFollower")
+
+
+class InstallSnapshotFollower:
+    # for follower to receive it
+    def __init__(self, install_snapshot_json_data_dict, raft_peer_state):
+        self.raft_peer_state = raft_peer_state
+        self.host_port_dict = {"host": str(raft_peer_state.my_addr_port_tuple[0]),
+                               "port": str(raft_peer_state.my_addr_port_tuple[1]),
+                               "peer_id": str(raft_peer_state.peer_id)}
+        self.leader_term = install_snapshot_json_data_dict["sender_term"]
+        self.last_included_index = int(install_snapshot_json_data_dict["last_included_index"])
+        self.last_included_term = int(install_snapshot_json_data_dict["last_included_term"])
+        self.offset = int(install_snapshot_json_data_dict["offset"])
+        self.data = install_snapshot_json_data_dict["data"]
+        self.done = install_snapshot_json_data_dict["done"]
+        self.send_from = tuple(install_snapshot_json_data_dict["send_from"])
+
+    # for follower to process received chunk and return result as dict
+    def process_install_snapshot(self):
+        result = {"last_included_index": self.last_included_index,
+                  "next_offset": 0,
+                  "done": False,
+                  "send_from": list(self.raft_peer_state.my_addr_port_tuple),
+                  "send_to": list(self.send_from),
+                  "sender_term": self.raft_peer_state.current_term,
+                  "msg_type": "install_snapshot_reply"}
+
+        # this peer already applied everything in the snapshot, no need to transfer it
+        if self.last_included_index <= self.raft_peer_state.last_apply:
+            result["done"] = True
+            return result
+
+        incoming_snapshot = self.raft_peer_state.incoming_snapshot
+        # leader compacted again, or a new leader sends its own snapshot which could be encoded differently,
+        # drop what we have received, a chunk resent by the same leader (even the first one) is only a duplicate
+        if incoming_snapshot is None or incoming_snapshot.last_included_index != self.last_included_index or \
+                incoming_snapshot.last_included_term != self.last_included_term or \
+                incoming_snapshot.sender_term != self.leader_term:
+            incoming_snapshot = Snapshot(self.last_included_index, self.last_included_term)
+            incoming_snapshot.sender_term = self.leader_term
+            self.raft_peer_state.incoming_snapshot = incoming_snapshot
+
+        if not incoming_snapshot.add_chunk(self.offset, self.data):
+            logger.debug(" unexpected chunk offset " + str(self.offset) + " expect " +
+                         str(incoming_snapshot.received_size), extra=self.host_port_dict)
+        elif self.done:
+            incoming_snapshot.finish_receiving()
+            self.raft_peer_state.install_snapshot(incoming_snapshot)
+            self.raft_peer_state.incoming_snapshot = None
+            result["done"] = True
+            logger.debug(" snapshot installed " + str(incoming_snapshot), extra=self.host_port_dict)
+            return result
+
+        result["next_offset"] = incoming_snapshot.received_size
+        return result
+
+    def __str__(self):
+        return str({key: value for key, value in vars(self).items() if key != "data"})
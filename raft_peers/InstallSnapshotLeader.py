@@ -0,0 +1,34 @@
+"""
+
+
+This is the class to create the install_snapshot chunk for followers
+whose next index is already compacted into the leader's snapshot.
+
+
+
+"""
+import logging
+
+logger = logging.getLogger("InstallSnapshotLeader")
+
+
+class InstallSnapshotLeader:
+    # for leader to initialize one chunk of its current snapshot
+    def __init__(self, raft_peer_state, send_to_addr_port_tuple, chunk_size):
+        self.msg_type = "install_snapshot"
+        self.sender_term = raft_peer_state.current_term
+        self.peer_id = raft_peer_state.peer_id
+        snapshot = raft_peer_state.snapshot
+        self.last_included_index = snapshot.last_included_index
+        self.last_included_term = snapshot.last_included_term
+        # byte offset of this chunk in the encoded snapshot
+        self.offset = raft_peer_state.peers_snapshot_offset.get(send_to_addr_port_tuple, 0)
+        self.data, self.done = snapshot.get_chunk(self.offset, chunk_size)
+        self.send_from = list(raft_peer_state.my_addr_port_tuple)
+        self.send_to = list(send_to_addr_port_tuple)
+
+    def __str__(self):
+        return str({key: value for key, value in vars(self).items() if key != "data"})
+
+    def return_instance_vars_in_dict(self):
+        return vars(self)
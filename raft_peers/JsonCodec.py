@@ -0,0 +1,35 @@
+"""
+
+
+This is the class to encode and decode the messages as newline delimited
+JSON, it is the original wire format of this Raft and is always used for
+User.py and the visualization. Between peers it is the fallback when the
+binary codec is not negotiated, and it is handy for debugging since every
+message is readable.
+
+
+"""
+
+import json
+
+import jsonpickle
+
+
+class JsonCodec:
+    codec_name = "json"
+    # framing used by FrameReader
+    framing = "newline"
+
+    def encode_frame(self, json_data_dict):
+        """
+
+        turn dictionary into one newline terminated JSON frame, jsonpickle will
+        automatically serialize the objects in the dictionary
+
+        :param json_data_dict: dict
+        :return: bytes
+        """
+        return str.encode(jsonpickle.encode(json_data_dict) + "\n", "utf-8")
+
+    def decode(self, payload):
+        return json.loads(bytes(payload).decode("utf-8"))
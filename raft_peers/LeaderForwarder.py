@@ -0,0 +1,177 @@
+"""
+
+
+This is the class a follower uses to forward the user commands it can not
+answer to the leader, through the leader's user port like any other user,
+and relay the replies back. A user connected to any peer gets its answer
+without looking for the leader itself.
+
+Every forwarded message gets a forward id as its request_id, the leader
+echoes it in the reply and the user's own request_id is put back before
+the reply is relayed. Forwards waiting on a connection that is closed, or
+on a leader that could not be reached, are answered with not_leader.
+
+
+"""
+
+import itertools
+import json
+import logging
+import socket
+import threading
+from queue import Queue
+
+from FrameReader import FrameReader
+
+logger = logging.getLogger("LeaderForwarder")
+
+
+class LeaderForwarder:
+    def __init__(self, relay_reply, my_detail):
+        # relay_reply(user_addr_port_tuple, reply_dict) sends the reply to the user who sent the command
+        self.relay_reply = relay_reply
+        self.my_detail = my_detail
+        self.lock = threading.Lock()
+        self.forward_ids = itertools.count(1)
+        # forward id => [user addr, user's request_id, reply msg_type, socket it was sent on or None]
+        self.pending_forwards = {}
+        # (leader user addr, forward id, message), only the writer thread touches the connection
+        self.forward_queue = Queue()
+        self.leader_addr_port_tuple = None
+        self.leader_socket = None
+        self.thread_forward = threading.Thread(target=self.process_forward_queue)
+        self.thread_forward.daemon = True
+        self.thread_forward.start()
+
+    def forward(self, json_data_dict, user_addr_port_tuple, leader_addr_port_tuple):
+        """
+
+        queue the user's message for the leader, it never blocks on the network
+
+        :param json_data_dict: dict, request_command or read_command
+        :param user_addr_port_tuple: (str, int)
+        :param leader_addr_port_tuple: (str, int), leader's user port
+        """
+        forwarded_dict = dict(json_data_dict)
+        with self.lock:
+            forward_id = next(self.forward_ids)
+            self.pending_forwards[forward_id] = [user_addr_port_tuple, json_data_dict.get("request_id"),
+                                                 json_data_dict["msg_type"] + "_reply", None]
+        forwarded_dict["request_id"] = forward_id
+        # a peer with an outdated leader never forwards it again, so it could not go round in circles
+        forwarded_dict["forwarded"] = True
+        self.forward_queue.put((leader_addr_port_tuple, forward_id, forwarded_dict))
+
+    def process_forward_queue(self):
+        while True:
+            leader_addr_port_tuple, forward_id, forwarded_dict = self.forward_queue.get()
+            if leader_addr_port_tuple != self.leader_addr_port_tuple or self.leader_socket is None:
+                self.connect_to_leader(leader_addr_port_tuple)
+            if self.leader_socket is None:
+                self.fail_forwards(lambda one_forward_id, one_pending: one_forward_id == forward_id)
+                continue
+            with self.lock:
+                if forward_id in self.pending_forwards:
+                    self.pending_forwards[forward_id][3] = self.leader_socket
+            try:
+                forwarded_dict["send_from"] = list(self.leader_socket.getsockname())
+                forwarded_dict["send_to"] = list(self.leader_socket.getpeername())
+                self.leader_socket.sendall(str.encode(json.dumps(forwarded_dict) + "\n", "utf-8"))
+            except OSError as e:
+                logger.debug(" forward to leader failed " + str(e), extra=self.my_detail)
+                self.close_leader_socket()
+                self.fail_forwards(lambda one_forward_id, one_pending: one_forward_id == forward_id)
+
+    def connect_to_leader(self, leader_addr_port_tuple):
+        self.close_leader_socket()
+        self.leader_addr_port_tuple = leader_addr_port_tuple
+        try:
+            leader_socket = socket.create_connection(leader_addr_port_tuple)
+        except OSError as e:
+            logger.debug(" unable to connect leader " + str(leader_addr_port_tuple) + " " + str(e),
+                         extra=self.my_detail)
+            return
+        self.leader_socket = leader_socket
+        thread_receive = threading.Thread(target=self.receive_from_leader,
+                                          args=(leader_socket,))
+        thread_receive.daemon = True
+        thread_receive.start()
+        logger.debug(" connected to leader " + str(leader_addr_port_tuple), extra=self.my_detail)
+
+    def close_leader_socket(self):
+        if self.leader_socket is None:
+            return
+        try:
+            self.leader_socket.shutdown(socket.SHUT_RDWR)
+            self.leader_socket.close()
+        except OSError:
+            pass
+        self.leader_socket = None
+
+    def receive_from_leader(self, leader_socket):
+        frame_reader = FrameReader(leader_socket)
+        try:
+            while True:
+                for payload in frame_reader.read_frames():
+                    self.relay_one_reply(json.loads(bytes(payload).decode("utf-8")))
+        except (OSError, ValueError) as e:
+            logger.debug(" leader connection closed " + str(e), extra=self.my_detail)
+        # nothing more comes back on this connection
+        self.fail_forwards(lambda one_forward_id, one_pending: one_pending[3] is leader_socket)
+
+    def relay_one_reply(self, reply_dict):
+        if reply_dict["msg_type"] == "request_command_reply_batch":
+            self.relay_reply_batch(reply_dict)
+            return
+        with self.lock:
+            one_pending = self.pending_forwards.pop(reply_dict.get("request_id"), None)
+        if one_pending is None:
+            return
+        user_addr_port_tuple, request_id, reply_msg_type, leader_socket = one_pending
+        reply_dict.pop("request_id")
+        if request_id is not None:
+            reply_dict["request_id"] = request_id
+        self.relay_reply(user_addr_port_tuple, reply_dict)
+
+    def relay_reply_batch(self, reply_dict):
+        """
+
+        the leader batches the replies of all forwards from this peer, they are split
+        by user and each user gets its own replies in one batch again
+
+        :param reply_dict: dict, request_command_reply_batch
+        """
+        user_replies = {}
+        with self.lock:
+            for one_reply_dict in reply_dict["replies"]:
+                one_pending = self.pending_forwards.pop(one_reply_dict.get("request_id"), None)
+                if one_pending is None:
+                    continue
+                user_addr_port_tuple, request_id, reply_msg_type, leader_socket = one_pending
+                one_reply_dict.pop("request_id")
+                if request_id is not None:
+                    one_reply_dict["request_id"] = request_id
+                user_replies.setdefault(user_addr_port_tuple, []).append(one_reply_dict)
+        for user_addr_port_tuple, one_user_replies in user_replies.items():
+            if len(one_user_replies) == 1:
+                self.relay_reply(user_addr_port_tuple, one_user_replies[0])
+            else:
+                self.relay_reply(user_addr_port_tuple, {"msg_type": "request_command_reply_batch",
+                                                        "replies": one_user_replies})
+
+    def fail_forwards(self, is_failed):
+        """
+
+        answer not_leader to the forwards is_failed(forward id, pending forward) picks
+
+        :param is_failed: function
+        """
+        with self.lock:
+            failed_forward_ids = [one_forward_id for one_forward_id, one_pending in self.pending_forwards.items()
+                                  if is_failed(one_forward_id, one_pending)]
+            failed_forwards = [self.pending_forwards.pop(one_forward_id) for one_forward_id in failed_forward_ids]
+        for user_addr_port_tuple, request_id, reply_msg_type, leader_socket in failed_forwards:
+            reply_dict = {"msg_type": reply_msg_type, "command_result": "not_leader"}
+            if request_id is not None:
+                reply_dict["request_id"] = request_id
+            self.relay_reply(user_addr_port_tuple, reply_dict)
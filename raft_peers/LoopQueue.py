@@ -0,0 +1,61 @@
+"""
+
+
+This is the class to replace the thread safe Queue in the asyncio engine,
+the Raft handlers keep calling put() without knowing which engine runs them
+and the coroutines of the event loop await get().
+
+Items put before the event loop starts are kept and handed to the loop
+once it is bound.
+
+
+"""
+
+import asyncio
+
+
+class LoopQueue:
+    def __init__(self):
+        self.loop = None
+        self.queue = None
+        # items put before bind()
+        self.pending_items = []
+
+    def bind(self, loop):
+        """
+
+        must be called inside the event loop before any get()
+
+        :param loop: asyncio event loop
+        """
+        self.loop = loop
+        self.queue = asyncio.Queue()
+        for one_item in self.pending_items:
+            self.queue.put_nowait(one_item)
+        self.pending_items = []
+
+    def put(self, item):
+        if self.loop is None:
+            self.pending_items.append(item)
+            return
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is self.loop:
+            self.queue.put_nowait(item)
+        else:
+            # put from another thread, asyncio.Queue is not thread safe
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, item)
+
+    async def get(self):
+        return await self.queue.get()
+
+    def get_nowait(self):
+        # only inside the event loop, after qsize() says something is there
+        return self.queue.get_nowait()
+
+    def qsize(self):
+        if self.queue is None:
+            return len(self.pending_items)
+        return self.queue.qsize()
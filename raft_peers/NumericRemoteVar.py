@@ -0,0 +1,289 @@
+"""
+
+
+This is the RemoteVar for counter heavy workloads, the float variables are
+kept in one NumPy float64 array with a slot for every variable name, the
+other variables (learnt skills) stay in vars like RemoteVar.
+
+A pass of committed logs is applied in two steps. The commands are read
+and the client sessions checked one by one, but add, sub, time and div on
+a known variable only record (slot, operation, param) without going
+through perform_action. Then the operations are applied in the log order
+with Python floats, and one scatter writes the values back to the array.
+
+This is not a vectorized state machine, the second step is a Python loop
+over the operations and NumPy only keeps the values and writes them back.
+The results must be exactly the floats RemoteVar gives, every peer splits
+the committed logs into different passes and still has to reach the same
+values, so the operations of one variable are never done in another order
+(no pairwise sums, no differences of a cumsum), and every command needs
+the value right after its own operation as its result.
+
+NumPy is optional, it is only imported when this state machine is chosen.
+
+
+"""
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from RemoteVar import RemoteVar
+
+
+class PendingResult:
+    # result of a command recorded in the current pass, known once the pass is applied
+    __slots__ = ("op_index",)
+
+    def __init__(self, op_index):
+        self.op_index = op_index
+
+
+class NumericRemoteVar(RemoteVar):
+    # operation of each action, sub is an add of the negative param which gives exactly the same float
+    numeric_actions = {"add": 0, "sub": 0, "time": 1, "div": 2}
+    initial_slots = 64
+
+    def __init__(self):
+        if numpy is None:
+            raise ImportError("numpy is needed by the numeric state machine")
+        super().__init__()
+        # ufunc of every operation of numeric_actions
+        self.operation_ufuncs = (numpy.add, numpy.multiply, numpy.true_divide)
+        # (var name => slot, float64 array of the values), slots are only added and the array is
+        # replaced by a longer one, a snapshot restored from the leader replaces both at once
+        self.slot_table = ({}, numpy.zeros(self.initial_slots, dtype=numpy.float64))
+        # operations recorded in the current pass, None outside perform_actions
+        self.pass_slots = None
+        self.pass_operations = None
+        self.pass_params = None
+        # operations of the current pass whose command got a PendingResult
+        self.pass_pending_count = 0
+        # (session results, client_seq) of the session results that are a PendingResult in the current pass
+        self.pass_session_results = None
+
+    def perform_actions(self, action_param_lists, log_indexes):
+        """
+
+        apply the commands of consecutive logs together
+
+        :param action_param_lists: list of list
+        :param log_indexes: list of int
+        :return: list, the result of every command
+        """
+        self.pass_slots, self.pass_operations, self.pass_params = [], [], []
+        self.pass_pending_count = 0
+        self.pass_session_results = []
+        try:
+            slow_commands = self.record_pass_operations(action_param_lists, log_indexes)
+            op_results = self.apply_pass_operations()
+        finally:
+            self.pass_slots = self.pass_operations = self.pass_params = None
+            pass_pending_count = self.pass_pending_count
+            pass_session_results = self.pass_session_results
+            self.pass_session_results = None
+        # every command was a plain numeric one, the operations are the commands
+        if len(slow_commands) == 0:
+            return op_results
+        results = []
+        op_start = 0
+        for op_count_before, result, op_count_after in slow_commands:
+            results.extend(op_results[op_start:op_count_before])
+            results.append(result)
+            op_start = op_count_after
+        results.extend(op_results[op_start:])
+        if pass_pending_count == 0:
+            return results
+        # sessions keep the results for retried commands, so they get the values as well
+        for session_results, client_seq in pass_session_results:
+            # could be acknowledged by a later command of the pass already
+            result = session_results.get(client_seq)
+            if type(result) is PendingResult:
+                session_results[client_seq] = op_results[result.op_index]
+        return [op_results[result.op_index] if type(result) is PendingResult else result for result in results]
+
+    def record_pass_operations(self, action_param_lists, log_indexes):
+        """
+
+        first step of perform_actions, numeric commands on existing variables, plain or sent with
+        a client session, are recorded right here as one operation each, every other command goes
+        through perform_action
+
+        :param action_param_lists: list of list
+        :param log_indexes: list of int
+        :return: list of (operations before, result, operations after) of every command that
+                 went through perform_action or was sent with a client session, in the log order
+        """
+        slow_commands = []
+        get_slot = self.slot_table[0].get
+        get_operation = self.numeric_actions.get
+        session_expiry_check_logs = self.session_expiry_check_logs
+        pass_slots, pass_operations, pass_params = self.pass_slots, self.pass_operations, self.pass_params
+        for action_param_list, log_index in zip(action_param_lists, log_indexes):
+            slot = None
+            if 3 <= len(action_param_list) <= 4 and log_index % session_expiry_check_logs != 0:
+                try:
+                    operation = get_operation(action_param_list[1])
+                    if operation is not None:
+                        slot = get_slot(action_param_list[0])
+                        if slot is not None:
+                            param = float(action_param_list[2])
+                except (TypeError, ValueError):
+                    slot = None
+            if slot is not None:
+                if action_param_list[1] == "sub":
+                    param = -param
+                elif operation == 2 and param == 0.0:
+                    slot = None
+            if slot is not None and len(action_param_list) == 4:
+                try:
+                    session, client_seq, result = self.open_session_command(action_param_list, log_index)
+                except Exception:
+                    slot = None
+                else:
+                    op_count = len(pass_slots)
+                    # answered from the session, a command repeated in this pass gets its PendingResult
+                    if session is None:
+                        if type(result) is PendingResult:
+                            self.pass_pending_count += 1
+                        slow_commands.append((op_count, result, op_count))
+                        continue
+                    result = PendingResult(op_count)
+                    session["results"][client_seq] = result
+                    self.pass_session_results.append((session["results"], client_seq))
+                    self.pass_pending_count += 1
+                    slow_commands.append((op_count, result, op_count + 1))
+            # perform_action records the operation on a new variable, or gives the
+            # command_error result of a bad param or a div by zero
+            if slot is None:
+                op_count = len(pass_slots)
+                result = self.perform_action(action_param_list, log_index)
+                slow_commands.append((op_count, result, len(pass_slots)))
+                continue
+            pass_slots.append(slot)
+            pass_operations.append(operation)
+            pass_params.append(param)
+        return slow_commands
+
+    def apply_pass_operations(self):
+        """
+
+        apply the operations recorded in this pass one after another in the log order,
+        python floats give the same values as float64
+
+        :return: list of float, the value after each operation
+        """
+        values = self.slot_table[1]
+        # slot => value after the operations so far
+        pass_values = {}
+        op_results = []
+        for slot, operation, param in zip(self.pass_slots, self.pass_operations, self.pass_params):
+            value = pass_values.get(slot)
+            if value is None:
+                value = float(values[slot])
+            if operation == 0:
+                value += param
+            elif operation == 1:
+                value *= param
+            else:
+                value /= param
+            pass_values[slot] = value
+            op_results.append(value)
+        # one scatter writes the last value of every variable changed in the pass
+        values[list(pass_values)] = list(pass_values.values())
+        return op_results
+
+    def perform_session_action(self, action_param_list, log_index):
+        result = super().perform_session_action(action_param_list, log_index)
+        if type(result) is PendingResult and self.pass_session_results is not None:
+            session = self.sessions.get(str(action_param_list[3][0]))
+            if session is not None:
+                self.pass_session_results.append((session["results"], int(action_param_list[3][1])))
+        return result
+
+    def perform_var_action(self, action_param_list):
+        var_name = str(action_param_list[0])
+        operation = self.numeric_actions.get(str(action_param_list[1]))
+        if operation is None:
+            super().perform_var_action(action_param_list)
+            slot = self.slot_table[0].get(var_name)
+            # the value after the last operation on it in this pass
+            if self.pass_slots is not None and slot is not None and slot in self.pass_slots:
+                self.pass_pending_count += 1
+                return PendingResult(len(self.pass_slots) - 1 - self.pass_slots[::-1].index(slot))
+            return self.read_var(var_name)
+        # a skill that is not a number, RemoteVar gives the same command_error
+        if var_name not in self.slot_table[0] and type(self.vars.get(var_name, 0.0)) not in (float, int, bool):
+            return super().perform_var_action(action_param_list)
+        try:
+            param = float(action_param_list[2])
+            if operation == 2 and param == 0.0:
+                # same as RemoteVar, the array would keep inf instead
+                raise ZeroDivisionError("float division by zero")
+        except (TypeError, ValueError, ZeroDivisionError):
+            # RemoteVar adds a missing variable before the param fails, but a learnt skill keeps its value
+            if var_name not in self.vars:
+                self.get_slot(var_name)
+            raise
+        slot = self.get_slot(var_name)
+        if str(action_param_list[1]) == "sub":
+            param = -param
+        if self.pass_slots is None:
+            values = self.slot_table[1]
+            values[slot] = self.operation_ufuncs[operation](values[slot], param)
+            return float(values[slot])
+        self.pass_slots.append(slot)
+        self.pass_operations.append(operation)
+        self.pass_params.append(param)
+        self.pass_pending_count += 1
+        return PendingResult(len(self.pass_slots) - 1)
+
+    def get_slot(self, var_name):
+        slots, values = self.slot_table
+        slot = slots.get(var_name)
+        if slot is not None:
+            return slot
+        slot = len(slots)
+        if slot == len(values):
+            values = numpy.concatenate((values, numpy.zeros(len(values), dtype=numpy.float64)))
+            self.slot_table = (slots, values)
+        # a skill learnt under this name as a number turns into a float like it does in RemoteVar
+        values[slot] = float(self.vars.get(var_name, 0.0))
+        self.vars.pop(var_name, None)
+        # added last, so the slot is in the array of any table the state loop read
+        slots[var_name] = slot
+        return slot
+
+    def learn_skill(self, skill_name, action_param = True):
+        if str(skill_name) not in self.slot_table[0]:
+            super().learn_skill(skill_name, action_param)
+
+    def read_var(self, var_name):
+        slots, values = self.slot_table
+        slot = slots.get(str(var_name))
+        # a slot added after the table was read belongs to a command not applied yet
+        if slot is None or slot >= len(values):
+            return self.vars.get(str(var_name))
+        return float(values[slot])
+
+    def session_result(self, client_id, client_seq):
+        applied, result = super().session_result(client_id, client_seq)
+        # recorded in the pass being applied
+        if type(result) is PendingResult:
+            return False, None
+        return applied, result
+
+    def take_snapshot(self):
+        # same format as RemoteVar, the float variables come from one copy of the array
+        snapshot = super().take_snapshot()
+        slots, values = self.slot_table
+        snapshot["vars"].update(zip(slots, values[:len(slots)].tolist()))
+        return snapshot
+
+    def restore_snapshot(self, snapshot_vars):
+        super().restore_snapshot(snapshot_vars)
+        float_var_names = [var_name for var_name, value in self.vars.items() if type(value) is float]
+        values = numpy.zeros(max(self.initial_slots, 2 * len(float_var_names)), dtype=numpy.float64)
+        values[:len(float_var_names)] = [self.vars.pop(var_name) for var_name in float_var_names]
+        self.slot_table = ({var_name: slot for slot, var_name in enumerate(float_var_names)}, values)
@@ -0,0 +1,104 @@
+"""
+
+
+This is the class to hold the messages waiting to be sent to one
+destination, it is bounded so a slow or half-dead peer could never make
+the leader pile up messages for it.
+
+When it is full, only messages a newer one makes useless are dropped:
+the queued heartbeats, since a newer message to the same peer carries the
+same information, and the queued heartbeat replies of the same term as a
+new one. A new heartbeat is dropped as well when nothing else could go.
+Votes, append entries with logs, their replies, snapshot chunks and user
+replies are never dropped, the queue grows past max_size for them instead
+of blocking the state loop. Those are few while the heartbeats keep a
+slow peer's queue from growing.
+
+
+"""
+
+import threading
+from collections import deque
+
+
+class OutboundQueue:
+    def __init__(self, max_size, wakeup=None):
+        self.max_size = int(max_size)
+        self.messages = deque()
+        self.condition = threading.Condition()
+        # called after every put, used by writers not waiting on the condition
+        self.wakeup = wakeup
+        self.dropped_count = 0
+
+    @staticmethod
+    def is_heartbeat(json_data_dict):
+        return json_data_dict["msg_type"] == "append_entries_leader" and len(json_data_dict["new_entries"]) == 0
+
+    @staticmethod
+    def heartbeat_reply_term(json_data_dict):
+        """
+
+        a heartbeat reply only matters through the newest one of its term, read rounds and
+        match index only move forward
+
+        :param json_data_dict: dict
+        :return: term of the accepted heartbeat reply, None for any other message
+        """
+        if json_data_dict["msg_type"] == "append_entries_follower_reply" and \
+                json_data_dict["append_entries_result"] and int(json_data_dict["log_index_end"]) == -1:
+            return json_data_dict["sender_term"]
+        return None
+
+    def put(self, json_data_dict):
+        """
+
+        add the message, drop the stale ones if the queue is full
+
+        :param json_data_dict: dict
+        :return: int, number of messages dropped
+        """
+        dropped_count = 0
+        with self.condition:
+            if len(self.messages) >= self.max_size:
+                reply_term = self.heartbeat_reply_term(json_data_dict)
+                kept_messages = deque(one_message for one_message in self.messages
+                                      if not self.is_heartbeat(one_message) and
+                                      (reply_term is None or self.heartbeat_reply_term(one_message) != reply_term))
+                dropped_count = len(self.messages) - len(kept_messages)
+                self.messages = kept_messages
+                # anything else is sent even if the queue grows past max_size
+                if len(self.messages) >= self.max_size and self.is_heartbeat(json_data_dict):
+                    dropped_count += 1
+                    json_data_dict = None
+            if json_data_dict is not None:
+                self.messages.append(json_data_dict)
+            self.dropped_count += dropped_count
+            self.condition.notify()
+        if self.wakeup is not None:
+            self.wakeup()
+        return dropped_count
+
+    def get(self, timeout=None):
+        """
+
+        wait for the next message
+
+        :param timeout: float, None waits forever
+        :return: dict or None if nothing came within timeout
+        """
+        with self.condition:
+            if len(self.messages) == 0:
+                self.condition.wait(timeout)
+            if len(self.messages) == 0:
+                return None
+            return self.messages.popleft()
+
+    def get_nowait(self):
+        with self.condition:
+            if len(self.messages) == 0:
+                return None
+            return self.messages.popleft()
+
+    def qsize(self):
+        with self.condition:
+            return len(self.messages)
@@ -0,0 +1,65 @@
+"""
+
+
+This is the class to hand every outgoing message to the OutboundQueue of
+its destination, each destination has its own writer so one slow peer,
+user or visualization only delays the messages sent to itself.
+
+put() keeps the interface of the single send queue it replaced, so the
+Raft handlers do not know which writer sends their messages.
+
+
+"""
+
+import logging
+import threading
+
+logger = logging.getLogger("OutboundRouter")
+
+
+class OutboundRouter:
+    def __init__(self, create_writer, my_detail):
+        # create_writer(destination_addr_port_tuple) starts the writer and returns its OutboundQueue
+        self.create_writer = create_writer
+        self.my_detail = my_detail
+        self.lock = threading.Lock()
+        # key is destination addr => (ip, port)
+        self.destination_queues = {}
+
+    def put(self, json_data_dict):
+        """
+
+        queue the message for the destination in its send_to
+
+        :param json_data_dict: dict
+        """
+        destination_addr_port_tuple = (str(json_data_dict["send_to"][0]), int(json_data_dict["send_to"][1]))
+        with self.lock:
+            outbound_queue = self.destination_queues.get(destination_addr_port_tuple)
+            if outbound_queue is None:
+                outbound_queue = self.create_writer(destination_addr_port_tuple)
+                self.destination_queues[destination_addr_port_tuple] = outbound_queue
+            dropped_count = outbound_queue.put(json_data_dict)
+        if dropped_count > 0:
+            logger.debug(" outbound queue full dropped " + str(dropped_count) + " messages to " +
+                         str(destination_addr_port_tuple), extra=self.my_detail)
+
+    def remove_if_idle(self, destination_addr_port_tuple, outbound_queue):
+        """
+
+        forget the queue if nothing is waiting in it, its writer could stop after that
+
+        :param destination_addr_port_tuple: (str, int)
+        :param outbound_queue: OutboundQueue
+        :return: bool
+        """
+        with self.lock:
+            if self.destination_queues.get(destination_addr_port_tuple) is outbound_queue and \
+                    outbound_queue.qsize() == 0:
+                self.destination_queues.pop(destination_addr_port_tuple)
+                return True
+            return False
+
+    def qsize(self):
+        with self.lock:
+            return sum(one_queue.qsize() for one_queue in self.destination_queues.values())
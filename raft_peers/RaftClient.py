@@ -0,0 +1,242 @@
+"""
+
+
+This is the class to use the Raft from another program instead of typing
+commands into User.py.
+
+It keeps one connection to the leader it knows, every command gets a
+request_id and a Future right away, so many commands are on the wire at
+the same time and the replies are matched by request_id in any order.
+When the peer replies not_leader or the connection is lost, the client
+connects to the leader_hint (or the next peer) and sends every command
+that is not answered yet again.
+
+Commands are sent in a client session, a command resent after the old
+leader already applied it is answered from the session instead of being
+applied twice. Sessions without a command for session_expiry_logs logs
+are dropped, their commands are answered 'session_expired'.
+
+    raft_client = RaftClient([("localhost", 20001), ("localhost", 20002)])
+    futures = [raft_client.request_command(["x", "add", 1]) for i in range(1000)]
+    print(futures[-1].result(), raft_client.read_command("x").result())
+
+
+"""
+
+import itertools
+import json
+import logging
+import socket
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+
+from FrameReader import FrameReader
+
+logger = logging.getLogger("RaftClient")
+
+
+class RaftClient:
+    # seconds to wait before asking the next peer when nobody knows the leader
+    retry_interval = 0.2
+    connect_timeout = 2
+    # commands joined into one sendall
+    max_send_batch = 256
+
+    def __init__(self, servers_addr_port_list):
+        self.servers_addr_port_list = [(str(host), int(port)) for host, port in servers_addr_port_list]
+        self.server_index = -1
+        self.my_detail = {"host": "random host", "port": "random port", "peer_id": "raft_client"}
+        self.lock = threading.RLock()
+        self.condition = threading.Condition(self.lock)
+        # commands are sent in a client session, the leader skips the ones retried after they are applied
+        self.client_id = uuid.uuid4().hex
+        self.request_ids = itertools.count(1)
+        # request_id => [Future, message dict, socket it was sent on or None]
+        self.pending_requests = OrderedDict()
+        # request_ids waiting for the writer, commands resent after a leader change go first
+        self.send_request_ids = deque()
+        self.leader_socket = None
+        # [host, port] of both ends, taken once when connected
+        self.leader_send_from = None
+        self.leader_send_to = None
+        self.closed = False
+        self.thread_send = threading.Thread(target=self.process_send_request_ids)
+        self.thread_send.daemon = True
+        self.thread_send.start()
+
+    def request_command(self, request_command_list):
+        """
+
+        ask the leader to perform [var_name, action, action_param]
+
+        :param request_command_list: list
+        :return: Future, the value of the variable after the command is applied
+        """
+        return self.submit({"msg_type": "request_command", "request_command_list": list(request_command_list),
+                            "client_id": self.client_id})
+
+    def read_command(self, var_name):
+        """
+
+        read one variable from the leader without adding a log
+
+        :param var_name: str
+        :return: Future, the value of the variable or None if it was never set
+        """
+        return self.submit({"msg_type": "read_command", "read_command_list": [str(var_name)]})
+
+    def submit(self, json_data_dict):
+        future = Future()
+        with self.condition:
+            if self.closed:
+                raise ConnectionError("raft client is closed")
+            request_id = next(self.request_ids)
+            json_data_dict["request_id"] = request_id
+            self.pending_requests[request_id] = [future, json_data_dict, None]
+            self.send_request_ids.append(request_id)
+            self.condition.notify()
+        return future
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.close_leader_socket()
+            failed_requests = list(self.pending_requests.values())
+            self.pending_requests = OrderedDict()
+            self.condition.notify()
+        for future, json_data_dict, sent_socket in failed_requests:
+            future.set_exception(ConnectionError("raft client is closed"))
+
+    def process_send_request_ids(self):
+        while True:
+            with self.condition:
+                while len(self.send_request_ids) == 0 and not self.closed:
+                    self.condition.wait()
+                if self.closed:
+                    return
+                if self.leader_socket is None:
+                    self.connect_to_leader(None)
+                    if self.leader_socket is None:
+                        self.condition.wait(self.retry_interval)
+                        continue
+                leader_socket = self.leader_socket
+                frames = []
+                while len(self.send_request_ids) > 0 and len(frames) < self.max_send_batch:
+                    one_request = self.pending_requests.get(self.send_request_ids.popleft())
+                    # answered already
+                    if one_request is None or one_request[2] is not None:
+                        continue
+                    one_request[2] = leader_socket
+                    one_request[1]["send_from"] = self.leader_send_from
+                    one_request[1]["send_to"] = self.leader_send_to
+                    self.add_client_seq(one_request[1])
+                    frames.append(json.dumps(one_request[1]) + "\n")
+            try:
+                leader_socket.sendall(str.encode("".join(frames), "utf-8"))
+            except OSError as e:
+                logger.debug(" send to leader failed " + str(e), extra=self.my_detail)
+                self.switch_leader(leader_socket, None)
+
+    def add_client_seq(self, json_data_dict):
+        """
+        number the command in the client session, the caller must hold the lock
+
+        :param json_data_dict: dict
+        """
+        if "client_id" in json_data_dict:
+            json_data_dict["client_seq"] = json_data_dict["request_id"]
+            # pending requests are kept in request_id order, everything before the first one is answered
+            json_data_dict["client_ack_seq"] = next(iter(self.pending_requests)) - 1
+
+    def connect_to_leader(self, leader_hint):
+        """
+        connect to the hinted leader, or to the peers in turn until one accepts,
+        the caller must hold the lock
+
+        :param leader_hint: [host, port] or None
+        """
+        if leader_hint is not None:
+            candidate_addr_port_tuples = [(str(leader_hint[0]), int(leader_hint[1]))]
+        else:
+            candidate_addr_port_tuples = []
+        # the peers in turn, starting after the one connected last time
+        server_number = len(self.servers_addr_port_list)
+        candidate_addr_port_tuples += [self.servers_addr_port_list[(self.server_index + i) % server_number]
+                                       for i in range(1, server_number + 1)]
+        for one_addr_port_tuple in candidate_addr_port_tuples:
+            try:
+                leader_socket = socket.create_connection(one_addr_port_tuple, self.connect_timeout)
+                leader_socket.settimeout(None)
+                self.leader_send_from = list(leader_socket.getsockname())
+                self.leader_send_to = list(leader_socket.getpeername())
+            except OSError as e:
+                logger.debug(" unable to connect " + str(one_addr_port_tuple) + " " + str(e), extra=self.my_detail)
+                continue
+            self.leader_socket = leader_socket
+            if one_addr_port_tuple in self.servers_addr_port_list:
+                self.server_index = self.servers_addr_port_list.index(one_addr_port_tuple)
+            thread_receive = threading.Thread(target=self.receive_from_leader, args=(leader_socket,))
+            thread_receive.daemon = True
+            thread_receive.start()
+            logger.debug(" connected to " + str(one_addr_port_tuple), extra=self.my_detail)
+            return
+
+    def close_leader_socket(self):
+        if self.leader_socket is None:
+            return
+        try:
+            self.leader_socket.shutdown(socket.SHUT_RDWR)
+            self.leader_socket.close()
+        except OSError:
+            pass
+        self.leader_socket = None
+
+    def switch_leader(self, old_leader_socket, leader_hint):
+        """
+
+        leave the peer that is not the leader and send everything not answered on it again,
+        only the first failure of a connection does it
+
+        :param old_leader_socket: socket
+        :param leader_hint: [host, port] or None
+        """
+        if leader_hint is None:
+            # nobody knows the leader, an election is going on
+            time.sleep(self.retry_interval)
+        with self.condition:
+            if self.leader_socket is not old_leader_socket or self.closed:
+                return
+            self.close_leader_socket()
+            resend_request_ids = [request_id for request_id, one_request in self.pending_requests.items()
+                                  if one_request[2] is old_leader_socket]
+            for request_id in resend_request_ids:
+                self.pending_requests[request_id][2] = None
+            self.send_request_ids.extendleft(reversed(resend_request_ids))
+            self.connect_to_leader(leader_hint)
+            self.condition.notify()
+
+    def receive_from_leader(self, leader_socket):
+        frame_reader = FrameReader(leader_socket)
+        try:
+            while True:
+                for payload in frame_reader.read_frames():
+                    self.process_one_reply(leader_socket, json.loads(bytes(payload).decode("utf-8")))
+        except (OSError, ValueError) as e:
+            logger.debug(" leader connection closed " + str(e), extra=self.my_detail)
+        self.switch_leader(leader_socket, None)
+
+    def process_one_reply(self, leader_socket, reply_dict):
+        if reply_dict["msg_type"] == "request_command_reply_batch":
+            for one_reply_dict in reply_dict["replies"]:
+                self.process_one_reply(leader_socket, one_reply_dict)
+            return
+        if reply_dict["command_result"] == "not_leader":
+            self.switch_leader(leader_socket, reply_dict.get("leader_hint"))
+            return
+        with self.lock:
+            one_request = self.pending_requests.pop(reply_dict.get("request_id"), None)
+        if one_request is not None:
+            one_request[0].set_result(reply_dict["command_result"])
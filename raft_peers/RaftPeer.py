@@ -6,14 +6,17 @@ Author: Bingfeng Liu
 This is the class to process and send the json message
 between peer communications.
 
+The Raft state is owned by one state loop, it takes the received messages
+and the StateEvent of the timer, the commit thread and the leader forwarder
+from one queue and handles them one after another. Sockets, encoding and
+the timer run in their own threads and never change the state themselves.
+
 
 """
 
 import _thread
-import json
 import os
 
-import jsonpickle
 import random
 import socket
 import logging
@@ -28,10 +31,22 @@ from RequestVote import RequestVote
 from RequestVoteReceive import RequestVoteReceive
 from AppendEntriesFollower import AppendEntriesFollower
 from AppendEntriesLeader import AppendEntriesLeader
+from InstallSnapshotLeader import InstallSnapshotLeader
+from InstallSnapshotFollower import InstallSnapshotFollower
 from RemoteVar import RemoteVar
+from NumericRemoteVar import NumericRemoteVar
+from Snapshot import Snapshot
+from WriteAheadLog import WriteAheadLog
+from JsonCodec import JsonCodec
+from BinaryCodec import BinaryCodec
+from LeaderForwarder import LeaderForwarder
+from FrameReader import FrameReader
+from OutboundQueue import OutboundQueue
+from OutboundRouter import OutboundRouter
+from VisualizationTap import VisualizationTap
+from StateEvent import StateEvent
 import time
 import threading
-import copy
 
 logger = logging.getLogger("RaftPeer")
 
@@ -39,7 +54,12 @@ logger = logging.getLogger("RaftPeer")
 # this RaftPeer is inspired from http://lesoluzioni.blogspot.com.au/2015/12/python-json-socket-serverclient.html
 class RaftPeer:
     backlog = 5
-    recv_buffer_size = 1024
+    # initial size of the receive buffer of every socket, FrameReader grows it when needed
+    recv_buffer_size = 64 * 1024
+    # seconds to wait for the remote peer to answer codec_hello before falling back to JSON
+    codec_hello_timeout = 2
+    # seconds a writer of a user or the visualization waits for a message before it stops
+    outbound_writer_idle_timeout = 60
 
     # thread safe queue FIFO
     # https://docs.python.org/2/library/queue.html
@@ -47,6 +67,8 @@ class RaftPeer:
     def __init__(self, host, port, user_port, peer_id, max_peer_number, append_entries_timeout, min_leader_election_timeout, max_leader_election_timeout):
 
         self.visualizaiton_on = False
+        # VisualizationTap, Raft handlers record events into it and its own thread sends them to the game
+        self.visualization_tap = None
         self.visualization_scoket = None
         self.visualization_listen_thread = None
         self.visualization_addr_port_tuple = None
@@ -84,11 +106,16 @@ class RaftPeer:
         # other wise we dont know the msg is from which peer and send to who in peer_addr_client_socket
         # in peer_addr_client_socket we use known peer's ip and port as key
         # dictionary
+        # inbox of the state loop, received messages are dict and the other events are StateEvent
         self.json_message_recv_queue = Queue()
-        # dictioanry
-        self.json_message_send_queue = Queue()
+        # messages handled with one lock hold, the rest waits for the next batch
+        self.max_recv_batch = 256
+        # dictioanry, every destination has its own bounded queue and writer
+        self.json_message_send_queue = OutboundRouter(self.create_outbound_writer, self.my_detail)
+        # messages waiting for one destination before stale heartbeats are dropped
+        self.outbound_queue_size = 256
         self.json_message_commit_queue = Queue()
-        self.raft_peer_state = RaftPeerState(self.my_addr_port_tuple, self.peer_id)
+        self.raft_peer_state = RaftPeerState(self.my_addr_port_tuple, self.peer_id, (host, user_port))
         # btw 100ms - 150ms
         # random_timeout = random.randint(100, 150)/1000
         # set time as seed
@@ -100,16 +127,80 @@ class RaftPeer:
         logger.debug(" random_timeout =>  " + str(self.random_timeout) + " s", extra=self.my_detail)
         # heart beat should be 5 times quicker than candidate timeoutm in here it is c seconds
         self.append_entries_heart_beat_time_out = append_entries_timeout
+        self.min_leader_election_timeout = min_leader_election_timeout
         self.timeout_counter = TimeoutCounter(self.random_timeout, self.my_addr_port_tuple, self.peer_id,
                                               self.raft_peer_state, self.append_entries_heart_beat_time_out)
-        try:
-
-            self.thread_connect_to_all = None
+        # take a snapshot every snapshot_threshold applied logs, 0 means never compact the log
+        self.snapshot_threshold = 0
+        # max size of the snapshot data sent in one install_snapshot
+        self.snapshot_chunk_size = 64 * 1024
+        # seconds to wait for the reply of a snapshot chunk before the heart beat sends it again,
+        # a follower hearing nothing for this long would have started an election
+        self.snapshot_chunk_timeout = min_leader_election_timeout
+        # JSON is always used for user and visualization, peers use the negotiated codec
+        self.json_codec = JsonCodec()
+        self.wire_codecs = {BinaryCodec.codec_name: BinaryCodec(), JsonCodec.codec_name: self.json_codec}
+        self.preferred_wire_codec = BinaryCodec.codec_name
+        # key is peer_addr => (ip, port), codec used to send to this peer
+        self.peers_addr_codec = {}
+        # bound the logs sent in one append entries, the rest is sent once this batch is acknowledged
+        self.max_entries_per_append = 64
+        self.max_bytes_per_append = 64 * 1024
+        # unacknowledged append entries allowed to one follower in replicate mode, in batches and in bytes
+        self.max_in_flight_appends = 4
+        self.max_in_flight_bytes = 1024 * 1024
+        # seconds to wait after a user command before sending it, so a burst shares one append entries
+        self.replication_coalescing_window = 0.002
+        # key is peer_addr => (ip, port), time.monotonic() of the last append entries with logs sent to it
+        self.peers_last_append_time = {}
+        # [read round, read index, var name, user addr, request_id] of the reads waiting for the majority to echo
+        # their round and for the read index to be applied, answered without adding any log
+        self.pending_reads = []
+        # a read is waiting for the next read round, started with the next new entries
+        self.read_round_requested = False
+        # seconds a confirmed read round lets the leader answer reads without another round, 0 is off
+        self.read_lease_timeout = 0
+        # time.monotonic() of the last append entries from the leader, votes are ignored for a while after it
+        # in lease mode so no other leader could be elected while the lease is valid
+        self.last_leader_contact_time = None
+        # leader_commit_index of the last append entries, how far behind the leader a follower read is
+        self.known_leader_commit_index = -1
+        # user port of the leader of current term from its append entries, None while it is unknown
+        self.known_leader_user_addr_port_tuple = None
+        # LeaderForwarder, followers forward user commands to the leader instead of replying not_leader
+        self.leader_forwarder = None
+        # calling right methods to handle the different JSON data
+        self.receive_processing_functions = {"append_entries_follower_reply": self.process_append_entries_follower_reply,
+                                             "append_entries_leader": self.process_append_entries_leader,
+                                             "request_vote_reply": self.process_request_vote_reply,
+                                             "request_vote": self.process_request_vote,
+                                             "install_snapshot": self.process_install_snapshot,
+                                             "install_snapshot_reply": self.process_install_snapshot_reply,
+                                             "request_command": self.process_request_command,
+                                             "read_command": self.process_read_command,
+                                             "villager_killed": self.process_killed}
+        # calling right methods to handle the StateEvent, with the payload of the event
+        self.state_event_functions = {StateEvent.timer_fired: self.process_timer_fired,
+                                      StateEvent.logs_applied: self.process_logs_applied,
+                                      StateEvent.forwarded_reply: self.process_forwarded_reply}
+        # logs applied in one pass of the commit thread, the rest waits for the next pass
+        self.max_logs_per_apply = 1024
+        # index of the last log applied to the remote_var and of the last snapshot taken or restored by
+        # the apply stage, only the commit thread changes them, the state loop learns them from logs_applied
+        self.applied_index = -1
+        self.applied_snapshot_index = -1
+        # user addr => replies collected while applying one pass of logs, each user gets them in one frame,
+        # None when replies are sent right away
+        self.user_reply_batches = None
+        self.thread_connect_to_all = None
+        self.start_processing_threads()
+
+    def start_processing_threads(self):
+        """
+        This method starts the threads sending, receiving, accepting and committing for the threaded engine.
 
-            self.thread_send = threading.Thread(target=self.process_json_message_send_queue, args=())
-            self.thread_send.daemon = True
-            self.thread_send.start()
-            logger.debug(" start thread => process_json_message_send_queue successful ", extra=self.my_detail)
+        """
+        try:
 
             self.thread_rev = threading.Thread(target=self.process_json_message_recv_queue, args=())
             self.thread_rev.daemon = True
@@ -144,54 +235,152 @@ class RaftPeer:
         This method is used to process the logs that is ready to be committed, because we assume in the real
         world situation, the commits might take long time to complete and we dont want to block recv while
         comitting entreis, that is why we have this method here.
+
+        It is the apply stage, the logs are applied to the remote_var without the raft_peer_state lock and
+        the state loop is told what was applied with one logs_applied event per pass.
         """
         while True:
             # FIFO queue so will always commit from most left
             one_log = self.json_message_commit_queue.get()
-            with self.raft_peer_state.lock:
-                if one_log.log_applied == False:
-                    if self.visualizaiton_on:
-                        # for visualization we want to delay the commit,
-                        # so we can show each peers commit in different time
-                        time.sleep(float("{0:.2f}".format(random.uniform(0, self.append_entries_heart_beat_time_out))))
+            self.put_state_event(StateEvent.logs_applied, self.apply_committed_logs(self.take_waiting_logs(one_log)))
+
+    def take_waiting_logs(self, first_log):
+        """
+        take the logs already waiting in the commit queue after first_log, the commit thread
+        is the only one taking from it so they are there
+
+        :param first_log: LogData or Snapshot
+        :return: list of LogData or Snapshot
+        """
+        one_pass_logs = [first_log]
+        while len(one_pass_logs) < self.max_logs_per_apply and self.json_message_commit_queue.qsize() > 0:
+            one_pass_logs.append(self.json_message_commit_queue.get_nowait())
+        return one_pass_logs
+
+    def apply_committed_logs(self, one_pass_logs):
+        """
+        Apply the logs to the remote_var in the apply stage, it does not touch anything else of the
+        raft_peer_state. A Snapshot installed from the leader comes through the commit queue as well,
+        so it replaces the remote_var after the logs committed before it are applied.
+
+        :param one_pass_logs: list of LogData or Snapshot
+        :return: dict, the payload of the logs_applied event
+        """
+        remote_var = self.raft_peer_state.remote_var
+        applied_logs = []
+        # consecutive logs given to the remote_var together
+        waiting_logs = []
+        taken_snapshot = None
+        for one_log in one_pass_logs:
+            if type(one_log) is Snapshot:
+                self.apply_waiting_logs(waiting_logs, applied_logs)
+                if one_log.last_included_index > self.applied_index:
+                    remote_var.restore_snapshot(one_log.snapshot_vars)
+                    self.applied_index = one_log.last_included_index
+                    self.applied_snapshot_index = one_log.last_included_index
+                continue
+            # this log is already included in the snapshot
+            if one_log.log_index <= self.applied_index:
+                continue
+            waiting_logs.append(one_log)
+            self.applied_index = one_log.log_index
+            if self.snapshot_threshold > 0 and \
+                    one_log.log_index - self.applied_snapshot_index >= self.snapshot_threshold:
+                self.apply_waiting_logs(waiting_logs, applied_logs)
+                # must be taken before the next log changes the remote_var, encoded here as well
+                taken_snapshot = Snapshot(one_log.log_index, one_log.log_term, remote_var.take_snapshot())
+                self.applied_snapshot_index = one_log.log_index
+        self.apply_waiting_logs(waiting_logs, applied_logs)
+        return {"applied_index": self.applied_index, "applied_logs": applied_logs, "snapshot": taken_snapshot}
+
+    def apply_waiting_logs(self, waiting_logs, applied_logs):
+        """
+        apply the waiting logs with one perform_actions and move them to applied_logs with their results
+
+        :param waiting_logs: list of LogData, emptied
+        :param applied_logs: list of (LogData, command result)
+        """
+        if len(waiting_logs) == 0:
+            return
+        command_results = self.raft_peer_state.remote_var.perform_actions(
+            [one_log.request_command_action_list for one_log in waiting_logs],
+            [one_log.log_index for one_log in waiting_logs])
+        for one_log, command_result in zip(waiting_logs, command_results):
+            one_log.log_applied = True
+            applied_logs.append((one_log, command_result))
+        del waiting_logs[:]
+
+    def process_logs_applied(self, logs_applied):
+        """
+        The state loop moves last_apply, replies to the users of the applied logs and serves the
+        reads waiting for them, the replies to one user go out in one frame.
 
-                    self.raft_peer_state.remote_var.perform_action(one_log.request_command_action_list)
-                    one_log.log_applied = True
+        :param logs_applied: dict, returned by apply_committed_logs
+        """
+        with self.raft_peer_state.lock:
+            self.start_user_reply_batches()
+            try:
+                for one_log, command_result in logs_applied["applied_logs"]:
                     # if this log is added when this peer is a leader
                     if self.raft_peer_state.peer_state == "leader" and one_log.request_user_addr_port_tuple != None:
-                        self.json_message_send_queue.put({"msg_type": "request_command_reply",
-                                                          "send_from": list(self.my_addr_port_tuple),
-                                                          "send_to": list(one_log.request_user_addr_port_tuple),
-                                                          "command_result": self.raft_peer_state.remote_var.vars[
-                                                              one_log.request_command_action_list[0]],
-                                                          "sender_term": self.raft_peer_state.current_term})
-                    if self.raft_peer_state.commit_index < one_log.log_index:
-                        self.raft_peer_state.last_apply = one_log.log_index
-                        self.raft_peer_state.commit_index = one_log.log_index
+                        request_command_reply = {"msg_type": "request_command_reply",
+                                                 "send_from": list(self.my_addr_port_tuple),
+                                                 "send_to": list(one_log.request_user_addr_port_tuple),
+                                                 "command_result": command_result,
+                                                 "sender_term": self.raft_peer_state.current_term}
+                        if one_log.request_id is not None:
+                            request_command_reply["request_id"] = one_log.request_id
+                        self.queue_user_reply(request_command_reply)
                     if self.visualizaiton_on:
-                        print("sent to visual new commit index")
-                        self.json_message_send_queue.put({
-                            "msg_type":"commit_index",
-                            "send_from":list(self.my_addr_port_tuple),
-                            "send_to": list(self.visualization_addr_port_tuple),
-                            "index": one_log.log_index,
-                            "skill_name": str(one_log.request_command_action_list[0])
-                            })
+                        self.visualization_tap.record("commit_index", index=one_log.log_index,
+                                                      skill_name=str(one_log.request_command_action_list[0]))
+                self.raft_peer_state.last_apply = max(self.raft_peer_state.last_apply, logs_applied["applied_index"])
+                if len(self.pending_reads) > 0:
+                    self.serve_pending_reads()
+            finally:
+                self.put_user_reply_batches()
+            taken_snapshot = logs_applied["snapshot"]
+            # a newer snapshot could have been installed from the leader in the meantime
+            if taken_snapshot is not None and \
+                    taken_snapshot.last_included_index > self.raft_peer_state.snapshot_last_index:
+                self.raft_peer_state.compact_log(taken_snapshot)
+                logger.debug(" log compacted into snapshot " + str(self.raft_peer_state.snapshot),
+                             extra=self.my_detail)
+                self.release_encoded_entries()
 
-    def start_visualization_connection_thread(self, visualizaiton_ip, visualization_port):
+    def release_encoded_entries(self):
+        """
+        drop the encoded entries every follower already has, or that are compacted
+        into the snapshot, they are never sent as entries again
+        """
+        released_log_index = self.raft_peer_state.snapshot_last_index
+        peers_match_index = self.raft_peer_state.peers_match_index
+        if self.raft_peer_state.peer_state == "leader" and len(peers_match_index) == self.max_peer_number - 1:
+            released_log_index = max(released_log_index, min(peers_match_index.values()))
+        self.wire_codecs[BinaryCodec.codec_name].release_entries(released_log_index)
+
+    def start_visualization_connection_thread(self, visualizaiton_ip, visualization_port, sample_rate=1.0,
+                                              max_delay=None, buffer_size=4096):
         """
         This method is used to establish connection with visualization server        
         :param visualizaiton_ip: string
         :param visualization_port: int
+        :param sample_rate: float, share of heartbeats and append entries replies shown
+        :param max_delay: float, seconds each event is delayed at most, one heart beat if None
+        :param buffer_size: int, events kept while the game is behind
         """
-        self.visualizaiton_on = True
         self.visualization_scoket = socket.socket()
         self.visualization_addr_port_tuple = (str(visualizaiton_ip), int(visualization_port))
         self.visualization_scoket.connect(self.visualization_addr_port_tuple)
-        self.visualization_listen_thread = threading.Thread(target=self.receive_from_one_peer_newline_delimiter,
-                                                            args=(self.visualization_addr_port_tuple,))
-        self.visualization_listen_thread.daemon = True
-        self.visualization_listen_thread.start()
+        self.visualization_listen_thread = self.start_receive_thread(self.visualization_addr_port_tuple)
+        if max_delay is None:
+            # the villagers act one by one instead of all at the same moment
+            max_delay = self.append_entries_heart_beat_time_out
+        self.visualization_tap = VisualizationTap(self.json_message_send_queue.put,
+                                                  self.raft_peer_state.my_addr_port_tuple,
+                                                  self.visualization_addr_port_tuple, self.my_detail,
+                                                  buffer_size, sample_rate, max_delay)
+        self.visualizaiton_on = True
 
         # after connected to visualization, need to send a 'information' JSON to tell visualization that
         # there is new peer in the Raft system.
@@ -206,6 +395,121 @@ class RaftPeer:
 
         print("visusalization server connection established")
 
+    def set_wire_codec(self, codec_name):
+        """
+        This method is used to choose the codec between peers, "binary_v1" is negotiated with
+        each remote peer when connecting, "json" keeps the readable newline JSON for debugging.
+
+        :param codec_name: string
+        """
+        if codec_name not in self.wire_codecs:
+            raise ValueError("unknown wire codec " + str(codec_name))
+        self.preferred_wire_codec = codec_name
+
+    def set_in_flight_limits(self, max_in_flight_appends, max_in_flight_bytes):
+        """
+        This method is used to bound the append entries pipelined to one follower before
+        any of them is acknowledged.
+
+        :param max_in_flight_appends: int
+        :param max_in_flight_bytes: int
+        """
+        self.max_in_flight_appends = int(max_in_flight_appends)
+        self.max_in_flight_bytes = int(max_in_flight_bytes)
+
+    def set_replication_coalescing_window(self, replication_coalescing_window):
+        """
+        This method is used to set how long the leader waits after a user command before sending it,
+        commands coming within this window are sent in the same append entries.
+
+        :param replication_coalescing_window: float, seconds
+        """
+        self.replication_coalescing_window = float(replication_coalescing_window)
+
+    def set_read_lease(self, read_lease_timeout):
+        """
+        answer reads without a read round for read_lease_timeout seconds after a round is confirmed,
+        it must be shorter than the min election timeout on every peer
+
+        :param read_lease_timeout: float, 0 turns it off
+        """
+        self.read_lease_timeout = min(float(read_lease_timeout), self.min_leader_election_timeout)
+
+    def set_state_machine(self, state_machine_name):
+        """
+        choose what the logs are applied to, remote_var or numeric (NumericRemoteVar, needs numpy),
+        it must be the same on every peer and set before the write ahead log is loaded
+
+        :param state_machine_name: str
+        """
+        state_machines = {"remote_var": RemoteVar, "numeric": NumericRemoteVar}
+        self.raft_peer_state.remote_var = state_machines[state_machine_name]()
+
+    def set_session_expiry_logs(self, session_expiry_logs):
+        """
+        drop the client sessions without a command for session_expiry_logs logs,
+        it must be the same on every peer so they all skip the same retried commands
+
+        :param session_expiry_logs: int
+        """
+        self.raft_peer_state.remote_var.session_expiry_logs = int(session_expiry_logs)
+
+    def set_forward_to_leader(self, forward_to_leader):
+        """
+        let followers forward the commands of users to the leader and relay the replies
+
+        :param forward_to_leader: bool
+        """
+        if forward_to_leader and self.leader_forwarder is None:
+            self.leader_forwarder = LeaderForwarder(self.relay_forwarded_reply, self.my_detail)
+
+    def set_outbound_queue_size(self, outbound_queue_size):
+        """
+        This method is used to bound the messages waiting for one destination, it applies to
+        the writers started after it is called.
+
+        :param outbound_queue_size: int
+        """
+        self.outbound_queue_size = int(outbound_queue_size)
+
+    def set_append_entries_limits(self, max_entries_per_append, max_bytes_per_append):
+        """
+        This method is used to bound the number of logs and their size sent in one append entries,
+        so a lagging follower never gets a huge message.
+
+        :param max_entries_per_append: int
+        :param max_bytes_per_append: int
+        """
+        self.max_entries_per_append = int(max_entries_per_append)
+        self.max_bytes_per_append = int(max_bytes_per_append)
+
+    def start_log_compaction(self, snapshot_threshold, snapshot_chunk_size):
+        """
+        This method is used to turn on the log compaction, the remote_var is snapshotted every
+        snapshot_threshold applied logs and followers lagging behind the snapshot get it in chunks.
+
+        :param snapshot_threshold: int
+        :param snapshot_chunk_size: int
+        """
+        self.snapshot_threshold = int(snapshot_threshold)
+        self.snapshot_chunk_size = int(snapshot_chunk_size)
+
+    def start_write_ahead_log(self, wal_dir, segment_max_bytes):
+        """
+        This method is used to persist the state_log, current_term and vote_for on disk,
+        if there are segments left by the previous run, the state is rebuilt from them.
+        It should be called before connecting to other peers.
+
+        :param wal_dir: string
+        :param segment_max_bytes: int
+        """
+        write_ahead_log = WriteAheadLog(wal_dir, self.peer_id, segment_max_bytes)
+        self.raft_peer_state.attach_write_ahead_log(write_ahead_log)
+        # the remote_var is restored from the snapshot on disk
+        self.applied_index = self.raft_peer_state.last_apply
+        self.applied_snapshot_index = self.raft_peer_state.snapshot_last_index
+        logger.debug(" write ahead log loaded => \n " + str(self.raft_peer_state), extra=self.my_detail)
+
     def start_raft_peer(self):
         self.thread_timer = threading.Thread(target=self.timeout_counter.start_time_counter, args=(self,))
         self.thread_timer.daemon = True
@@ -217,57 +521,151 @@ class RaftPeer:
         
         This method is running as an independent thread, so it will consume the JSON data which are read
         from the recv thread.
+
+        It is the state loop, the only thread changing the Raft state, StateEvent put by the other
+        threads are handled in turn with the messages.
          
         """
         while True:
             logger.debug(" start receive ", extra=self.my_detail)
-            one_recv_json_message_dict = self.json_message_recv_queue.get()
+            recv_json_messages = [self.json_message_recv_queue.get()]
+            # only this thread takes from the queue, so the messages counted by qsize are there
+            while len(recv_json_messages) < self.max_recv_batch and self.json_message_recv_queue.qsize() > 0:
+                recv_json_messages.append(self.json_message_recv_queue.get_nowait())
+            self.process_recv_json_messages(recv_json_messages)
+
+    def process_recv_json_messages(self, recv_json_messages):
+        """
+
+        Handle the messages received together with one hold of the raft_peer_state lock, the
+        handlers take the same RLock again without waiting. The heartbeats and heartbeat replies
+        superseded by a later one in the batch are dropped first.
+
+        :param recv_json_messages: list of dict, in the order they were received
+        """
+        if len(recv_json_messages) > 1:
+            recv_json_messages = self.coalesce_recv_json_messages(recv_json_messages)
+        with self.raft_peer_state.lock:
+            for one_recv_json_message_dict in recv_json_messages:
+                try:
+                    if type(one_recv_json_message_dict) is StateEvent:
+                        self.state_event_functions[one_recv_json_message_dict.event_type](
+                            one_recv_json_message_dict.payload)
+                    else:
+                        self.process_one_recv_json_message(one_recv_json_message_dict)
+                except Exception as e:
+                    logger.debug(" processing recv message failed " + str(one_recv_json_message_dict) + " " + str(e),
+                                 extra=self.my_detail)
+
+    @staticmethod
+    def coalescing_key(one_recv_json_message_dict):
+        """
+
+        messages with the same key only matter through the last of them, a dropped one is
+        like a message lost on the network which Raft copes with
+
+        :param one_recv_json_message_dict: dict or StateEvent
+        :return: tuple or None if the message is always handled
+        """
+        if type(one_recv_json_message_dict) is StateEvent:
+            return None
+        msg_type = one_recv_json_message_dict["msg_type"]
+        if msg_type == "append_entries_leader" and len(one_recv_json_message_dict["new_entries"]) == 0:
+            # the last heartbeat has the newest commit index and read round
+            return msg_type, tuple(one_recv_json_message_dict["send_from"]), one_recv_json_message_dict["sender_term"]
+        if msg_type == "append_entries_follower_reply" and one_recv_json_message_dict["append_entries_result"] and \
+                int(one_recv_json_message_dict["log_index_end"]) == -1:
+            # read rounds and match index only move forward
+            return msg_type, tuple(one_recv_json_message_dict["send_from"]), one_recv_json_message_dict["sender_term"]
+        return None
+
+    def coalesce_recv_json_messages(self, recv_json_messages):
+        coalesced_json_messages = []
+        seen_keys = set()
+        for one_recv_json_message_dict in reversed(recv_json_messages):
+            coalescing_key = self.coalescing_key(one_recv_json_message_dict)
+            if coalescing_key is not None:
+                if coalescing_key in seen_keys:
+                    continue
+                seen_keys.add(coalescing_key)
+            coalesced_json_messages.append(one_recv_json_message_dict)
+        coalesced_json_messages.reverse()
+        return coalesced_json_messages
+
+    def put_state_event(self, event_type, payload=None):
+        """
+
+        hand an event to the state loop, called by the threads which must not change the state themselves
+
+        :param event_type: str, one of the StateEvent types
+        :param payload: depends on the event type
+        """
+        self.json_message_recv_queue.put(StateEvent(event_type, payload))
+
+    def process_timer_fired(self, payload):
+        self.timeout_counter.fire_if_due(self)
+
+    def process_one_recv_json_message(self, one_recv_json_message_dict):
+        """
+
+        Drop the outdated message, update the term and call the right method to handle this JSON data.
+
+        :param one_recv_json_message_dict: dict
+        """
+        with self.raft_peer_state.lock:
+            # update terms from candidate
+            logger.debug(" inside receive ", extra=self.my_detail)
+            # those JSON message does not have term, they are used by User.py and visualization/game
+            if one_recv_json_message_dict["msg_type"] not in ["request_command", "read_command", "villager_killed"]:
+
+                # in lease mode the leader answers reads alone, so nobody may elect another leader
+                # before its lease runs out
+                if one_recv_json_message_dict["msg_type"] == "request_vote" and self.leader_lease_holds_votes():
+                    logger.debug(" leader lease valid request vote ignored " + str(one_recv_json_message_dict),
+                                 extra=self.my_detail)
+                    return
+
+                # if my term is same as request vote sender means, I am a candidate or I receive this term msg
+                # from someone else already, there should one person who is already electing from my knowledge
+                # no reason to accept a same term requxest vote
+                if one_recv_json_message_dict["msg_type"] in ["request_vote"] and (
+                    one_recv_json_message_dict["sender_term"] == self.raft_peer_state.current_term):
+                    logger.debug(" same term request vote abort " + str(one_recv_json_message_dict),
+                                 extra=self.my_detail)
+                    return
+
+                # in Raft we always favour the largest term number
+                if one_recv_json_message_dict["sender_term"] > self.raft_peer_state.current_term:
+                    logger.debug(" see larger term " + str(one_recv_json_message_dict),
+                                 extra=self.my_detail)
+                    self.raft_peer_state.current_term = one_recv_json_message_dict["sender_term"]
+                    # leader of the new term is only known once it sends append entries
+                    self.known_leader_user_addr_port_tuple = None
+                    # current term is outdate, so if it starts voting need to stop immediately
+                    # term will reject the previous voting request actually
+                    self.raft_peer_state.peer_state = "follower"
+                    self.raft_peer_state.leader_majority_count = 0
+                    # every new term clear old vote_for, might experience new term election
+                    self.raft_peer_state.vote_for = None
+                    self.raft_peer_state.persist_term_and_vote()
+                    # force reset timer, since it is outdated not reseting only vote true then reset and receive append entries
+                    # self.timeout_counter.reset_timeout()
+                if one_recv_json_message_dict["sender_term"] < self.raft_peer_state.current_term:
+                    logger.debug(" received outdated term msg abort " + str(one_recv_json_message_dict),
+                                 extra=self.my_detail)
+                    return
+        logger.debug(" processing one recv message " + str(one_recv_json_message_dict), extra=self.my_detail)
+        # in json encode it is two element list
+        # sendpeer_addr, peer_port = one_recv_json_message_dict["send_from"]
+
+        # calling right methods to handle the different JSON data
+        receive_processing_function = self.receive_processing_functions[one_recv_json_message_dict["msg_type"]]
+        receive_processing_function(one_recv_json_message_dict)
+        # no longer the leader, the waiting reads are told to find the new one
+        if len(self.pending_reads) > 0 and self.raft_peer_state.peer_state != "leader":
             with self.raft_peer_state.lock:
-                # update terms from candidate
-                logger.debug(" inside receive ", extra=self.my_detail)
-                # those JSON message does not have term, they are used by User.py and visualization/game
-                if one_recv_json_message_dict["msg_type"] not in ["request_command", "villager_killed"]:
-
-                    # if my term is same as request vote sender means, I am a candidate or I receive this term msg
-                    # from someone else already, there should one person who is already electing from my knowledge
-                    # no reason to accept a same term requxest vote
-                    if one_recv_json_message_dict["msg_type"] in ["request_vote"] and (
-                        one_recv_json_message_dict["sender_term"] == self.raft_peer_state.current_term):
-                        logger.debug(" same term request vote abort " + str(one_recv_json_message_dict),
-                                     extra=self.my_detail)
-                        continue
+                self.serve_pending_reads()
 
-                    # in Raft we always favour the largest term number
-                    if one_recv_json_message_dict["sender_term"] > self.raft_peer_state.current_term:
-                        logger.debug(" see larger term " + str(one_recv_json_message_dict),
-                                     extra=self.my_detail)
-                        self.raft_peer_state.current_term = one_recv_json_message_dict["sender_term"]
-                        # current term is outdate, so if it starts voting need to stop immediately
-                        # term will reject the previous voting request actually
-                        self.raft_peer_state.peer_state = "follower"
-                        self.raft_peer_state.leader_majority_count = 0
-                        # every new term clear old vote_for, might experience new term election
-                        self.raft_peer_state.vote_for = None
-                        # force reset timer, since it is outdated not reseting only vote true then reset and receive append entries
-                        # self.timeout_counter.reset_timeout()
-                    if one_recv_json_message_dict["sender_term"] < self.raft_peer_state.current_term:
-                        logger.debug(" received outdated term msg abort " + str(one_recv_json_message_dict),
-                                     extra=self.my_detail)
-                        continue
-            logger.debug(" processing one recv message " + str(one_recv_json_message_dict), extra=self.my_detail)
-            # in json encode it is two element list
-            # sendpeer_addr, peer_port = one_recv_json_message_dict["send_from"]
-
-            # calling right methods to handle the different JSON data
-            one_recv_json_message_type = one_recv_json_message_dict["msg_type"]
-            receive_processing_functions = {"append_entries_follower_reply": self.process_append_entries_follower_reply,
-                                            "append_entries_leader": self.process_append_entries_leader,
-                                            "request_vote_reply": self.process_request_vote_reply,
-                                            "request_vote": self.process_request_vote,
-                                            "request_command": self.process_request_command,
-                                            "villager_killed": self.process_killed}
-            receive_processing_function = receive_processing_functions[one_recv_json_message_type]
-            receive_processing_function(one_recv_json_message_dict)
 
     def process_killed(self, one_recv_json_message_type):
         """
@@ -293,36 +691,258 @@ class RaftPeer:
             if self.raft_peer_state.peer_state == "leader":
 
                 if one_recv_json_message_type["request_command_list"] == []:
-                    self.json_message_send_queue.put({"msg_type": "request_command_reply",
-                                                      "command_result": "is_leader",
-                                                      "send_from": list(self.user_socket.getsockname()),
-                                                      "send_to": list(one_recv_json_message_type["send_from"]),
-                                                      "sender_term": self.raft_peer_state.current_term})
+                    self.put_user_reply("request_command_reply", one_recv_json_message_type["send_from"],
+                                        "is_leader", one_recv_json_message_type.get("request_id"))
                     return
-                temp_log = LogData(len(self.raft_peer_state.state_log),
+                request_command_action_list = one_recv_json_message_type["request_command_list"]
+                if "client_id" in one_recv_json_message_type:
+                    client_id = one_recv_json_message_type["client_id"]
+                    client_seq = one_recv_json_message_type["client_seq"]
+                    # a retry of a command already applied is answered without adding it again
+                    applied, command_result = self.raft_peer_state.remote_var.session_result(client_id, client_seq)
+                    if applied:
+                        self.put_user_reply("request_command_reply", one_recv_json_message_type["send_from"],
+                                            command_result, one_recv_json_message_type.get("request_id"))
+                        return
+                    # the session goes with the command in the log, so every peer skips the same duplicates
+                    request_command_action_list = list(request_command_action_list[0:3]) + \
+                                                  [[client_id, client_seq,
+                                                    one_recv_json_message_type.get("client_ack_seq", 0)]]
+                temp_log = LogData(self.raft_peer_state.log_length(),
                                    self.raft_peer_state.current_term,
-                                   one_recv_json_message_type["request_command_list"],
-                                   (one_recv_json_message_type["send_from"]))
-                temp_log.increment_majority_count()
-                # temp_log.one_log.check_over_majority((self.max_peer_number/2)+1)
+                                   request_command_action_list,
+                                   (one_recv_json_message_type["send_from"]),
+                                   request_id=one_recv_json_message_type.get("request_id"))
 
-                self.raft_peer_state.state_log.append(temp_log)
+                # only buffered here, the fsync is shared with other commands before next append entries
+                self.raft_peer_state.append_log(temp_log)
+                # send it without waiting for the heart beat, commands within the window go together
+                self.timeout_counter.schedule_replication(self.replication_coalescing_window)
 
                 if self.visualizaiton_on:
-                    one_recv_json_message_type_deep_copy = copy.deepcopy(one_recv_json_message_type)
-                    one_recv_json_message_type_deep_copy["msg_type"] = "request_command_ack"
-                    one_recv_json_message_type_deep_copy["send_from"] = list(self.raft_peer_state.my_addr_port_tuple)
-                    one_recv_json_message_type_deep_copy["send_to"] = list(self.visualization_addr_port_tuple)
-                    one_recv_json_message_type_deep_copy["sender_term"] = self.raft_peer_state.current_term
-                    one_recv_json_message_type_deep_copy["index"] = temp_log.log_index
-                    self.json_message_send_queue.put(one_recv_json_message_type_deep_copy)
+                    self.visualization_tap.record("request_command_ack",
+                                                  request_command_list=list(
+                                                      one_recv_json_message_type["request_command_list"]),
+                                                  sender_term=self.raft_peer_state.current_term,
+                                                  index=temp_log.log_index)
+
+            elif one_recv_json_message_type["request_command_list"] != [] and \
+                    self.forward_to_leader(one_recv_json_message_type):
+                return
+            else:
+                self.put_user_reply("request_command_reply", one_recv_json_message_type["send_from"],
+                                    "not_leader", one_recv_json_message_type.get("request_id"))
+
+    def forward_to_leader(self, one_recv_json_message_dict):
+        """
+        hand the user's command to the LeaderForwarder if forwarding is on and the leader is known,
+        the caller must hold the raft_peer_state lock.
+
+        :param one_recv_json_message_dict: dict
+        :return: bool, False if the user should be told to find the leader itself
+        """
+        if self.leader_forwarder is None or self.known_leader_user_addr_port_tuple is None or \
+                one_recv_json_message_dict.get("forwarded", False):
+            return False
+        self.leader_forwarder.forward(one_recv_json_message_dict, tuple(one_recv_json_message_dict["send_from"]),
+                                      self.known_leader_user_addr_port_tuple)
+        return True
+
+    def relay_forwarded_reply(self, user_addr_port_tuple, reply_dict):
+        """
+        send the leader's reply of a forwarded command back to the user, called by the LeaderForwarder,
+        the leader hint is filled in by the state loop
+
+        :param user_addr_port_tuple: (str, int)
+        :param reply_dict: dict
+        """
+        self.put_state_event(StateEvent.forwarded_reply, (user_addr_port_tuple, reply_dict))
+
+    def process_forwarded_reply(self, payload):
+        user_addr_port_tuple, reply_dict = payload
+        reply_dict["send_from"] = list(self.user_socket.getsockname())
+        reply_dict["send_to"] = list(user_addr_port_tuple)
+        if reply_dict.get("command_result") == "not_leader" and reply_dict.get("leader_hint") is None:
+            reply_dict["leader_hint"] = self.leader_hint()
+        self.json_message_send_queue.put(reply_dict)
+
+    def leader_hint(self):
+        # user port of the leader as far as this peer knows, None during elections
+        if self.raft_peer_state.peer_state == "leader":
+            return list(self.raft_peer_state.my_user_addr_port_tuple)
+        if self.known_leader_user_addr_port_tuple is None:
+            return None
+        return list(self.known_leader_user_addr_port_tuple)
+
+    def put_user_reply(self, msg_type, user_addr_port_tuple, command_result, request_id=None):
+        """
+        reply to a user, not_leader replies tell the user where the leader is
 
+        :param msg_type: str, request_command_reply or read_command_reply
+        :param user_addr_port_tuple: (str, int)
+        :param command_result: value of the variable, "is_leader" or "not_leader"
+        :param request_id: echoed if the user sent one
+        """
+        user_reply = {"msg_type": msg_type,
+                      "command_result": command_result,
+                      "send_from": list(self.user_socket.getsockname()),
+                      "send_to": list(user_addr_port_tuple),
+                      "sender_term": self.raft_peer_state.current_term}
+        if msg_type == "read_command_reply":
+            # applied_index lets the user ask the next read not to go back before it
+            user_reply["applied_index"] = self.raft_peer_state.last_apply
+        if command_result == "not_leader":
+            user_reply["leader_hint"] = self.leader_hint()
+        if request_id is not None:
+            user_reply["request_id"] = request_id
+        self.queue_user_reply(user_reply)
+
+    def queue_user_reply(self, user_reply):
+        """
+        send the reply, or keep it for the user's batch while one is being collected,
+        the caller must hold the raft_peer_state lock
+
+        :param user_reply: dict
+        """
+        if self.user_reply_batches is None:
+            self.json_message_send_queue.put(user_reply)
+            return
+        self.user_reply_batches.setdefault(tuple(user_reply["send_to"]), []).append(user_reply)
+
+    def start_user_reply_batches(self):
+        # the caller must hold the raft_peer_state lock and call put_user_reply_batches before releasing it
+        self.user_reply_batches = {}
+
+    def put_user_reply_batches(self):
+        """
+        send the replies collected since start_user_reply_batches, a user with more than one
+        gets them in one request_command_reply_batch, each reply keeps its request_id
+        """
+        user_reply_batches = self.user_reply_batches
+        self.user_reply_batches = None
+        for user_addr_port_tuple, user_replies in user_reply_batches.items():
+            if len(user_replies) == 1:
+                self.json_message_send_queue.put(user_replies[0])
+                continue
+            self.json_message_send_queue.put({"msg_type": "request_command_reply_batch",
+                                              "send_from": user_replies[0]["send_from"],
+                                              "send_to": list(user_addr_port_tuple),
+                                              "sender_term": self.raft_peer_state.current_term,
+                                              "replies": [{key: value for key, value in one_reply.items()
+                                                           if key not in ("send_from", "send_to", "sender_term")}
+                                                          for one_reply in user_replies]})
+
+    def process_read_command(self, one_recv_json_message_dict):
+        """
+
+        Processing the read_command from user, the value is read from the remote_var
+        without adding a log. Leader records its commit index as the read index, confirms
+        it is still the leader with one read round and replies once the read index is applied.
+
+        Followers answer it right away if the user accepts a stale value, with
+        max_staleness_index (logs applied behind the leader's commit index) or
+        max_staleness_ms (since the last append entries from the leader), and
+        min_applied_index for reads that must not go back in time.
+
+        :param one_recv_json_message_dict: dict
+        """
+        with self.raft_peer_state.lock:
+            var_name = str(one_recv_json_message_dict["read_command_list"][0])
+            user_addr_port_tuple = tuple(one_recv_json_message_dict["send_from"])
+            request_id = one_recv_json_message_dict.get("request_id")
+            if self.raft_peer_state.peer_state != "leader":
+                if self.follower_read_allowed(one_recv_json_message_dict):
+                    self.put_user_reply("read_command_reply", user_addr_port_tuple,
+                                        self.raft_peer_state.remote_var.read_var(var_name), request_id)
+                elif not self.forward_to_leader(one_recv_json_message_dict):
+                    self.put_user_reply("read_command_reply", user_addr_port_tuple, "not_leader", request_id)
+                return
+            read_index = self.raft_peer_state.commit_index
+            # a new leader only knows what is committed once it commits a log of its own term
+            if self.raft_peer_state.get_log_term(read_index) != self.raft_peer_state.current_term:
+                read_index = self.raft_peer_state.first_index_of_term(self.raft_peer_state.current_term)
+                if read_index == -1:
+                    noop_log = LogData(self.raft_peer_state.log_length(), self.raft_peer_state.current_term,
+                                       ["", "noop", 0])
+                    self.raft_peer_state.append_log(noop_log)
+                    read_index = noop_log.log_index
+                    self.timeout_counter.schedule_replication(self.replication_coalescing_window)
+            if self.read_lease_valid():
+                read_round = 0
             else:
-                self.json_message_send_queue.put({"msg_type": "request_command_reply",
-                                                  "command_result": "not_leader",
-                                                  "send_from": self.user_socket.getsockname(),
-                                                  "send_to": list(one_recv_json_message_type["send_from"]),
-                                                  "sender_term": self.raft_peer_state.current_term})
+                # the next round starts after this read arrived, reads within the coalescing window share it
+                read_round = self.raft_peer_state.read_round + 1
+                self.read_round_requested = True
+                self.timeout_counter.schedule_replication(self.replication_coalescing_window)
+            self.pending_reads.append([read_round, read_index, var_name, user_addr_port_tuple, request_id])
+            self.serve_pending_reads()
+
+    def serve_pending_reads(self):
+        """
+        reply to the reads whose round is confirmed and whose read index is applied,
+        or tell all of them to find the leader if this peer is no longer the leader,
+        the caller must hold the raft_peer_state lock.
+        """
+        if self.raft_peer_state.peer_state != "leader":
+            for read_round, read_index, var_name, user_addr_port_tuple, request_id in self.pending_reads:
+                self.put_user_reply("read_command_reply", user_addr_port_tuple, "not_leader", request_id)
+            self.pending_reads = []
+            return
+        confirmed_read_round = self.raft_peer_state.confirmed_read_round(self.max_peer_number)
+        waiting_reads = []
+        for one_read in self.pending_reads:
+            read_round, read_index, var_name, user_addr_port_tuple, request_id = one_read
+            if read_round > confirmed_read_round or read_index > self.raft_peer_state.last_apply:
+                waiting_reads.append(one_read)
+                continue
+            self.put_user_reply("read_command_reply", user_addr_port_tuple,
+                                self.raft_peer_state.remote_var.read_var(var_name), request_id)
+        self.pending_reads = waiting_reads
+
+    def follower_read_allowed(self, one_recv_json_message_dict):
+        """
+        whether this follower's remote_var is within the staleness the user accepts,
+        a read without any staleness bound always goes to the leader
+
+        :param one_recv_json_message_dict: dict
+        :return: bool
+        """
+        max_staleness_index = one_recv_json_message_dict.get("max_staleness_index")
+        max_staleness_ms = one_recv_json_message_dict.get("max_staleness_ms")
+        if (max_staleness_index is None and max_staleness_ms is None) or self.last_leader_contact_time is None:
+            return False
+        if int(one_recv_json_message_dict.get("min_applied_index", -1)) > self.raft_peer_state.last_apply:
+            return False
+        if max_staleness_index is not None and \
+                self.known_leader_commit_index - self.raft_peer_state.last_apply > int(max_staleness_index):
+            return False
+        if max_staleness_ms is not None and \
+                (time.monotonic() - self.last_leader_contact_time) * 1000 > float(max_staleness_ms):
+            return False
+        return True
+
+    def read_lease_valid(self):
+        """
+        the leader is sure no other leader exists until the lease runs out, a lease starts with
+        a read round echoed by the majority and lasts read_lease_timeout, the caller must hold the
+        raft_peer_state lock.
+
+        :return: bool
+        """
+        if self.read_lease_timeout <= 0 or self.raft_peer_state.peer_state != "leader":
+            return False
+        confirmed_read_round = self.raft_peer_state.confirmed_read_round(self.max_peer_number)
+        read_round_start_time = self.raft_peer_state.read_round_start_time.get(confirmed_read_round)
+        return read_round_start_time is not None and \
+               time.monotonic() < read_round_start_time + self.read_lease_timeout
+
+    def leader_lease_holds_votes(self):
+        if self.read_lease_timeout <= 0:
+            return False
+        if self.raft_peer_state.peer_state == "leader":
+            return self.read_lease_valid()
+        return self.last_leader_contact_time is not None and \
+               time.monotonic() - self.last_leader_contact_time < self.min_leader_election_timeout
 
     def process_append_entries_follower_reply(self, one_recv_json_message_dict):
         """
@@ -347,30 +967,44 @@ class RaftPeer:
         log_index_end = int(one_recv_json_message_dict["log_index_end"])
 
         with self.raft_peer_state.lock:
+            # accepted or rejected, the follower still takes us as the leader of this term
+            self.raft_peer_state.acknowledge_read_round(tuple(one_recv_json_message_dict["send_from"]),
+                                                        int(one_recv_json_message_dict.get("read_round", 0)))
+            if len(self.pending_reads) > 0:
+                # one round confirms all the reads waiting for it
+                self.start_user_reply_batches()
+                self.serve_pending_reads()
+                self.put_user_reply_batches()
             # heart beat if reply is true, and log start = -1, log end = -1
             if one_recv_json_message_dict["append_entries_result"] == True:
-                # increase this peer's next index
-                self.raft_peer_state.peers_match_index[tuple(one_recv_json_message_dict["send_from"])] = \
-                self.raft_peer_state.peers_next_index[tuple(one_recv_json_message_dict["send_from"])]
+                send_from = tuple(one_recv_json_message_dict["send_from"])
+                # follower's log matches leader's up to the last log it just added, or up to prev log for heartbeat
+                if log_index_end != -1:
+                    replied_match_index = log_index_end
+                else:
+                    replied_match_index = int(one_recv_json_message_dict.get("prev_log_index", -1))
+                self.raft_peer_state.peers_match_index[send_from] = max(
+                    self.raft_peer_state.peers_match_index[send_from], replied_match_index)
 
                 # print(" log_index_start " + str(log_index_start) + " log_index_end " + str(log_index_end))
 
-                for one_log in self.raft_peer_state.state_log[log_index_start:(log_index_end + 1)]:
-                    self.raft_peer_state.peers_next_index[tuple(one_recv_json_message_dict["send_from"])] += 1
-                    one_log.majority_count += 1
-                    if one_log.check_over_majority((self.max_peer_number // 2) + 1):
-                        with self.raft_peer_state.remote_var.lock:
-
-                            self.raft_peer_state.commit_index = one_log.log_index
-                            self.raft_peer_state.last_apply = self.raft_peer_state.commit_index
-
-                            if one_log.log_applied == False:
+                # the same batch could be acknowledged twice if it is resent by heartbeat, so never move next index back
+                if log_index_end != -1:
+                    self.raft_peer_state.peers_next_index[send_from] = max(
+                        self.raft_peer_state.peers_next_index[send_from], log_index_end + 1)
+                self.raft_peer_state.acknowledge_in_flight(send_from, self.raft_peer_state.peers_match_index[send_from])
+                self.release_encoded_entries()
+                # follower's log matches, pipeline the following batches from now on
+                if not self.raft_peer_state.peers_replicating.get(send_from, False):
+                    self.raft_peer_state.start_replicating(send_from)
+                if self.raft_peer_state.peer_state == "leader":
+                    # commit index only moves forward, so every log is put into the commit queue once
+                    for one_log in self.raft_peer_state.advance_leader_commit_index(self.max_peer_number):
+                        self.json_message_commit_queue.put(one_log)
 
-                                # make sure all log before it is applied
-                                for i in range(self.raft_peer_state.commit_index + 1):
-                                    one_temp_log = self.raft_peer_state.state_log[i]
-                                    if one_temp_log.log_applied == False:
-                                        self.json_message_commit_queue.put(one_temp_log)
+                # follower still lagging behind, stream the next batches without waiting for the heartbeat
+                if self.raft_peer_state.peer_state == "leader":
+                    self.put_pipelined_append_entries(send_from)
 
             else:
                 logger.debug(" starting process_append_entries_follower_reply False" + str(one_recv_json_message_dict),
@@ -379,10 +1013,43 @@ class RaftPeer:
                     self.raft_peer_state.peers_next_index[tuple(one_recv_json_message_dict["send_from"])]) + " " + str(
                     one_recv_json_message_dict),
                              extra=self.my_detail)
-                with self.raft_peer_state.lock:
-                    if self.raft_peer_state.peers_next_index[tuple(one_recv_json_message_dict["send_from"])] > 0:
-                        # decrease the next index if the false append entreis returned. the min next is 0
-                        self.raft_peer_state.peers_next_index[tuple(one_recv_json_message_dict["send_from"])] -= 1
+                send_from = tuple(one_recv_json_message_dict["send_from"])
+                next_index = self.raft_peer_state.peers_next_index[send_from]
+                conflict_index = int(one_recv_json_message_dict.get("conflict_index", -1))
+                rejected_prev_log_index = int(one_recv_json_message_dict.get("prev_log_index", next_index - 1))
+                if self.raft_peer_state.peers_replicating.get(send_from, False):
+                    # pipelined batch rejected, every batch after it will be rejected as well
+                    if rejected_prev_log_index < self.raft_peer_state.peers_match_index[send_from]:
+                        return
+                elif rejected_prev_log_index != next_index - 1:
+                    # reply of an older probe, next index has been moved already
+                    return
+                rejected_next_index = rejected_prev_log_index + 1
+                if conflict_index == -1:
+                    # decrease the next index if the false append entreis returned. the min next is 0
+                    new_next_index = rejected_next_index - 1
+                elif int(one_recv_json_message_dict["conflict_term"]) != -1:
+                    # jump over the whole conflicting term, or to the end of the same term in leader's log
+                    last_index_of_conflict_term = self.raft_peer_state.last_index_of_term(
+                        int(one_recv_json_message_dict["conflict_term"]))
+                    if last_index_of_conflict_term != -1:
+                        new_next_index = last_index_of_conflict_term + 1
+                    else:
+                        new_next_index = conflict_index
+                else:
+                    # follower's log is shorter, continue from its end
+                    new_next_index = conflict_index
+                # always move backward, and never before the logs follower is known to have
+                new_next_index = max(min(new_next_index, rejected_next_index - 1),
+                                     self.raft_peer_state.peers_match_index[send_from] + 1, 0)
+                # back to probe mode, one append entries at a time until the follower accepts one
+                self.raft_peer_state.start_probing(send_from, new_next_index)
+                # probe again right away instead of waiting for the next heartbeat
+                if self.raft_peer_state.peer_state == "leader" and new_next_index != next_index:
+                    if new_next_index <= self.raft_peer_state.snapshot_last_index:
+                        self.put_install_snapshot(send_from)
+                    else:
+                        self.put_append_entries(send_from, "append")
 
 
             # match index can only increase, so we only record when it is true, it is always one less than nextIndex
@@ -405,10 +1072,15 @@ class RaftPeer:
             # when received heart beat from leader, reset self timeout of starting new election
             # reset timeout to eleciton timeout
             self.timeout_counter.reset_timeout()
+            self.last_leader_contact_time = time.monotonic()
+            self.known_leader_commit_index = int(one_recv_json_message_dict["leader_commit_index"])
+            if one_recv_json_message_dict.get("leader_user_addr") is not None:
+                self.known_leader_user_addr_port_tuple = tuple(one_recv_json_message_dict["leader_user_addr"])
             # if JSON come here means, the term is either equal to current peer or greater so
             # to be safe set it to follower
             self.raft_peer_state.peer_state = "follower"
             self.raft_peer_state.vote_for = None
+            self.raft_peer_state.persist_term_and_vote()
             append_entries_follower = AppendEntriesFollower(one_recv_json_message_dict, self.raft_peer_state,
                                                             self.json_message_commit_queue)
 
@@ -419,20 +1091,99 @@ class RaftPeer:
                     temp_processed_append_entries_result_json["append_entries_result"] and \
                     temp_processed_append_entries_result_json["log_index_start"] != -1 and \
                     temp_processed_append_entries_result_json["log_index_end"] != -1:
-
-                time.sleep(float("{0:.2f}".format(random.uniform(0, self.append_entries_heart_beat_time_out))))
-                temp_processed_append_entries_result_json_deep_copy = copy.deepcopy(temp_processed_append_entries_result_json)
-                temp_processed_append_entries_result_json_deep_copy["send_to"] = list(self.visualization_addr_port_tuple)
                 # note that leader append entries used the key 'leader_commit_index' which is different key used in here
-                temp_processed_append_entries_result_json_deep_copy["sender_commit_index"] = self.raft_peer_state.current_term
-                self.json_message_send_queue.put(temp_processed_append_entries_result_json_deep_copy)
-                print (" sent append reply to visual ")
+                self.visualization_tap.record("append_entries_follower_reply", append_entries_result=True,
+                                              log_index_start=temp_processed_append_entries_result_json[
+                                                  "log_index_start"],
+                                              log_index_end=temp_processed_append_entries_result_json[
+                                                  "log_index_end"],
+                                              sender_term=self.raft_peer_state.current_term,
+                                              sender_commit_index=self.raft_peer_state.commit_index)
 
             self.json_message_send_queue.put(temp_processed_append_entries_result_json)
-            logger.debug(" after append entries from leader => \n " + str(self.raft_peer_state),
-                         extra=self.my_detail)
+            # the whole state grows with the log, only its summary is logged for every append entries
+            logger.debug(" after append entries from leader => log length " + str(self.raft_peer_state.log_length()) +
+                         " commit index " + str(self.raft_peer_state.commit_index) +
+                         " last apply " + str(self.raft_peer_state.last_apply), extra=self.my_detail)
         logger.debug(" finished process_append_entries_leader " + str(one_recv_json_message_dict), extra=self.my_detail)
 
+    def process_install_snapshot(self, one_recv_json_message_dict):
+        """
+        This method is used to process one snapshot chunk sent from the leader to
+        follower, the snapshot replaces the remote_var after the last chunk is received.
+
+        :param one_recv_json_message_dict: dict
+
+        """
+        logger.debug(" starting process_install_snapshot " + str(one_recv_json_message_dict["offset"]),
+                     extra=self.my_detail)
+        with self.raft_peer_state.lock:
+            # snapshot chunk is sent by leader as well, so it works like a heartbeat
+            self.timeout_counter.reset_timeout()
+            self.raft_peer_state.peer_state = "follower"
+            self.raft_peer_state.vote_for = None
+            self.raft_peer_state.persist_term_and_vote()
+            install_snapshot_follower = InstallSnapshotFollower(one_recv_json_message_dict, self.raft_peer_state)
+            installed_snapshot = self.raft_peer_state.snapshot
+            self.json_message_send_queue.put(install_snapshot_follower.process_install_snapshot())
+            if self.raft_peer_state.snapshot is not installed_snapshot:
+                # the apply stage restores the remote_var from it after the logs committed before it
+                self.json_message_commit_queue.put(self.raft_peer_state.snapshot)
+        logger.debug(" finished process_install_snapshot ", extra=self.my_detail)
+
+    def process_install_snapshot_reply(self, one_recv_json_message_dict):
+        """
+        This method is for 'leader' to stream the next snapshot chunk as soon as the previous
+        one is received, after the last chunk the follower continues with append entries
+        from the log after the snapshot.
+
+        :param one_recv_json_message_dict: dict
+
+        """
+        logger.debug(" starting process_install_snapshot_reply " + str(one_recv_json_message_dict),
+                     extra=self.my_detail)
+        send_from = tuple(one_recv_json_message_dict["send_from"])
+        last_included_index = int(one_recv_json_message_dict["last_included_index"])
+        with self.raft_peer_state.lock:
+            if self.raft_peer_state.peer_state != "leader" or send_from not in self.raft_peer_state.peers_next_index:
+                return
+            next_offset = int(one_recv_json_message_dict["next_offset"])
+            # the reply of a chunk resent after the timeout, the chunk after it is already waiting for its own
+            if not one_recv_json_message_dict["done"] and \
+                    last_included_index == self.raft_peer_state.snapshot_last_index and \
+                    send_from in self.raft_peer_state.peers_snapshot_send_time and \
+                    next_offset == self.raft_peer_state.peers_snapshot_offset.get(send_from, 0):
+                return
+            self.raft_peer_state.peers_snapshot_send_time.pop(send_from, None)
+            if one_recv_json_message_dict["done"]:
+                self.raft_peer_state.peers_snapshot_offset.pop(send_from, None)
+                if self.raft_peer_state.peers_next_index[send_from] <= last_included_index:
+                    self.raft_peer_state.peers_next_index[send_from] = last_included_index + 1
+                    self.raft_peer_state.peers_match_index[send_from] = last_included_index
+                return
+            # leader compacted again while sending, the next heartbeat starts the new snapshot from 0
+            if last_included_index != self.raft_peer_state.snapshot_last_index:
+                self.raft_peer_state.peers_snapshot_offset[send_from] = 0
+                return
+            self.raft_peer_state.peers_snapshot_offset[send_from] = next_offset
+            self.put_install_snapshot(send_from)
+
+    def put_install_snapshot(self, peer_addr_port_tuple):
+        """
+
+        send the snapshot chunk at the offset the follower expects, nothing is sent while the
+        previous chunk waits for its reply, unless it was sent snapshot_chunk_timeout ago
+
+        :param peer_addr_port_tuple: (str, int)
+        """
+        now = time.monotonic()
+        send_time = self.raft_peer_state.peers_snapshot_send_time.get(peer_addr_port_tuple)
+        if send_time is not None and now - send_time < self.snapshot_chunk_timeout:
+            return
+        self.raft_peer_state.peers_snapshot_send_time[peer_addr_port_tuple] = now
+        self.json_message_send_queue.put(InstallSnapshotLeader(self.raft_peer_state, peer_addr_port_tuple,
+                                                               self.snapshot_chunk_size).return_instance_vars_in_dict())
+
     def process_request_vote_reply(self, one_recv_json_message_dict):
         """
         
@@ -457,14 +1208,8 @@ class RaftPeer:
                 if self.raft_peer_state.peer_state == "leader":
 
                     if self.visualizaiton_on:
-                        leadership_json = {
-                            "msg_type": "leadership",
-                            "sender_term": self.raft_peer_state.current_term,
-                            "send_from": self.raft_peer_state.my_addr_port_tuple,
-                            "send_to": list(self.visualization_addr_port_tuple),
-                            "peer_id": self.raft_peer_state.peer_id
-                        }
-                        self.json_message_send_queue.put(leadership_json)
+                        self.visualization_tap.record("leadership", sender_term=self.raft_peer_state.current_term,
+                                                      peer_id=self.raft_peer_state.peer_id)
 
                     logger.debug(" I am leader ", extra=self.my_detail)
                     # init nextIndex[] and matchIndex[]
@@ -506,24 +1251,48 @@ class RaftPeer:
                 self.timeout_counter.reset_timeout()
 
             if self.visualizaiton_on:
-                temp_request_vote_result_deep_copy = copy.deepcopy(temp_request_vote_result)
-                temp_request_vote_result_deep_copy["send_to"] = list(self.visualization_addr_port_tuple)
-                self.json_message_send_queue.put(temp_request_vote_result_deep_copy)
+                self.visualization_tap.record("request_vote_reply", peer_id=temp_request_vote_result["peer_id"],
+                                              vote_peer_id=temp_request_vote_result["vote_peer_id"],
+                                              sender_term=temp_request_vote_result["sender_term"],
+                                              vote_granted=temp_request_vote_result["vote_granted"])
 
             self.json_message_send_queue.put(temp_request_vote_result)
         logger.debug(" finished process_request_vote " + str(one_recv_json_message_dict), extra=self.my_detail)
 
-    def process_json_message_send_queue(self):
+    def create_outbound_writer(self, destination_addr_port_tuple):
         """
-        This method will be invoked in an independent thread for sending JSON from sending queue.
-        
+        This method starts the writer thread of one destination and returns its queue,
+        it is called by the OutboundRouter the first time a message is sent to this destination.
+
+        :param destination_addr_port_tuple: (str, int)
+        :return: OutboundQueue
+        """
+        outbound_queue = OutboundQueue(self.outbound_queue_size)
+        writer_thread = threading.Thread(target=self.process_outbound_queue,
+                                         args=(destination_addr_port_tuple, outbound_queue))
+        writer_thread.daemon = True
+        writer_thread.start()
+        logger.debug(" start thread => outbound writer of " + str(destination_addr_port_tuple), extra=self.my_detail)
+        return outbound_queue
+
+    def process_outbound_queue(self, destination_addr_port_tuple, outbound_queue):
+        """
+        This method will be invoked in an independent thread for each destination, a blocking sendall
+        to a slow destination only delays the messages sent to it.
+
+        :param destination_addr_port_tuple: (str, int)
+        :param outbound_queue: OutboundQueue
         """
         while True:
-            one_json_data_dict = self.json_message_send_queue.get()
+            one_json_data_dict = outbound_queue.get(self.outbound_writer_idle_timeout)
+            if one_json_data_dict is None:
+                # users come and go, stop the writer of anything that is not a peer once it is idle
+                if destination_addr_port_tuple not in self.peers_addr_client_socket and \
+                        self.json_message_send_queue.remove_if_idle(destination_addr_port_tuple, outbound_queue):
+                    return
+                continue
             logger.debug(" processing one send message " + str(one_json_data_dict), extra=self.my_detail)
-            # in json encode it is two element list
-            peer_addr, peer_port = one_json_data_dict["send_to"]
-            self.send_to_peer((peer_addr, peer_port), one_json_data_dict)
+            self.send_to_peer(destination_addr_port_tuple, one_json_data_dict)
 
     def start_connect_to_all_peer_thread(self, peer_addr_port_tuple_list):
         """
@@ -589,8 +1358,77 @@ class RaftPeer:
         client_socket = socket.socket()
         logger.debug("raft peer connect to " + str(peer_addr_port_tuple), extra=self.my_detail)
         client_socket.connect(peer_addr_port_tuple)
+        if self.preferred_wire_codec == JsonCodec.codec_name:
+            self.peers_addr_codec[peer_addr_port_tuple] = self.json_codec
+        else:
+            self.peers_addr_codec[peer_addr_port_tuple] = self.negotiate_wire_codec(client_socket)
         self.peers_addr_client_socket[peer_addr_port_tuple] = client_socket
 
+    def negotiate_wire_codec(self, client_socket):
+        """
+
+        Send codec_hello as the first JSON line and wait for the remote peer to pick a codec,
+        peers without codec_hello never answer it (its term is lower than any real term),
+        so JSON is used after the timeout.
+
+        :param client_socket: socket
+        :return: JsonCodec or BinaryCodec
+        """
+        reply = None
+        try:
+            client_socket.sendall(self.json_codec.encode_frame(self.create_codec_hello()))
+            client_socket.settimeout(self.codec_hello_timeout)
+            frame_reader = FrameReader(client_socket)
+            while reply is None:
+                for payload in frame_reader.read_frames():
+                    reply = self.json_codec.decode(payload)
+                    break
+            codec_name = reply["codec"]
+        except Exception as e:
+            logger.debug(" codec_hello not answered use json " + str(e), extra=self.my_detail)
+            codec_name = JsonCodec.codec_name
+        finally:
+            client_socket.settimeout(None)
+        logger.debug(" negotiated wire codec " + str(codec_name), extra=self.my_detail)
+        return self.wire_codecs.get(codec_name, self.json_codec)
+
+    def create_codec_hello(self):
+        # codecs in the order this peer prefers them
+        return {"msg_type": "codec_hello",
+                "codecs": [self.preferred_wire_codec, JsonCodec.codec_name],
+                "sender_term": -2,
+                "send_from": list(self.my_addr_port_tuple)}
+
+    def reply_codec_hello(self, peer_socket, codec_hello):
+        """
+
+        Pick the first codec in codec_hello that this peer supports and answer it on the same socket,
+        everything after codec_hello on this socket is framed by the picked codec.
+
+        :param peer_socket: socket
+        :param codec_hello: dict
+        :return: JsonCodec or BinaryCodec
+        """
+        codec_name = JsonCodec.codec_name
+        if self.preferred_wire_codec != JsonCodec.codec_name:
+            for one_codec_name in codec_hello["codecs"]:
+                if one_codec_name in self.wire_codecs:
+                    codec_name = one_codec_name
+                    break
+        self.write_frame(peer_socket, self.json_codec.encode_frame({"msg_type": "codec_hello_reply",
+                                                                   "codec": codec_name}))
+        return self.wire_codecs[codec_name]
+
+    def write_frame(self, peer_socket, serialized_frame):
+        """
+
+        write one encoded frame to the connection
+
+        :param peer_socket: socket
+        :param serialized_frame: bytes
+        """
+        peer_socket.sendall(serialized_frame)
+
     # listen from user and other peer servers
     def accept(self, socket, peers_addr_listen_socket):
         """
@@ -607,15 +1445,26 @@ class RaftPeer:
             peers_addr_listen_socket[peer_addr_port_tuple] = peer_socket
             logger.debug(" recv socket from " + str(peer_addr_port_tuple), extra=self.my_detail)
             try:
-                temp_thread = threading.Thread(target=self.receive_from_one_peer_newline_delimiter,
-                                               args=(peer_addr_port_tuple,))
-                temp_thread.daemon = True
-                temp_thread.start()
+                self.start_receive_thread(peer_addr_port_tuple)
                 # _thread.start_new_thread(self.receive_from_one_peer_newline_delimiter, (peer_addr_port_tuple, ))
                 logger.debug(" creating recv thread successful => " + str(peer_addr_port_tuple), extra=self.my_detail)
             except Exception as e:
                 logger.debug(" creating recv thread failed => " + str(peer_addr_port_tuple), extra=self.my_detail)
 
+    def start_receive_thread(self, peer_addr_port_tuple):
+        """
+
+        start one thread receiving from the socket of this addr_port_tuple
+
+        :param peer_addr_port_tuple: (str, int)
+        :return: Thread
+        """
+        receive_thread = threading.Thread(target=self.receive_from_one_peer_newline_delimiter,
+                                          args=(peer_addr_port_tuple,))
+        receive_thread.daemon = True
+        receive_thread.start()
+        return receive_thread
+
     def close(self):
         """
         close all socket when exit
@@ -651,8 +1500,10 @@ class RaftPeer:
             self.raft_peer_state.peer_state = "candidate"
             # every new election need to increase current term
             self.raft_peer_state.current_term += 1
+            self.known_leader_user_addr_port_tuple = None
             # vote self
             self.raft_peer_state.leader_majority_count = 1
+            self.raft_peer_state.persist_term_and_vote()
             socket_keys = self.peers_addr_client_socket.keys()
             temp_request_vote = None
             # logger.debug(" before loop ", extra=self.my_detail)
@@ -660,11 +1511,10 @@ class RaftPeer:
                 # logger.debug(" in loop ", extra=self.my_detail)
                 temp_request_vote = RequestVote(self.raft_peer_state, one_add_port_tuple).return_instance_vars_in_dict()
                 self.json_message_send_queue.put(temp_request_vote)
-            if self.visualizaiton_on and len(socket_keys) is not 0:
+            if self.visualizaiton_on and len(socket_keys) != 0:
                 # send to visualization one request json among all other peers
-                temp_request_vote_deep_copy = copy.deepcopy(temp_request_vote)
-                temp_request_vote_deep_copy["send_to"] = list(self.visualization_addr_port_tuple)
-                self.json_message_send_queue.put(temp_request_vote_deep_copy)
+                self.visualization_tap.record("request_vote", peer_id=self.raft_peer_state.peer_id,
+                                              sender_term=self.raft_peer_state.current_term)
         logger.debug(" finished request vote to all peers as client ", extra=self.my_detail)
 
     def put_sent_to_all_peer_append_entries_heart_beat(self):
@@ -675,25 +1525,117 @@ class RaftPeer:
         """
         logger.debug(" sending append entries heart beats to all peers as client ", extra=self.my_detail)
         with self.raft_peer_state.lock:
-            log_len = len(self.raft_peer_state.state_log)
+            log_len = self.raft_peer_state.log_length()
             append_entries_heart_beat_leader = None
-            for one_add_port_tuple in self.peers_addr_client_socket.keys():
+            # every heart beat renews the lease
+            if self.read_lease_timeout > 0:
+                self.raft_peer_state.start_read_round(time.monotonic())
+            for one_add_port_tuple in list(self.peers_addr_client_socket.keys()):
+                if one_add_port_tuple not in self.raft_peer_state.peers_next_index:
+                    self.raft_peer_state.add_peer_next_and_match_index(one_add_port_tuple)
+                # logs this peer needs are compacted, send the snapshot chunk instead, or send it
+                # again when its reply is overdue
+                if self.raft_peer_state.peers_next_index[one_add_port_tuple] <= \
+                        self.raft_peer_state.snapshot_last_index:
+                    self.put_install_snapshot(one_add_port_tuple)
+                    continue
+                # nothing pipelined was acknowledged within a heartbeat interval, some batch is lost
+                oldest_in_flight_send_time = self.raft_peer_state.oldest_in_flight_send_time(one_add_port_tuple)
+                if oldest_in_flight_send_time is not None and \
+                        time.monotonic() - oldest_in_flight_send_time > self.append_entries_heart_beat_time_out:
+                    self.raft_peer_state.start_probing(one_add_port_tuple,
+                                                       self.raft_peer_state.peers_match_index[one_add_port_tuple] + 1)
                 # this peer is uptodated and we have no new entries just send empty heartbeat
                 if self.raft_peer_state.peers_next_index[one_add_port_tuple] == log_len or \
-                                self.raft_peer_state.peers_match_index == log_len:
-                    append_entries_heart_beat_leader = AppendEntriesLeader(self.raft_peer_state, one_add_port_tuple,
-                                                                           "heartbeat").return_instance_vars_in_dict()
+                                self.raft_peer_state.peers_match_index[one_add_port_tuple] == log_len - 1:
+                    # logs sent within this heart beat interval already told the peer we are alive
+                    if one_add_port_tuple in self.peers_last_append_time and time.monotonic() - \
+                            self.peers_last_append_time[one_add_port_tuple] < self.append_entries_heart_beat_time_out:
+                        continue
+                    append_entries_heart_beat_leader = self.put_append_entries(one_add_port_tuple, "heartbeat")
                 else:
-                    append_entries_heart_beat_leader = AppendEntriesLeader(self.raft_peer_state, one_add_port_tuple,
-                                                                           "append").return_instance_vars_in_dict()
-                self.json_message_send_queue.put(append_entries_heart_beat_leader)
-            if self.visualizaiton_on:
-                # send one copy of appendentries to visualization even though peers getting different append entries
-                append_entries_heart_beat_leader_deep_copy = copy.deepcopy(append_entries_heart_beat_leader)
-                append_entries_heart_beat_leader_deep_copy["send_to"] = self.visualization_addr_port_tuple
-                append_entries_heart_beat_leader_deep_copy["new_entries"] = []
-                self.json_message_send_queue.put(append_entries_heart_beat_leader_deep_copy)
+                    self.put_pipelined_append_entries(one_add_port_tuple)
+            if self.visualizaiton_on and append_entries_heart_beat_leader is not None:
+                # send one heartbeat to visualization even though peers getting different append entries
+                self.visualization_tap.record("append_entries_leader", peer_id=self.raft_peer_state.peer_id,
+                                              sender_term=self.raft_peer_state.current_term, new_entries=[])
+
 
+    def put_sent_to_all_peer_new_entries(self):
+        """
+
+        send the logs added by users to every peer missing them, called by the timeout counter
+        once the coalescing window after the first of these logs is over
+
+        """
+        with self.raft_peer_state.lock:
+            if self.raft_peer_state.peer_state != "leader":
+                return
+            log_len = self.raft_peer_state.log_length()
+            read_round_requested = self.read_round_requested
+            if read_round_requested:
+                self.read_round_requested = False
+                self.raft_peer_state.start_read_round(time.monotonic())
+            for one_add_port_tuple in list(self.peers_addr_client_socket.keys()):
+                next_index = self.raft_peer_state.peers_next_index.get(one_add_port_tuple)
+                # peers behind the snapshot get it with the heart beat
+                if next_index is None or next_index <= self.raft_peer_state.snapshot_last_index:
+                    continue
+                if next_index >= log_len:
+                    # up to date peers only need the read round
+                    if read_round_requested:
+                        self.put_append_entries(one_add_port_tuple, "heartbeat")
+                    continue
+                self.put_pipelined_append_entries(one_add_port_tuple)
+
+    def put_append_entries(self, peer_addr_port_tuple, append_entries_type):
+        """
+
+        create the append entries for one follower and put it in the send queue
+
+        :param peer_addr_port_tuple: (str, int)
+        :param append_entries_type: "append" or "heartbeat"
+        :return: dict
+        """
+        append_entries = self.create_append_entries(peer_addr_port_tuple, append_entries_type)
+        if len(append_entries["new_entries"]) > 0:
+            send_time = time.monotonic()
+            self.peers_last_append_time[peer_addr_port_tuple] = send_time
+            # optimistic, the next batch follows this one without waiting for the reply
+            if self.raft_peer_state.peers_replicating.get(peer_addr_port_tuple, False):
+                self.raft_peer_state.record_in_flight(peer_addr_port_tuple, append_entries["new_entries"], send_time)
+        self.json_message_send_queue.put(append_entries)
+        return append_entries
+
+    def put_pipelined_append_entries(self, peer_addr_port_tuple):
+        """
+
+        send the logs the follower is missing, a follower in replicate mode gets batches until its
+        in flight window is full, a follower in probe mode gets one batch from its next index
+
+        :param peer_addr_port_tuple: (str, int)
+        """
+        while self.raft_peer_state.snapshot_last_index < self.raft_peer_state.peers_next_index[peer_addr_port_tuple] \
+                < self.raft_peer_state.log_length():
+            replicating = self.raft_peer_state.peers_replicating.get(peer_addr_port_tuple, False)
+            if replicating and self.raft_peer_state.in_flight_window_full(
+                    peer_addr_port_tuple, self.max_in_flight_appends, self.max_in_flight_bytes):
+                return
+            self.put_append_entries(peer_addr_port_tuple, "append")
+            if not replicating:
+                return
+
+    def create_append_entries(self, peer_addr_port_tuple, append_entries_type):
+        """
+
+        create the append entries dict for one follower within the size limits
+
+        :param peer_addr_port_tuple: (str, int)
+        :param append_entries_type: "append" or "heartbeat"
+        :return: dict
+        """
+        return AppendEntriesLeader(self.raft_peer_state, peer_addr_port_tuple, append_entries_type,
+                                   self.max_entries_per_append, self.max_bytes_per_append).return_instance_vars_in_dict()
 
     # not used so far
     def sent_to_all_peer(self, json_data_dict):
@@ -713,11 +1655,12 @@ class RaftPeer:
     def send_to_peer(self, peer_addr_port_tuple, json_data_dict):
         """
         
-        turn dictionary into valid JSON string with jsonpickle which will automatically
-        serilize the objects in the dictionary to be dictionary str.
+        turn dictionary into one frame with the codec of this connection, users and
+        visualization always get newline JSON.
         
         :param peer_addr_port_tuple: (str, int) 
         :param json_data_dict: dict
+        :return: the socket written to, None if the message is not sent
         
         """
         logger.debug(" sending json_data to " + str(peer_addr_port_tuple), extra=self.my_detail)
@@ -725,7 +1668,9 @@ class RaftPeer:
         # logger.debug(" sending json_data to " + str(self.peers_addr_client_socket), extra=self.my_detail)
         # sent to user
         # sent to user/visualization because they are not p2p only have one socket
-        if json_data_dict["msg_type"] in ["request_command_reply"]:
+        codec = self.json_codec
+        if json_data_dict["msg_type"] in ["request_command_reply", "read_command_reply",
+                                          "request_command_reply_batch"]:
             try:
                 peer_socket = self.user_addr_listen_socket[peer_addr_port_tuple]
             except Exception as e:
@@ -739,6 +1684,7 @@ class RaftPeer:
         else:
             try:
                 peer_socket = self.peers_addr_client_socket[peer_addr_port_tuple]
+                codec = self.peers_addr_codec.get(peer_addr_port_tuple, self.json_codec)
             except Exception as e:
                 logger.debug(" peer not connected as client yet, put this term message back => " + str(e), extra=self.my_detail)
                 # if json_data_dict["sender_term"] == self.raft_peer_state.current_term:
@@ -746,18 +1692,25 @@ class RaftPeer:
                 return
 
         try:
-            # serialized_json_data = json.dumps(json.loads(jsonpickle.encode(json_data_dict)))
-            serialized_json_data = jsonpickle.encode(json_data_dict)
-            logger.debug(" json data serialization " + serialized_json_data, extra=self.my_detail)
+            serialized_frame = codec.encode_frame(json_data_dict)
+            logger.debug(" " + codec.codec_name + " serialization " + str(len(serialized_frame)) + " bytes",
+                         extra=self.my_detail)
             # send msg size
             # peer_socket.send(str.encode(str(len(serialized_json_data))+"\n", "utf-8"))
             # logger.debug(" json data sent len " + str(len(serialized_json_data)), extra = self.my_detail)
         except Exception as e:
             logger.debug(" json data serialization failed " + str(json_data_dict) + str(e), extra=self.my_detail)
             return
+        # entries and votes must be durable before anyone could see them
+        try:
+            self.raft_peer_state.sync_write_ahead_log()
+        except Exception as e:
+            logger.debug(" write ahead log sync failed abort sending " + str(e), extra=self.my_detail)
+            return
         # make it utf8r
         try:
-            peer_socket.sendall(str.encode(serialized_json_data + "\n", "utf-8"))
+            self.write_frame(peer_socket, serialized_frame)
+            return peer_socket
         except Exception as e:
             # reconnect to peer
             # no reconnecting to user socket, we use listen socket to send message to user
@@ -817,19 +1770,28 @@ class RaftPeer:
             logger.debug(" can't find this addr_port_tuple in either dicts ", extra=self.my_detail)
             return
 
-        msg = ""
-        # could be wrong if msg size bigger than 1024, need further testing
+        # every connection starts with newline JSON, peers switch it with codec_hello
+        codec = self.json_codec
+        frame_reader = FrameReader(peer_socket, codec.framing, self.recv_buffer_size)
         while True:
 
             try:
-                # if remote close it should return "" ?
-                # receive max 1024 bytes every time
-                temp = peer_socket.recv(1024).decode("utf-8")
-                # python is cool, it just return empty string when remote closed the connection
-                if temp == "":
-                    raise Exception()
-                    # remote closed recev will still return infinite empty string
+                # frames are memoryviews into the reader buffer, decode them before the next read
+                for payload in frame_reader.read_frames():
+                    try:
+                        one_deserialized_json_data = codec.decode(payload)
+                    except Exception as e:
+                        logger.debug(" deserialization recv data failed " + str(e), extra=self.my_detail)
+                        continue
+                    if one_deserialized_json_data["msg_type"] == "codec_hello":
+                        codec = self.reply_codec_hello(peer_socket, one_deserialized_json_data)
+                        frame_reader.set_framing(codec.framing)
+                        continue
+                    self.json_message_recv_queue.put(one_deserialized_json_data)
+                    logger.debug(" put one " + codec.codec_name + " data " + one_deserialized_json_data["msg_type"],
+                                 extra=self.my_detail)
             except Exception as e:
+                # python is cool, recv_into just return 0 when remote closed the connection
                 logger.debug(" one listen incoming socket closed " + str(e) + str(peer_addr_port_tuple),
                              extra=self.my_detail)
                 # called this will terminate accept?
@@ -839,19 +1801,3 @@ class RaftPeer:
                 elif peer_addr_port_tuple in self.user_addr_listen_socket:
                     self.user_addr_listen_socket.pop(peer_addr_port_tuple)
                 return
-
-            msg += temp
-            # if msg has new line means we have received some complete JSON data
-            # it is time to deserilize it to dictionary
-            if "\n" in msg:
-                msg_split_list = msg.split("\n")
-                msg = msg_split_list[-1]
-                # get all JSON but leave the incomplete message in the msg
-                for one_json_msg in msg_split_list[0:-1]:
-                    try:
-                        # logger.debug(" recv one json_data " + one_json_msg, extra = self.my_detail)
-                        one_deserialized_json_data = json.loads(one_json_msg)
-                        self.json_message_recv_queue.put(one_deserialized_json_data)
-                        logger.debug(" put one json_data " + one_json_msg, extra=self.my_detail)
-                    except Exception as e:
-                        logger.debug(" deserialization recv json data failed " + str(e), extra=self.my_detail)
@@ -7,13 +7,17 @@ Created Date: 18/04/2017
 '''
 import _thread
 import threading
+from collections import deque
 from LogData import LogData
 from RemoteVar import  RemoteVar
+from Snapshot import Snapshot
 
 class RaftPeerState:
-    def __init__(self, addr_port_tuple, peer_id):
+    def __init__(self, addr_port_tuple, peer_id, user_addr_port_tuple = None):
         # user perform actions on
         self.remote_var = RemoteVar()
+        # where users connect to this peer, followers send users here when this peer is the leader
+        self.my_user_addr_port_tuple = user_addr_port_tuple
 
         # self.lock = _thread.allocate_lock()
         self.lock = threading.RLock()
@@ -23,24 +27,316 @@ class RaftPeerState:
         # can set it to addr_port_tuple?
         self.vote_for = None
         # might not be used but for completeness of Raft
+        # only keeps the logs after the snapshot, so list position is log_index - snapshot_last_index - 1
         self.state_log = []
+        # index and term of the last log included in the snapshot, -1 means no snapshot yet
+        self.snapshot_last_index = -1
+        self.snapshot_last_term = -1
+        self.snapshot = None
+        # follower side, the snapshot being received from install_snapshot chunks
+        self.incoming_snapshot = None
+        # leader side, peer_addr_port_tuple and offset of the next snapshot chunk to send
+        self.peers_snapshot_offset = {}
+        # leader side, peer_addr_port_tuple and time.monotonic() the chunk waiting for its reply was sent,
+        # only one chunk is sent to a follower at a time
+        self.peers_snapshot_send_time = {}
+        # [term, index of the first log of this term] in ascending order, one per term in the log
+        self.term_start_indexes = []
+        # logs in (last_apply, commit_index] are handed to the commit thread but not applied yet (or the
+        # state loop is not told yet),
+        # logs up to commit_index are handed exactly once because commit_index only moves forward
         self.commit_index = -1
         self.last_apply = -1
         # reinitialize after election use self next index?
         # peer_addr_port_tuple and its next index
         self.peers_next_index = {}
         self.peers_match_index = {}
+        # peer_addr_port_tuple and whether it is in replicate mode, append entries are pipelined in this mode
+        # and next index is moved as soon as they are sent, in probe mode next index only moves on replies
+        self.peers_replicating = {}
+        # peer_addr_port_tuple and deque of [last log index, size, send time] of the unacknowledged batches
+        self.peers_in_flight = {}
+        # leader starts a read round to confirm it is still the leader before answering reads,
+        # every append entries carries the latest round and followers echo it in their replies
+        self.read_round = 0
+        # read round => time.monotonic() it started, kept until a later round is confirmed
+        self.read_round_start_time = {}
+        # peer_addr_port_tuple and the latest read round it echoed
+        self.peers_read_round = {}
         #follower, candidate, leader
         self.peer_state = "follower"
         self.leader_majority_count = 0
+        # optional WriteAheadLog, None means this peer only keeps its state in memory
+        self.write_ahead_log = None
+
+    def attach_write_ahead_log(self, write_ahead_log):
+        """
+
+        rebuild state_log, current_term and vote_for from disk and persist every
+        change made after this point
+
+        :param write_ahead_log: WriteAheadLog
+        """
+        with self.lock:
+            write_ahead_log.load(self)
+            self.write_ahead_log = write_ahead_log
+
+    def log_length(self):
+        # logs in snapshot are counted as well, it is also the index of the next new log
+        return self.snapshot_last_index + 1 + len(self.state_log)
+
+    def last_log_index(self):
+        return self.log_length() - 1
+
+    def last_log_term(self):
+        return self.get_log_term(self.last_log_index())
+
+    def get_log(self, log_index):
+        return self.state_log[log_index - self.snapshot_last_index - 1]
+
+    def get_log_term(self, log_index):
+        if log_index == self.snapshot_last_index:
+            return self.snapshot_last_term
+        if log_index < 0:
+            return -1
+        return self.get_log(log_index).log_term
+
+    def get_logs(self, start_log_index, end_log_index):
+        # [include: exclude], both indexes must be after the snapshot
+        offset = self.snapshot_last_index + 1
+        return self.state_log[max(start_log_index - offset, 0):max(end_log_index - offset, 0)]
+
+    def first_index_of_term(self, term):
+        # -1 if there is no log of this term
+        for one_term, one_start_index in self.term_start_indexes:
+            if one_term == term:
+                return one_start_index
+        return -1
+
+    def last_index_of_term(self, term):
+        # -1 if there is no log of this term
+        for position, (one_term, one_start_index) in enumerate(self.term_start_indexes):
+            if one_term == term:
+                if position + 1 < len(self.term_start_indexes):
+                    return self.term_start_indexes[position + 1][1] - 1
+                return self.last_log_index()
+        return -1
+
+    def rebuild_term_start_indexes(self):
+        self.term_start_indexes = []
+        if self.snapshot_last_index != -1:
+            self.term_start_indexes.append([self.snapshot_last_term, self.snapshot_last_index])
+        for one_log in self.state_log:
+            self.record_term_start(one_log)
+
+    def record_term_start(self, log_data):
+        if len(self.term_start_indexes) == 0 or self.term_start_indexes[-1][0] != log_data.log_term:
+            self.term_start_indexes.append([log_data.log_term, log_data.log_index])
+
+    def append_log(self, log_data):
+        self.state_log.append(log_data)
+        self.record_term_start(log_data)
+        if self.write_ahead_log is not None:
+            self.write_ahead_log.append_entry(log_data)
+
+    def truncate_log(self, log_index):
+        """
+
+        delete the log at log_index and all that follow it
+
+        :param log_index: int
+        """
+        del self.state_log[log_index - self.snapshot_last_index - 1:]
+        while len(self.term_start_indexes) > 0 and self.term_start_indexes[-1][1] >= log_index:
+            self.term_start_indexes.pop()
+        if self.write_ahead_log is not None:
+            self.write_ahead_log.truncate(log_index)
+
+    def persist_term_and_vote(self):
+        if self.write_ahead_log is not None:
+            self.write_ahead_log.record_term_and_vote(self.current_term, self.vote_for)
+
+    def sync_write_ahead_log(self):
+        # called before any message leaves this peer, so all the entries and votes it
+        # promised are on disk while only paying one fsync for the whole burst
+        if self.write_ahead_log is not None:
+            self.write_ahead_log.sync()
+
+    def take_snapshot(self, last_included_index):
+        """
+
+        snapshot the remote_var which has applied all the logs up to last_included_index
+        and remove those logs from state_log
+
+        :param last_included_index: int
+        """
+        self.compact_log(Snapshot(last_included_index, self.get_log_term(last_included_index),
+                                  self.remote_var.take_snapshot()))
+
+    def compact_log(self, snapshot):
+        """
+
+        remove the logs included in the snapshot taken by the apply stage of RaftPeer
+
+        :param snapshot: Snapshot
+        """
+        self.state_log = self.get_logs(snapshot.last_included_index + 1, self.log_length())
+        self.set_snapshot(snapshot)
+
+    def install_snapshot(self, snapshot):
+        """
+
+        keep the snapshot received from leader, logs after the snapshot are kept only if this
+        peer has the same log at last_included_index. RaftPeer hands it to its apply stage,
+        which replaces remote_var and moves last_apply once the earlier logs are applied
+
+        :param snapshot: Snapshot
+        """
+        last_included_index = snapshot.last_included_index
+        if last_included_index < self.log_length() and \
+                last_included_index > self.snapshot_last_index and \
+                self.get_log_term(last_included_index) == snapshot.last_included_term:
+            self.state_log = self.get_logs(last_included_index + 1, self.log_length())
+        else:
+            self.state_log = []
+        self.commit_index = max(self.commit_index, last_included_index)
+        self.set_snapshot(snapshot)
+
+    def set_snapshot(self, snapshot):
+        self.snapshot = snapshot
+        self.snapshot_last_index = snapshot.last_included_index
+        self.snapshot_last_term = snapshot.last_included_term
+        self.rebuild_term_start_indexes()
+        if self.write_ahead_log is not None:
+            self.write_ahead_log.save_snapshot(self)
 
     def initialize_peers_next_and_match_index(self, peers_addr_port_tuple_list):
-        next_index = len(self.state_log)
+        next_index = self.log_length()
         # leader has nothing in log
         # if next_index == 0:
         #     next_index = -1
         self.peers_next_index = {peer_addr_port_tuple:next_index for peer_addr_port_tuple in peers_addr_port_tuple_list}
         self.peers_match_index = {peer_addr_port_tuple:-1 for peer_addr_port_tuple in peers_addr_port_tuple_list}
+        self.peers_snapshot_offset = {}
+        self.peers_snapshot_send_time = {}
+        self.peers_replicating = {peer_addr_port_tuple:False for peer_addr_port_tuple in peers_addr_port_tuple_list}
+        self.peers_in_flight = {peer_addr_port_tuple:deque() for peer_addr_port_tuple in peers_addr_port_tuple_list}
+        self.peers_read_round = {peer_addr_port_tuple:0 for peer_addr_port_tuple in peers_addr_port_tuple_list}
+
+    def add_peer_next_and_match_index(self, peer_addr_port_tuple):
+        # peer connected after this leader was elected, probe it from the end of the log like the others
+        self.peers_next_index[peer_addr_port_tuple] = self.log_length()
+        self.peers_match_index[peer_addr_port_tuple] = -1
+        self.peers_replicating[peer_addr_port_tuple] = False
+        self.peers_in_flight[peer_addr_port_tuple] = deque()
+        self.peers_read_round[peer_addr_port_tuple] = 0
+
+    def start_read_round(self, start_time):
+        # rounds only go up, a reply echoing this round proves the follower heard from us after start_time
+        self.read_round += 1
+        self.read_round_start_time[self.read_round] = start_time
+        return self.read_round
+
+    def acknowledge_read_round(self, peer_addr_port_tuple, read_round):
+        if peer_addr_port_tuple in self.peers_read_round:
+            self.peers_read_round[peer_addr_port_tuple] = max(self.peers_read_round[peer_addr_port_tuple], read_round)
+
+    def confirmed_read_round(self, max_peer_number):
+        """
+
+        the latest read round echoed by the majority, the leader always counts itself,
+        the leader was still the leader when that round started
+
+        :param max_peer_number: int
+        :return: int, 0 if no round is confirmed
+        """
+        read_rounds = list(self.peers_read_round.values()) + [self.read_round]
+        read_rounds += [0] * (max_peer_number - len(read_rounds))
+        read_rounds.sort(reverse=True)
+        confirmed_read_round = read_rounds[max_peer_number // 2]
+        # older rounds are never asked again
+        for one_read_round in [one_read_round for one_read_round in self.read_round_start_time
+                               if one_read_round < confirmed_read_round]:
+            del self.read_round_start_time[one_read_round]
+        return confirmed_read_round
+
+    def start_probing(self, peer_addr_port_tuple, next_index):
+        # forget the pipelined batches, they are resent from next_index once the follower accepts one
+        self.peers_next_index[peer_addr_port_tuple] = next_index
+        self.peers_replicating[peer_addr_port_tuple] = False
+        self.peers_in_flight[peer_addr_port_tuple] = deque()
+
+    def start_replicating(self, peer_addr_port_tuple):
+        self.peers_replicating[peer_addr_port_tuple] = True
+        self.peers_in_flight[peer_addr_port_tuple] = deque()
+
+    def record_in_flight(self, peer_addr_port_tuple, new_entries, send_time):
+        """
+
+        move the next index of a follower in replicate mode over the logs just sent
+
+        :param peer_addr_port_tuple: (str, int)
+        :param new_entries: list of LogData
+        :param send_time: float
+        """
+        last_log_index = new_entries[-1].log_index
+        self.peers_next_index[peer_addr_port_tuple] = last_log_index + 1
+        self.peers_in_flight.setdefault(peer_addr_port_tuple, deque()).append(
+            [last_log_index, sum(one_log.estimate_encoded_size() for one_log in new_entries), send_time])
+
+    def acknowledge_in_flight(self, peer_addr_port_tuple, match_index):
+        in_flight = self.peers_in_flight.get(peer_addr_port_tuple)
+        while in_flight and in_flight[0][0] <= match_index:
+            in_flight.popleft()
+
+    def in_flight_window_full(self, peer_addr_port_tuple, max_in_flight_appends, max_in_flight_bytes):
+        in_flight = self.peers_in_flight.get(peer_addr_port_tuple)
+        if not in_flight:
+            return False
+        return len(in_flight) >= max_in_flight_appends or \
+               sum(one_batch[1] for one_batch in in_flight) >= max_in_flight_bytes
+
+    def oldest_in_flight_send_time(self, peer_addr_port_tuple):
+        in_flight = self.peers_in_flight.get(peer_addr_port_tuple)
+        return in_flight[0][2] if in_flight else None
+
+    def advance_leader_commit_index(self, max_peer_number):
+        """
+
+        move the leader's commit index to the highest index replicated on the majority,
+        only logs of current term are committed by counting replicas
+
+        :param max_peer_number: int
+        :return: list of LogData, the newly committed logs
+        """
+        # leader always has its own logs, peers not connected yet have nothing
+        match_indexes = list(self.peers_match_index.values()) + [self.last_log_index()]
+        match_indexes += [-1] * (max_peer_number - len(match_indexes))
+        match_indexes.sort(reverse=True)
+        majority_match_index = match_indexes[max_peer_number // 2]
+        # nothing new, and a lagging majority can point into the compacted logs
+        if majority_match_index <= self.commit_index:
+            return []
+        if self.get_log_term(majority_match_index) != self.current_term:
+            return []
+        return self.advance_commit_index(majority_match_index)
+
+    def advance_commit_index(self, commit_index):
+        """
+
+        move commit index forward and return the logs that are committed by this move,
+        costs nothing if commit index does not change
+
+        :param commit_index: int
+        :return: list of LogData
+        """
+        commit_index = min(commit_index, self.last_log_index())
+        if commit_index <= self.commit_index:
+            return []
+        newly_committed_logs = self.get_logs(max(self.commit_index, self.snapshot_last_index) + 1, commit_index + 1)
+        self.commit_index = commit_index
+        return newly_committed_logs
+
     def increment_leader_majority_count(self):
         if self.peer_state == "candidate":
             self.leader_majority_count += 1
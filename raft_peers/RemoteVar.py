@@ -6,34 +6,168 @@ Date Created: 24/04/2017
 This class is used to store the result of each
 request_command if it is committed.
 
+Commands sent with a client session carry [client_id, client_seq,
+client_ack_seq] after the action param, the result of each one is kept
+in the session so a command retried after a leader change is answered
+from the session instead of being applied again. client_ack_seq tells
+which results the client does not need any more.
+
+A command that cannot be applied (an unknown action, a bad param, a div
+by zero) changes nothing more and gets a "command_error" result, on
+every peer the same, so the logs after it are applied as usual.
+
 '''
 
 import _thread
+from collections import OrderedDict
 
 
 class RemoteVar:
+    # sessions without a command for this many logs are dropped, must be the same on every peer
+    session_expiry_logs = 100000
+    # expired sessions are looked for when the log index is a multiple of it, so
+    # every peer drops them at the same log whatever snapshot it started from
+    session_expiry_check_logs = 1024
+    # marks a command without a result in the session, None is a result
+    no_result = object()
+    # start of the result of a command that could not be applied
+    command_error = "command_error"
+
     def __init__(self):
         self.lock = _thread.allocate_lock()
         # dictionary key is the var name, and value is var's value
         self.vars = {}
-
-    # param list [0] => var name, [1] => action func， [2] => action func single param
-    def perform_action(self, action_param_list):
-
-
+        # client_id => {"results": {client_seq: command result}, "ack_seq": int, "last_log_index": int}
+        self.sessions = {}
+
+    # param list [0] => var name, [1] => action func， [2] => action func single param,
+    # [3] => [client_id, client_seq, client_ack_seq] when sent with a client session
+    def perform_action(self, action_param_list, log_index=-1):
+        """
+
+        apply one command, a command of a client session already applied is skipped
+
+        :param action_param_list: list
+        :param log_index: int, index of the log carrying the command
+        :return: the value of the variable after the command, or the result cached in the session
+        """
+        if log_index >= 0 and log_index % self.session_expiry_check_logs == 0:
+            self.expire_sessions(log_index)
+        try:
+            if len(action_param_list) > 3:
+                return self.perform_session_action(action_param_list, log_index)
+            return self.perform_var_action(action_param_list)
+        except Exception as e:
+            return self.command_error_result(e)
+
+    def perform_actions(self, action_param_lists, log_indexes):
+        """
+
+        apply the commands of consecutive logs, NumericRemoteVar applies them together
+
+        :param action_param_lists: list of list
+        :param log_indexes: list of int
+        :return: list, the result of every command
+        """
+        return [self.perform_action(action_param_list, log_index)
+                for action_param_list, log_index in zip(action_param_lists, log_indexes)]
+
+    def perform_session_action(self, action_param_list, log_index):
+        session, client_seq, result = self.open_session_command(action_param_list, log_index)
+        if session is None:
+            return result
+        try:
+            result = self.perform_var_action(action_param_list)
+        except Exception as e:
+            result = self.command_error_result(e)
+        session["results"][client_seq] = result
+        return result
+
+    def open_session_command(self, action_param_list, log_index):
+        """
+
+        update the session of a command sent with a client session
+
+        :param action_param_list: list
+        :param log_index: int
+        :return: (session, client_seq, None) if the command is to be applied and its result kept
+                 in session["results"][client_seq], or (None, None, the result to answer)
+        """
+        client_id, client_seq, client_ack_seq = str(action_param_list[3][0]), int(action_param_list[3][1]), \
+                                                int(action_param_list[3][2])
+        session = self.sessions.get(client_id)
+        if session is None:
+            # results up to client_ack_seq were answered, so the session existed and expired
+            if client_ack_seq > 0:
+                return None, None, "session_expired"
+            session = {"results": OrderedDict(), "ack_seq": 0, "last_log_index": log_index}
+            self.sessions[client_id] = session
+        session["last_log_index"] = log_index
+        if client_ack_seq > session["ack_seq"]:
+            session["ack_seq"] = client_ack_seq
+            # results are added in the order the client sent them, the oldest are first
+            session_results = session["results"]
+            while len(session_results) > 0 and next(iter(session_results)) <= client_ack_seq:
+                session_results.popitem(last=False)
+        if client_seq in session["results"]:
+            return None, None, session["results"][client_seq]
+        # already answered, the client does not wait for it any more
+        if client_seq <= session["ack_seq"]:
+            return None, None, None
+        return session, client_seq, None
+
+    def command_error_result(self, error):
+        # the same on every peer, a retried command gets it from the session as well
+        return self.command_error + " " + type(error).__name__ + ": " + str(error)
+
+    def session_result(self, client_id, client_seq):
+        """
+
+        result of the command of a client session if it is applied already
+
+        :param client_id: str
+        :param client_seq: int
+        :return: (bool, result)
+        """
+        # called by the state loop while the commit thread applies, so every lookup is one get
+        session = self.sessions.get(str(client_id))
+        if session is None:
+            return False, None
+        result = session["results"].get(int(client_seq), self.no_result)
+        if result is self.no_result:
+            return False, None
+        return True, result
+
+    def expire_sessions(self, log_index):
+        expired_client_ids = [client_id for client_id, session in self.sessions.items()
+                              if log_index - session["last_log_index"] > self.session_expiry_logs]
+        for client_id in expired_client_ids:
+            del self.sessions[client_id]
+
+    def perform_var_action(self, action_param_list):
         action_funcs = {"add":self.add,
                         "sub":self.sub,
                         "div":self.div,
                         "time":self.time,
-                        "learn_skill":self.learn_skill}
+                        "learn_skill":self.learn_skill,
+                        "noop":self.noop}
 
         action_func = action_funcs[str(action_param_list[1])]
         action_func(str(action_param_list[0]),action_param_list[2])
+        return self.vars.get(str(action_param_list[0]))
+
+    def read_var(self, var_name):
+        # value of the variable or None if it was never set
+        return self.vars.get(str(var_name))
 
     def learn_skill(self, skill_name, action_param = True):
         if str(skill_name) not in self.vars:
             self.vars[skill_name] = action_param
 
+    def noop(self, var_name, action_param):
+        # added by a new leader to commit a log of its own term, changes nothing
+        pass
+
     def add(self, var_name, action_param):
         if str(var_name) not in self.vars:
             self.vars[str(var_name)] = 0.0
@@ -54,6 +188,24 @@ class RemoteVar:
             self.vars[str(var_name)] = 0.0
         self.vars[var_name] *= float(action_param)
 
+    def take_snapshot(self):
+        # values are float or bool, shallow copy is enough, json keys are str so results are pairs
+        return {"vars": dict(self.vars),
+                "sessions": {client_id: {"results": [[seq, result] for seq, result in session["results"].items()],
+                                         "ack_seq": session["ack_seq"],
+                                         "last_log_index": session["last_log_index"]}
+                             for client_id, session in self.sessions.items()}}
+
+    def restore_snapshot(self, snapshot_vars):
+        # snapshots taken before sessions existed are the vars alone, values are never dict
+        if not isinstance(snapshot_vars.get("vars"), dict):
+            snapshot_vars = {"vars": snapshot_vars, "sessions": {}}
+        self.vars = dict(snapshot_vars["vars"])
+        self.sessions = {client_id: {"results": OrderedDict((int(seq), result) for seq, result in session["results"]),
+                                     "ack_seq": int(session["ack_seq"]),
+                                     "last_log_index": int(session["last_log_index"])}
+                         for client_id, session in snapshot_vars["sessions"].items()}
+
     def __str__(self):
         return str(vars(self))
 
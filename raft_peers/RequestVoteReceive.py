@@ -39,7 +39,7 @@ class RequestVoteReceive:
             return request_vote_result
 
         # if this peer has no log, there is no any peer could have worst log than it
-        if len(self.raft_peer_state.state_log) == 0:
+        if self.raft_peer_state.log_length() == 0:
             return request_vote_result
 
         if self.raft_peer_state.vote_for != None:
@@ -59,14 +59,15 @@ class RequestVoteReceive:
 
         #at least up to date is fine?
         #ini last_log_index is -1 and state_log len is 0
-        if (len(self.raft_peer_state.state_log) -1) > self.last_log_index:
+        if self.raft_peer_state.last_log_index() > self.last_log_index:
             request_vote_result["vote_granted"] = False
             return request_vote_result
         # if same log length, but current peer has newer term, then reject the candidate request
-        if (len(self.raft_peer_state.state_log) - 1) == self.last_log_index:
-            if self.raft_peer_state.state_log[self.last_log_index].log_term > self.last_log_term:
+        if self.raft_peer_state.last_log_index() == self.last_log_index:
+            if self.raft_peer_state.last_log_term() > self.last_log_term:
                 request_vote_result["vote_granted"] = False
                 return request_vote_result
 
         self.raft_peer_state.vote_for = self.send_from
+        self.raft_peer_state.persist_term_and_vote()
         return request_vote_result
@@ -0,0 +1,90 @@
+"""
+
+
+This is the class to store the snapshot of RemoteVar with the index and
+term of the last log it included, logs up to that index could be removed
+from the state_log.
+
+The snapshot is encoded only once, so it could be sent to followers in
+chunks without encoding it again for every chunk.
+
+
+"""
+
+import json
+import os
+
+
+class Snapshot:
+    def __init__(self, last_included_index, last_included_term, snapshot_vars=None):
+        self.last_included_index = int(last_included_index)
+        self.last_included_term = int(last_included_term)
+        # dict taken from RemoteVar.take_snapshot(), None while it is still being received
+        self.snapshot_vars = snapshot_vars
+        self.encoded_data = None if snapshot_vars is None else json.dumps(snapshot_vars)
+        # follower side, chunks received so far from install_snapshot and the term of the leader sending them
+        self.received_chunks = []
+        self.received_size = 0
+        self.sender_term = None
+
+    def get_chunk(self, offset, chunk_size):
+        """
+
+        return the chunk starting at offset and whether it is the last one
+
+        :param offset: int
+        :param chunk_size: int
+        :return: (str, bool)
+        """
+        chunk = self.encoded_data[offset:offset + chunk_size]
+        return chunk, (offset + len(chunk)) >= len(self.encoded_data)
+
+    def add_chunk(self, offset, chunk):
+        """
+
+        append the chunk if it is the next expected one, duplicated or
+        out of order chunks are ignored
+
+        :param offset: int
+        :param chunk: str
+        :return: bool
+        """
+        if int(offset) != self.received_size:
+            return False
+        self.received_chunks.append(chunk)
+        self.received_size += len(chunk)
+        return True
+
+    def finish_receiving(self):
+        self.encoded_data = "".join(self.received_chunks)
+        self.snapshot_vars = json.loads(self.encoded_data)
+        self.received_chunks = []
+
+    def save_to_file(self, file_path):
+        """
+
+        write the snapshot to a temp file and rename it, so there is always a
+        complete snapshot on disk
+
+        :param file_path: str
+        """
+        temp_file_path = file_path + ".tmp"
+        with open(temp_file_path, "w", encoding="utf-8") as snapshot_file:
+            snapshot_file.write(json.dumps({"last_included_index": self.last_included_index,
+                                            "last_included_term": self.last_included_term}) + "\n")
+            snapshot_file.write(self.encoded_data)
+            snapshot_file.flush()
+            os.fsync(snapshot_file.fileno())
+        os.replace(temp_file_path, file_path)
+
+    @staticmethod
+    def load_from_file(file_path):
+        with open(file_path, "r", encoding="utf-8") as snapshot_file:
+            header = json.loads(snapshot_file.readline())
+            snapshot_vars = json.loads(snapshot_file.read())
+        return Snapshot(header["last_included_index"], header["last_included_term"], snapshot_vars)
+
+    def __str__(self):
+        return str({"last_included_index": self.last_included_index,
+                    "last_included_term": self.last_included_term,
+                    "size": len(self.encoded_data) if self.encoded_data is not None else self.received_size})
@@ -0,0 +1,37 @@
+"""
+
+
+This is the class of the events the state loop of RaftPeer handles besides
+the messages received from peers and users.
+
+The Raft state is only changed by the state loop, the timer, the commit
+thread and the leader forwarder do not touch it themselves (the commit
+thread only owns the remote_var), they put one of these events into the
+same queue as the received messages and the loop handles it in turn with
+them.
+
+
+"""
+
+
+class StateEvent:
+    # the election or heart beat deadline of the TimeoutCounter passed, no payload
+    timer_fired = "timer_fired"
+    # the commit thread applied one pass of logs, payload is the dict returned by apply_committed_logs
+    logs_applied = "logs_applied"
+    # leader's reply of a forwarded command, payload is (user addr, reply dict)
+    forwarded_reply = "forwarded_reply"
+
+    __slots__ = ("event_type", "payload")
+
+    def __init__(self, event_type, payload=None):
+        """
+
+        :param event_type: str, one of the event types above
+        :param payload: depends on the event type
+        """
+        self.event_type = event_type
+        self.payload = payload
+
+    def __str__(self):
+        return "StateEvent " + self.event_type
@@ -6,16 +6,25 @@ Author: Bingfeng Liu
 This is the class to perfome the coudown operations for
 the random timeout in Raft.
 
+It keeps the monotonic time the next election or heart beat is due and the
+timer only wakes up when that deadline passes or moves earlier, resets just
+move the deadline. The leader also has a short replication deadline after
+a user adds a log, so a burst of commands shares one append entries.
+
+The timer thread does not fire itself, it puts a timer_fired StateEvent for
+the state loop of RaftPeer and waits until the loop has handled it.
+
 
 
 """
 
 import logging
 
+from StateEvent import StateEvent
+
 logger = logging.getLogger("TimeoutCounter")
 logger.setLevel(logging.DEBUG)
 
-import _thread
 import time
 import threading
 class TimeoutCounter:
@@ -24,47 +33,112 @@ class TimeoutCounter:
         self.my_detial = {"host": str(owner_addr_port_tuple[0]),
                           "port": str(owner_addr_port_tuple[1]),
                           "peer_id": str(peer_id)}
-        self.lock = threading.RLock()
-        self.time_out = time_out
+        self.condition = threading.Condition()
         self.time_out_const = time_out
-        self.last = 0
-        self.sleep_time = 0.001
         # send heat beat in 10 ms
         # self.append_entries_heart_beat_time_out = 0.01
         self.append_entries_heart_beat_time_out = append_entries_heart_beat_time_out
         self.raft_peer_state = raft_peer_state
+        # time.monotonic() when the election or heart beat is due
+        self.deadline = time.monotonic() + time_out
+        # time.monotonic() when the logs added by users are sent, None if nothing is waiting
+        self.replication_deadline = None
+        # called when the deadline moves earlier, for timers not waiting on the condition
+        self.wakeup = None
+        # a timer_fired event is waiting for the state loop, no other one is put until it is handled
+        self.fire_pending = False
+
+    def next_deadline(self):
+        # caller must hold the condition
+        if self.replication_deadline is not None and self.replication_deadline < self.deadline:
+            return self.replication_deadline
+        return self.deadline
 
-    def start_time_out(self, time_out, action_func, timeout_type):
+    def fire_if_due(self, raft_peer):
+        """
+        send the new logs when the replication deadline passed, and when the deadline passed
+        send heart beat as a leader or start election otherwise
 
-        # logger.debug(" gap => " + str(gap), extra = self.my_detial)
-    #with self.lock:s
-        # 1ms
-        last = time.time()
-        time.sleep(self.sleep_time)
-        gap = time.time() - last
-        self.time_out -= gap
+        :param raft_peer: RaftPeer
+        :return: float, seconds until the next deadline
+        """
         with self.raft_peer_state.lock:
-            if self.time_out <= 0:
-                self.time_out = time_out
-                # will dead lock if called it inside
-                # self.time_out = self.time_out_const
-                logger.debug( " " + str(self.time_out) + timeout_type + " ", extra=self.my_detial)
+            now = time.monotonic()
+            action_func = None
+            with self.condition:
+                if self.fire_pending:
+                    self.fire_pending = False
+                    self.condition.notify()
+                if self.next_deadline() > now:
+                    return self.next_deadline() - now
+                replication_due = self.replication_deadline is not None and self.replication_deadline <= now
+                if replication_due:
+                    self.replication_deadline = None
+                if self.deadline <= now:
+                    if self.raft_peer_state.peer_state == "leader":
+                        time_out, action_func, timeout_type = self.append_entries_heart_beat_time_out, \
+                                                              raft_peer.put_sent_to_all_peer_append_entries_heart_beat, \
+                                                              "append heart beat time out"
+                    else:
+                        time_out, action_func, timeout_type = self.time_out_const, \
+                                                              raft_peer.put_sent_to_all_peer_request_vote, \
+                                                              "election time out"
+                    self.deadline = now + time_out
+            if replication_due:
+                raft_peer.put_sent_to_all_peer_new_entries()
+            if action_func is not None:
+                logger.debug( " " + str(time_out) + timeout_type + " ", extra=self.my_detial)
                 action_func()
-                # if self.time_out <= 0:
+            with self.condition:
+                return self.next_deadline() - time.monotonic()
 
     def start_time_counter(self, raft_peer):
         logger.debug(" counter started ", extra=self.my_detial)
+        self.reset_timeout()
         while True:
-            if raft_peer.raft_peer_state.peer_state == "leader":
-                self.start_time_out(self.append_entries_heart_beat_time_out, raft_peer.put_sent_to_all_peer_append_entries_heart_beat, "append heart beat time out")
-            else:
-                self.start_time_out(self.time_out_const, raft_peer.put_sent_to_all_peer_request_vote, "election time out")
+            with self.condition:
+                if self.fire_pending:
+                    # the state loop notifies once it has moved the deadlines
+                    self.condition.wait()
+                    continue
+                remaining = self.next_deadline() - time.monotonic()
+                if remaining > 0:
+                    # woken up early by a deadline moved earlier, or it is due now
+                    self.condition.wait(remaining)
+                    continue
+                self.fire_pending = True
+            raft_peer.put_state_event(StateEvent.timer_fired)
+
+    def schedule_replication(self, coalescing_window):
+        """
+        send the new logs after coalescing_window seconds, logs added before that are sent together
+
+        :param coalescing_window: float
+        """
+        with self.condition:
+            if self.replication_deadline is not None:
+                return
+            self.replication_deadline = time.monotonic() + coalescing_window
+            moved_earlier = self.replication_deadline < self.deadline
+            if moved_earlier:
+                self.condition.notify()
+        if moved_earlier and self.wakeup is not None:
+            self.wakeup()
+
+    def move_deadline(self, time_out):
+        with self.condition:
+            new_deadline = time.monotonic() + time_out
+            moved_earlier = new_deadline < self.next_deadline()
+            self.deadline = new_deadline
+            if moved_earlier:
+                self.condition.notify()
+        if moved_earlier and self.wakeup is not None:
+            self.wakeup()
 
     def reset_timeout(self):
-        #with self.lock: will get dead lock here
-        self.time_out = self.time_out_const
-        logger.debug(" time_out reset => " + str(self.time_out), extra=self.my_detial)
+        self.move_deadline(self.time_out_const)
+        logger.debug(" time_out reset => " + str(self.time_out_const), extra=self.my_detial)
+
     def reset_timeout_append_entries(self):
-        #with self.lock: will get dead lock here
-        self.time_out = self.append_entries_heart_beat_time_out
-        logger.debug(" time_out reset => " + str(self.time_out), extra=self.my_detial)
+        self.move_deadline(self.append_entries_heart_beat_time_out)
+        logger.debug(" time_out reset => " + str(self.append_entries_heart_beat_time_out), extra=self.my_detial)
@@ -23,6 +23,8 @@ import _thread
 import threading
 import ast
 
+from FrameReader import FrameReader
+
 FORMAT = '[%(module)s][%(asctime)-15s][%(levelname)s][%(peer_id)s][%(host)s][%(port)s][%(funcName)s] %(message)s'
 logging.basicConfig(format=FORMAT, level = logging.DEBUG, filename="./logs/user_log_file", filemode="w")
 logger = logging.getLogger("User")
@@ -60,43 +62,59 @@ class User:
         self.connect_to_next_peer()
         # self.connect_to_next_peer()
 
-    def connect_to_next_peer(self):
+    def connect_to_next_peer(self, leader_hint = None):
+        """
+        connect to the leader the last peer told us about, or to the next peer in the list
+
+        :param leader_hint: [host, port] of the leader's user port or None
+        """
         print("Connecting to leader ... ")
         are_you_leader = {"msg_type": "request_command",
                           "request_command_list":[]}
         while True:
             with self.lock:
-                # if self.leader_socket is not None:
-                #     self.leader_socket.shutdown(socket.SHUT_RDWR)
                 # if self.input_thread is not None:
                 #     # self.input_thread.exit()
                 #     self.input_thread = None
                 self.json_message_send_queue.empty()
+                # its receive thread stops once the socket is closed
+                if self.leader_socket is not None:
+                    try:
+                        self.leader_socket.shutdown(socket.SHUT_RDWR)
+                        self.leader_socket.close()
+                    except OSError:
+                        pass
                 self.leader_socket = None
-                self.peer_connection_index += 1
-                if self.peer_connection_index >= len(self.servers_addr_port_list):
-                    self.peer_connection_index = 0
+                if leader_hint is not None:
+                    next_addr_port_tuple = (leader_hint[0], int(leader_hint[1]))
+                    # only tried once, the list is used if the leader is gone already
+                    leader_hint = None
+                else:
+                    self.peer_connection_index += 1
+                    if self.peer_connection_index >= len(self.servers_addr_port_list):
+                        self.peer_connection_index = 0
+                    next_addr_port_tuple = self.servers_addr_port_list[self.peer_connection_index]
                 try:
-                    print("try to connect " + str(self.servers_addr_port_list[self.peer_connection_index]))
+                    print("try to connect " + str(next_addr_port_tuple))
                     leader_socket = socket.socket()
-                    leader_socket.connect(self.servers_addr_port_list[self.peer_connection_index])
+                    leader_socket.connect(next_addr_port_tuple)
                     print("connect successfully")
                     are_you_leader["send_to"] = list(leader_socket.getpeername())
                     are_you_leader["send_from"] = list(leader_socket.getsockname())
                     self.leader_socket = leader_socket
-                    _thread.start_new_thread(self.receive_from_one_peer_newline_delimiter, ())
+                    _thread.start_new_thread(self.receive_from_one_peer_newline_delimiter, (leader_socket,))
                     self.json_message_send_queue.put(are_you_leader)
                     logger.debug(" start thread => receive_from_one_peer_newline_delimiter successful ",
                                  extra=self.my_detail)
                     break
                 except Exception as e:
-                    logger.debug("Error: unable to connect " + str(self.servers_addr_port_list[self.peer_connection_index]) + ", exception => " + str(e), extra=self.my_detail)
+                    logger.debug("Error: unable to connect " + str(next_addr_port_tuple) + ", exception => " + str(e), extra=self.my_detail)
                     continue
         print ("Try find leader :], " + str(leader_socket))
 
     def take_user_input(self):
         #self.connect_to_next_peer()
-        print("Enter your command as a list [var_name, command_name， action_param]")
+        print("Enter your command as a list [var_name, command_name， action_param] or [var_name] to read it")
         while True:
             temp_input_list = input("$ ")
             # turn string representation of list into list
@@ -105,11 +123,17 @@ class User:
             except Exception as e:
                 print("Invalid input try again " + str(e))
                 continue
-            if len(temp_input_list) != 3:
+            if len(temp_input_list) not in [1, 3]:
                 print ("command input with wrong number of params")
                 continue
             with self.lock:
                 leader_socket = self.leader_socket
+            # [var_name] only reads the value, no log is added for it
+            if len(temp_input_list) == 1:
+                self.json_message_send_queue.put({"msg_type": "read_command",
+                                                  "read_command_list": temp_input_list,
+                                                  "send_from": list(leader_socket.getsockname())})
+                continue
             # while True:
             #     if leader_socket == None:
             #         time.sleep(1)
@@ -138,15 +162,25 @@ class User:
             #sendpeer_addr, peer_port = one_recv_json_message_dict["send_from"]
 
             one_recv_json_message_type = one_recv_json_message_dict["msg_type"]
-            receive_processing_functions = {"request_command_reply":self.request_command_request_reply}
+            receive_processing_functions = {"request_command_reply":self.request_command_request_reply,
+                                            "read_command_reply":self.request_command_request_reply,
+                                            "request_command_reply_batch":self.request_command_reply_batch}
             receive_processing_function = receive_processing_functions[one_recv_json_message_type]
             receive_processing_function(one_recv_json_message_dict)
 
+    def request_command_reply_batch(self, one_recv_json_message_dict):
+        # replies of the commands applied together, each one like a single reply
+        for one_reply_dict in one_recv_json_message_dict["replies"]:
+            self.request_command_request_reply(one_reply_dict)
+
     def request_command_request_reply(self, one_recv_json_message_dict):
-        time.sleep(1)
         if one_recv_json_message_dict["command_result"] == "not_leader":
             print(one_recv_json_message_dict["command_result"] + " finding leaders now")
-            self.connect_to_next_peer()
+            leader_hint = one_recv_json_message_dict.get("leader_hint")
+            if leader_hint is None:
+                # election is going on, give it some time before asking the next peer
+                time.sleep(1)
+            self.connect_to_next_peer(leader_hint)
         elif one_recv_json_message_dict["command_result"] == "is_leader":
             print("leader found " + str(self.leader_socket))
             # self.input_thread = _thread.start_new_thread(self.take_user_input, ())
@@ -186,40 +220,31 @@ class User:
         #make it utf8r
 
 
-    def receive_from_one_peer_newline_delimiter(self):
-        logger.debug(" recv json_data from " + str(self.leader_socket), extra = self.my_detail)
+    def receive_from_one_peer_newline_delimiter(self, peer_socket):
+        logger.debug(" recv json_data from " + str(peer_socket), extra = self.my_detail)
 
-        msg = ""
-        #could be wrong if msg size bigger than 1024, need further testing
+        frame_reader = FrameReader(peer_socket)
         while True:
-
-            with self.lock:
-                peer_socket = self.leader_socket
-
-            # if peer_socket == None:
-            #     logger.debug(" no leader socket now, abort receiving ", extra=self.my_detail)
-            #     time.sleep(0.1)
-            #     continue
             try:
-                msg += peer_socket.recv(1024).decode("utf-8")
-            except Exception as e:
-                logger.debug(" leader socket terminated, receive failed " + str(e), extra=self.my_detail)
-                # this exception will be triggered if we want to send something
-                self.connect_to_next_peer()
-                return
-
-            if "\n" in msg:
-                msg_split_list = msg.split("\n")
-                msg = msg_split_list[-1]
-                for one_json_msg in msg_split_list[0:-1]:
+                # frames are memoryviews into the reader buffer, decode them before the next read
+                for payload in frame_reader.read_frames():
                     try:
+                        one_json_msg = bytes(payload).decode("utf-8")
                         logger.debug(" recv one json_data " + one_json_msg, extra = self.my_detail)
                         one_deserialized_json_data = json.loads(one_json_msg)
                         self.json_message_recv_queue.put(one_deserialized_json_data)
                         logger.debug(" put one json_data " + one_json_msg, extra = self.my_detail)
                     except Exception as e:
                         logger.debug( " deserialization recv json data failed " + str(e), extra = self.my_detail)
-
+            except Exception as e:
+                logger.debug(" leader socket terminated, receive failed " + str(e), extra=self.my_detail)
+                with self.lock:
+                    # closed by connect_to_next_peer, a newer socket is used already
+                    if self.leader_socket is not peer_socket:
+                        return
+                # this exception will be triggered if we want to send something
+                self.connect_to_next_peer()
+                return
 
 if __name__ == '__main__':
     # peer1 = ("localhost", 1119)
@@ -0,0 +1,85 @@
+"""
+
+
+This is the class to mirror what the Raft peer does to the visualization
+game without slowing the Raft peer down.
+
+Raft handlers only record small events into a bounded ring buffer, the
+oldest events are dropped when it is full. A publisher thread turns them
+into the JSON the game expects. It could skip a share of the frequent
+events and delays each event by a random time, so the villagers do not
+all act at the same moment, the delay never holds up the Raft peer.
+
+
+"""
+
+import collections
+import logging
+import random
+import threading
+import time
+
+logger = logging.getLogger("VisualizationTap")
+
+
+class VisualizationTap:
+    # events the game copes with missing, the others carry the log indexes it follows
+    sampled_msg_types = ("append_entries_leader", "append_entries_follower_reply")
+
+    def __init__(self, publish, send_from, send_to, my_detail, buffer_size=4096, sample_rate=1.0, max_delay=0.0):
+        """
+
+        :param publish: function, publish(json_data_dict) queues one message to the game
+        :param send_from: [str, int]
+        :param send_to: [str, int], the game server
+        :param my_detail: dict
+        :param buffer_size: int, events kept while the publisher is behind
+        :param sample_rate: float, share of the frequent events published
+        :param max_delay: float, seconds each event is delayed at most
+        """
+        self.publish = publish
+        self.send_from = list(send_from)
+        self.send_to = list(send_to)
+        self.my_detail = my_detail
+        self.sample_rate = float(sample_rate)
+        self.max_delay = float(max_delay)
+        self.condition = threading.Condition()
+        # (time.monotonic() when recorded, msg_type, fields), nothing else refers to the fields
+        self.events = collections.deque(maxlen=int(buffer_size))
+        self.dropped_count = 0
+        self.thread_publish = threading.Thread(target=self.process_events)
+        self.thread_publish.daemon = True
+        self.thread_publish.start()
+
+    def record(self, msg_type, **fields):
+        """
+
+        keep one event for the publisher, it never blocks
+
+        :param msg_type: str
+        :param fields: the values the game reads, copied by the caller if they could change later
+        """
+        with self.condition:
+            if len(self.events) == self.events.maxlen:
+                self.dropped_count += 1
+            self.events.append((time.monotonic(), msg_type, fields))
+            self.condition.notify()
+
+    def process_events(self):
+        while True:
+            with self.condition:
+                while len(self.events) == 0:
+                    self.condition.wait()
+                recorded_time, msg_type, fields = self.events.popleft()
+            if msg_type in self.sampled_msg_types and random.random() >= self.sample_rate:
+                continue
+            # events recorded long ago are already due, so a backlog is sent without waiting
+            delay = recorded_time + random.uniform(0, self.max_delay) - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            json_data_dict = {"msg_type": msg_type, "send_from": self.send_from, "send_to": self.send_to}
+            json_data_dict.update(fields)
+            try:
+                self.publish(json_data_dict)
+            except Exception as e:
+                logger.debug(" publish to visualization failed " + str(e), extra=self.my_detail)
@@ -0,0 +1,267 @@
+"""
+
+
+This is the class to persist the state_log, current_term and vote_for
+of a peer into append-only segment files, so a restarted peer could
+rebuild its RaftPeerState from disk instead of getting the whole log
+again from the leader.
+
+Records are only buffered when they are added, the buffer is written and
+fsynced in one go by sync(), so every entry added in one burst shares a
+single disk flush (group commit). Records could still be added while
+another thread waits for the fsync, they go to the next sync.
+
+When the log is compacted, the snapshot is written next to the segments
+and the segments it covers are removed.
+
+
+"""
+
+import json
+import logging
+import os
+import threading
+
+from Snapshot import Snapshot
+
+logger = logging.getLogger("WriteAheadLog")
+
+
+class WriteAheadLog:
+    segment_prefix = "segment_"
+    segment_suffix = ".wal"
+    snapshot_file_name = "snapshot.json"
+
+    def __init__(self, wal_dir, peer_id, segment_max_bytes=4 * 1024 * 1024):
+        self.my_detail = {"host": "wal", "port": str(wal_dir), "peer_id": str(peer_id)}
+        # guards pending_records, taken by the state loop when it adds a record
+        self.lock = threading.RLock()
+        # taken for writing the segment files, always before lock, the fsync only holds this one
+        # so the state loop could add records while another thread waits for the disk
+        self.sync_lock = threading.RLock()
+        self.wal_dir = os.path.join(str(wal_dir), str(peer_id))
+        self.segment_max_bytes = int(segment_max_bytes)
+        # records waiting for the next sync, list of JSON lines
+        self.pending_records = []
+        self.segment_file = None
+        self.segment_number = 0
+        self.segment_size = 0
+        self.segment_in_dir_synced = False
+        # last persisted (current_term, vote_for), used to skip duplicated term records
+        self.last_term_and_vote = None
+        if not os.path.isdir(self.wal_dir):
+            os.makedirs(self.wal_dir)
+
+    def segment_path(self, segment_number):
+        return os.path.join(self.wal_dir, self.segment_prefix + "{0:08d}".format(segment_number) + self.segment_suffix)
+
+    def list_segment_numbers(self):
+        """
+
+        return the segment numbers on disk in ascending order
+
+        :return: list of int
+        """
+        segment_numbers = []
+        for file_name in os.listdir(self.wal_dir):
+            if file_name.startswith(self.segment_prefix) and file_name.endswith(self.segment_suffix):
+                try:
+                    segment_numbers.append(int(file_name[len(self.segment_prefix):-len(self.segment_suffix)]))
+                except ValueError:
+                    continue
+        return sorted(segment_numbers)
+
+    def load(self, raft_peer_state):
+        """
+
+        Replay all the segments into the raft_peer_state, it should be called once
+        before the peer starts to send or receive any messages.
+
+        :param raft_peer_state: RaftPeerState
+        """
+        from LogData import LogData
+
+        with self.sync_lock, self.lock:
+            snapshot_path = os.path.join(self.wal_dir, self.snapshot_file_name)
+            if os.path.isfile(snapshot_path):
+                snapshot = Snapshot.load_from_file(snapshot_path)
+                raft_peer_state.snapshot = snapshot
+                raft_peer_state.snapshot_last_index = snapshot.last_included_index
+                raft_peer_state.snapshot_last_term = snapshot.last_included_term
+                raft_peer_state.remote_var.restore_snapshot(snapshot.snapshot_vars)
+                raft_peer_state.commit_index = snapshot.last_included_index
+                raft_peer_state.last_apply = snapshot.last_included_index
+
+            segment_numbers = self.list_segment_numbers()
+            for segment_number in segment_numbers:
+                with open(self.segment_path(segment_number), "r", encoding="utf-8") as segment_file:
+                    for one_line in segment_file:
+                        try:
+                            one_record = json.loads(one_line)
+                        except ValueError:
+                            # torn write at the tail of the last segment, everything after it was never synced
+                            logger.debug(" ignore broken record in segment " + str(segment_number),
+                                         extra=self.my_detail)
+                            break
+                        if one_record["record_type"] == "entry":
+                            one_log_data = LogData(one_record["log_index"],
+                                                   one_record["log_term"],
+                                                   one_record["request_command_action_list"])
+                            log_index = int(one_record["log_index"])
+                            if log_index <= raft_peer_state.snapshot_last_index:
+                                # already in the snapshot
+                                continue
+                            elif log_index == raft_peer_state.log_length():
+                                raft_peer_state.state_log.append(one_log_data)
+                            elif log_index < raft_peer_state.log_length():
+                                raft_peer_state.state_log[log_index - raft_peer_state.snapshot_last_index - 1] = \
+                                    one_log_data
+                            else:
+                                logger.debug(" ignore entry with gap " + str(one_record), extra=self.my_detail)
+                        elif one_record["record_type"] == "truncate":
+                            log_index = int(one_record["log_index"])
+                            if log_index > raft_peer_state.snapshot_last_index:
+                                del raft_peer_state.state_log[log_index - raft_peer_state.snapshot_last_index - 1:]
+                        elif one_record["record_type"] == "term":
+                            raft_peer_state.current_term = one_record["current_term"]
+                            raft_peer_state.vote_for = None if one_record["vote_for"] is None else tuple(
+                                one_record["vote_for"])
+            self.last_term_and_vote = (raft_peer_state.current_term, raft_peer_state.vote_for)
+            raft_peer_state.rebuild_term_start_indexes()
+
+            # always start a fresh segment after restart, so a torn tail is never appended to
+            if len(segment_numbers) > 0:
+                self.segment_number = segment_numbers[-1]
+            self.open_next_segment()
+            logger.debug(" loaded " + str(len(segment_numbers)) + " segments, log length " +
+                         str(raft_peer_state.log_length()) + " term " + str(raft_peer_state.current_term),
+                         extra=self.my_detail)
+
+    def open_next_segment(self):
+        if self.segment_file is not None:
+            self.segment_file.close()
+        self.segment_number += 1
+        self.segment_file = open(self.segment_path(self.segment_number), "a", encoding="utf-8")
+        self.segment_size = 0
+        # the new file is only found after a crash once the folder is fsynced as well
+        self.segment_in_dir_synced = False
+        # every segment starts with the term record, so a segment is never missing the term it belongs to
+        if self.last_term_and_vote is not None:
+            self.pending_records.insert(0, self.term_record(*self.last_term_and_vote))
+
+    def term_record(self, current_term, vote_for):
+        return json.dumps({"record_type": "term",
+                           "current_term": current_term,
+                           "vote_for": None if vote_for is None else list(vote_for)})
+
+    def append_entry(self, log_data):
+        """
+
+        buffer one log entry, it is only durable after the next sync()
+
+        :param log_data: LogData
+        """
+        one_record = json.dumps({"record_type": "entry",
+                                 "log_index": log_data.log_index,
+                                 "log_term": log_data.log_term,
+                                 "request_command_action_list": log_data.request_command_action_list})
+        with self.lock:
+            self.pending_records.append(one_record)
+
+    def truncate(self, log_index):
+        """
+
+        buffer the deletion of the log at log_index and all that follow it
+
+        :param log_index: int
+        """
+        with self.lock:
+            self.pending_records.append(json.dumps({"record_type": "truncate", "log_index": log_index}))
+
+    def record_term_and_vote(self, current_term, vote_for):
+        """
+
+        buffer the current term and vote for, skipped if nothing changed since last record
+
+        :param current_term: int
+        :param vote_for: (str, int) or None
+        """
+        vote_for = None if vote_for is None else tuple(vote_for)
+        with self.lock:
+            if self.last_term_and_vote == (current_term, vote_for):
+                return
+            self.last_term_and_vote = (current_term, vote_for)
+            self.pending_records.append(self.term_record(current_term, vote_for))
+
+    def sync(self):
+        """
+
+        write all the buffered records and fsync them with one disk flush
+
+        """
+        with self.sync_lock:
+            with self.lock:
+                if len(self.pending_records) == 0:
+                    return
+                if self.segment_size >= self.segment_max_bytes:
+                    self.open_next_segment()
+                data = "\n".join(self.pending_records) + "\n"
+                self.pending_records = []
+            self.segment_file.write(data)
+            self.segment_file.flush()
+            os.fsync(self.segment_file.fileno())
+            self.segment_size += len(data)
+            if not self.segment_in_dir_synced:
+                self.sync_dir()
+                self.segment_in_dir_synced = True
+
+    def sync_dir(self):
+        """
+
+        fsync the folder, so files created, renamed or removed in it stay that way after a crash
+
+        """
+        # folders could not be opened on Windows, the rename is durable there without it
+        if os.name == "nt":
+            return
+        dir_fd = os.open(self.wal_dir, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+    def has_pending_records(self):
+        with self.lock:
+            return len(self.pending_records) > 0
+
+    def save_snapshot(self, raft_peer_state):
+        """
+
+        write the snapshot, then rewrite the logs after it into a new segment
+        and remove all the older segments
+
+        :param raft_peer_state: RaftPeerState
+        """
+        with self.sync_lock, self.lock:
+            # the old segments stay complete until the new one is on disk
+            self.sync()
+            raft_peer_state.snapshot.save_to_file(os.path.join(self.wal_dir, self.snapshot_file_name))
+            self.sync_dir()
+            old_segment_numbers = self.list_segment_numbers()
+            self.open_next_segment()
+            for one_log_data in raft_peer_state.state_log:
+                self.append_entry(one_log_data)
+            self.sync()
+            for segment_number in old_segment_numbers:
+                if segment_number != self.segment_number:
+                    os.remove(self.segment_path(segment_number))
+            self.sync_dir()
+            logger.debug(" snapshot saved " + str(raft_peer_state.snapshot) + " removed " +
+                         str(len(old_segment_numbers)) + " segments", extra=self.my_detail)
+
+    def close(self):
+        with self.sync_lock, self.lock:
+            self.sync()
+            if self.segment_file is not None:
+                self.segment_file.close()
+                self.segment_file = None
@@ -15,6 +15,7 @@ import sys
 from configparser import ConfigParser
 import logging
 from RaftPeer import RaftPeer
+from AsyncRaftPeer import AsyncRaftPeer
 import time
 
 import argparse
@@ -30,6 +31,8 @@ if __name__ == '__main__':
 
     arg_parser.add_argument("-v", "--visualization", help="connecting to the visualization game server",
                     action="store_true")
+    arg_parser.add_argument("-e", "--engine", help="thread per connection or one asyncio event loop",
+                            choices=["thread", "asyncio"], default="thread")
     command_line_args = arg_parser.parse_args()
 
     # if len(sys.argv) != 3:
@@ -58,6 +61,7 @@ if __name__ == '__main__':
         append_entries_timeout = int(config_parser["raft_timeout"]["append_entreis"])
         min_leader_election_timeout = int(config_parser["raft_timeout"]["min_leader_election"])
         max_leader_election_timeout = int(config_parser["raft_timeout"]["max_leader_election"])
+        read_lease_timeout = float(config_parser["raft_timeout"].get("read_lease", 0))
     except Exception as e:
         sys.exit(str(e) + " Please check the format of raft_peer.ini file, it should contain raft_peer_listen_port and raft_peer_client_port")
 
@@ -65,7 +69,11 @@ if __name__ == '__main__':
     logging.basicConfig(format=FORMAT, level=logging.DEBUG, filename= ("logs/" + cur_peer_name+"_raft_log_file"), filemode="w")
 
     print ("host_ip => " + host_ip)
-    peer1_raft = RaftPeer(host_ip, listen_port, user_listen_port, cur_peer_name, total_peer_num, append_entries_timeout, min_leader_election_timeout, max_leader_election_timeout)
+    # both engines run the same Raft and talk the same wire format
+    raft_peer_class = AsyncRaftPeer if command_line_args.engine == "asyncio" else RaftPeer
+    peer1_raft = raft_peer_class(host_ip, listen_port, user_listen_port, cur_peer_name, total_peer_num, append_entries_timeout, min_leader_election_timeout, max_leader_election_timeout)
+
+    peer1_raft.set_read_lease(read_lease_timeout)
 
     peer_addr_port_tuple_list = []
 
@@ -75,13 +83,61 @@ if __name__ == '__main__':
         other_peer_listen_port = int(config_parser["peer"+str(i + 1)]["raft_peer_listen_port"])
         peer_addr_port_tuple_list.append((other_peer_host_ip, other_peer_listen_port))
 
+    # limits of one append entries and wire codec are optional, defaults are used without the raft_replication section
+    if config_parser.has_section("raft_replication"):
+        try:
+            max_entries_per_append = int(config_parser["raft_replication"]["max_entries_per_append"])
+            max_bytes_per_append = int(config_parser["raft_replication"]["max_bytes_per_append"])
+            wire_codec = config_parser["raft_replication"].get("wire_codec", "binary_v1")
+            outbound_queue_size = int(config_parser["raft_replication"].get("outbound_queue_size", 256))
+            max_in_flight_appends = int(config_parser["raft_replication"].get("max_in_flight_appends", 4))
+            max_in_flight_bytes = int(config_parser["raft_replication"].get("max_in_flight_bytes", 1024 * 1024))
+            replication_coalescing_window = float(
+                config_parser["raft_replication"].get("replication_coalescing_window", 0.002))
+            forward_to_leader = config_parser["raft_replication"].getboolean("forward_to_leader", False)
+            session_expiry_logs = int(config_parser["raft_replication"].get("session_expiry_logs", 100000))
+            state_machine = config_parser["raft_replication"].get("state_machine", "remote_var")
+            peer1_raft.set_state_machine(state_machine)
+        except Exception as e:
+            sys.exit(str(e) + " Please check the format of raft_replication section")
+        peer1_raft.set_append_entries_limits(max_entries_per_append, max_bytes_per_append)
+        peer1_raft.set_wire_codec(wire_codec)
+        peer1_raft.set_outbound_queue_size(outbound_queue_size)
+        peer1_raft.set_replication_coalescing_window(replication_coalescing_window)
+        peer1_raft.set_in_flight_limits(max_in_flight_appends, max_in_flight_bytes)
+        peer1_raft.set_forward_to_leader(forward_to_leader)
+        peer1_raft.set_session_expiry_logs(session_expiry_logs)
+
+    # write ahead log and log compaction are optional, peer only keeps its state in memory
+    # and never compacts its log without the raft_storage section
+    if config_parser.has_section("raft_storage"):
+        try:
+            snapshot_threshold = int(config_parser["raft_storage"].get("snapshot_threshold", 0))
+            snapshot_chunk_size = int(config_parser["raft_storage"].get("snapshot_chunk_size", 64 * 1024))
+            wal_dir = config_parser["raft_storage"].get("wal_dir", None)
+            wal_segment_max_bytes = int(config_parser["raft_storage"].get("wal_segment_max_bytes", 4 * 1024 * 1024))
+        except Exception as e:
+            sys.exit(str(e) + " Please check the format of raft_storage section")
+        peer1_raft.start_log_compaction(snapshot_threshold, snapshot_chunk_size)
+        if wal_dir is not None:
+            peer1_raft.start_write_ahead_log(wal_dir, wal_segment_max_bytes)
+
     if command_line_args.visualization:
         try:
             visual_host_ip = config_parser["visualization"]["visualization_host_ip"]
             visual_host_port = config_parser["visualization"]["visualization_listen_port"]
         except Exception as e:
             print ("visualization visualization_host_ip/visualization_listen_port not present")
-        peer1_raft.start_visualization_connection_thread(str(visual_host_ip), int(visual_host_port))
+        try:
+            visual_sample_rate = float(config_parser["visualization"].get("visualization_sample_rate", 1.0))
+            # one heart beat when it is not set
+            visual_max_delay = config_parser["visualization"].get("visualization_max_delay", None)
+            visual_max_delay = None if visual_max_delay is None else float(visual_max_delay)
+            visual_buffer_size = int(config_parser["visualization"].get("visualization_buffer_size", 4096))
+        except Exception as e:
+            sys.exit(str(e) + " Please check the format of visualization section")
+        peer1_raft.start_visualization_connection_thread(str(visual_host_ip), int(visual_host_port),
+                                                         visual_sample_rate, visual_max_delay, visual_buffer_size)
         time.sleep(1)
     peer1_raft.start_connect_to_all_peer_thread(peer_addr_port_tuple_list)
     peer1_raft.start_raft_peer()
@@ -0,0 +1,84 @@
+"""
+
+
+This is the script to compare the commands per second of RemoteVar and
+NumericRemoteVar on the same committed logs, applied in passes the way the
+commit thread applies them.
+
+Every workload is run on both state machines and the results and snapshots
+are checked to be the same before the speed is printed.
+
+python3 state_machine_benchmark.py
+python3 state_machine_benchmark.py --pass_size 4096 --passes 100
+
+
+"""
+
+import argparse
+import random
+import sys
+import time
+
+from RemoteVar import RemoteVar
+from NumericRemoteVar import NumericRemoteVar
+
+# name => (number of variables, actions picked at random for every command)
+workloads = {"hot_mixed": (4, ("add", "sub", "time")),
+             "wide_mixed": (1000, ("add", "sub", "time")),
+             "hot_add": (4, ("add",)),
+             "wide_add": (1000, ("add", "sub")),
+             "counter": (1, ("add",))}
+
+
+def create_passes(var_count, actions, pass_size, pass_count, seed):
+    random_generator = random.Random(seed)
+    passes = []
+    log_index = 1
+    for _ in range(pass_count):
+        action_param_lists = []
+        for _ in range(pass_size):
+            action = random_generator.choice(actions)
+            # near 1 so time keeps the values in range
+            param = 1.0 + random_generator.random() / 1000 if action == "time" else random_generator.randint(1, 9)
+            action_param_lists.append(["x" + str(random_generator.randrange(var_count)), action, param])
+        log_indexes = list(range(log_index, log_index + pass_size))
+        log_index += pass_size
+        passes.append((action_param_lists, log_indexes))
+    return passes
+
+
+def run_passes(remote_var, passes):
+    results = []
+    start_time = time.perf_counter()
+    for action_param_lists, log_indexes in passes:
+        results.append(remote_var.perform_actions(action_param_lists, log_indexes))
+    return time.perf_counter() - start_time, results
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="commands per second of the state machines")
+    arg_parser.add_argument("--pass_size", type=int, default=256, help="logs applied in one pass")
+    arg_parser.add_argument("--passes", type=int, default=400, help="passes of every workload")
+    arg_parser.add_argument("--seed", type=int, default=1)
+    command_line_args = arg_parser.parse_args()
+
+    print("%-12s %14s %14s %8s" % ("workload", "RemoteVar/s", "Numeric/s", "speedup"))
+    for workload_name, (var_count, actions) in workloads.items():
+        passes = create_passes(var_count, actions, command_line_args.pass_size, command_line_args.passes,
+                               command_line_args.seed)
+        command_count = command_line_args.pass_size * command_line_args.passes
+        # warm up both, the first passes add the variables
+        remote_var, numeric_remote_var = RemoteVar(), NumericRemoteVar()
+        run_passes(remote_var, passes[:1])
+        run_passes(numeric_remote_var, passes[:1])
+        remote_var_time, remote_var_results = run_passes(remote_var, passes[1:])
+        numeric_time, numeric_results = run_passes(numeric_remote_var, passes[1:])
+        if remote_var_results != numeric_results or remote_var.take_snapshot() != numeric_remote_var.take_snapshot():
+            sys.exit("results of " + workload_name + " are not the same")
+        command_count -= command_line_args.pass_size
+        print("%-12s %14.0f %14.0f %7.2fx" % (workload_name, command_count / remote_var_time,
+                                              command_count / numeric_time, remote_var_time / numeric_time))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+
+
+Shared factories of the tests, peer states with the given log terms and
+RaftPeer without any thread, the tests call the handlers of the state loop
+themselves and look at the messages it sends.
+
+
+"""
+
+from queue import Queue
+
+import pytest
+
+from AppendEntriesFollower import AppendEntriesFollower
+from BinaryCodec import BinaryCodec
+from LogData import LogData
+from RaftPeer import RaftPeer
+from RaftPeerState import RaftPeerState
+
+leader_addr_port_tuple = ("localhost", 20001)
+follower_addr_port_tuples = [("localhost", 20002), ("localhost", 20003), ("localhost", 20004), ("localhost", 20005)]
+
+
+class SentMessages(list):
+    # stands for the OutboundRouter, keeps what the peer sends
+    def put(self, json_data_dict):
+        self.append(json_data_dict)
+
+
+class QuietRaftPeer(RaftPeer):
+    # the sockets are bound but nothing listens or sends, the commit queue is left for the test to apply
+    def start_processing_threads(self):
+        self.json_message_send_queue = SentMessages()
+
+
+def send(json_data_dict):
+    # through the wire format, the receiver gets entries as dict
+    codec = BinaryCodec()
+    return codec.decode(codec.encode_frame(json_data_dict)[BinaryCodec.frame_length_struct.size:])
+
+
+def create_peer_state(log_terms, current_term=0, addr_port_tuple=leader_addr_port_tuple, peer_id="peer1"):
+    """
+
+    peer state whose log has one ["x", "add", 1] command of every term in log_terms
+
+    :param log_terms: list of int
+    :param current_term: int
+    :return: RaftPeerState
+    """
+    raft_peer_state = RaftPeerState(addr_port_tuple, peer_id, (addr_port_tuple[0], addr_port_tuple[1] + 1000))
+    raft_peer_state.current_term = current_term
+    for log_term in log_terms:
+        log_index = raft_peer_state.log_length()
+        raft_peer_state.append_log(LogData(log_index, log_term, ["x", "add", 1]))
+    return raft_peer_state
+
+
+def become_leader(raft_peer_state, follower_addr_port_tuples):
+    raft_peer_state.peer_state = "leader"
+    raft_peer_state.initialize_peers_next_and_match_index(follower_addr_port_tuples)
+    return raft_peer_state
+
+
+@pytest.fixture
+def followers():
+    return follower_addr_port_tuples
+
+
+@pytest.fixture
+def peer_state_factory():
+    return create_peer_state
+
+
+@pytest.fixture
+def leader_state_factory():
+    def create_leader_state(log_terms, current_term, max_peer_number=2):
+        return become_leader(create_peer_state(log_terms, current_term),
+                             follower_addr_port_tuples[:max_peer_number - 1])
+    return create_leader_state
+
+
+@pytest.fixture
+def raft_peer_factory():
+    """
+
+    RaftPeer on free ports of localhost with the given log, as a leader its followers are connected
+    and it sends through SentMessages, the sockets are closed after the test
+
+    """
+    raft_peers = []
+
+    def create_raft_peer(log_terms=(), current_term=0, peer_state="follower", max_peer_number=2,
+                         raft_peer_class=QuietRaftPeer):
+        raft_peer = raft_peer_class("localhost", 0, 0, "peer1", max_peer_number, 0.05, 1, 2)
+        raft_peers.append(raft_peer)
+        raft_peer.raft_peer_state.current_term = current_term
+        for log_term in log_terms:
+            log_index = raft_peer.raft_peer_state.log_length()
+            raft_peer.raft_peer_state.append_log(LogData(log_index, log_term, ["x", "add", 1]))
+        # the heart beats go to the peers with a client socket, these ones are never written to
+        for follower_addr_port_tuple in follower_addr_port_tuples[:max_peer_number - 1]:
+            raft_peer.peers_addr_client_socket[follower_addr_port_tuple] = None
+        if peer_state == "leader":
+            become_leader(raft_peer.raft_peer_state, follower_addr_port_tuples[:max_peer_number - 1])
+        else:
+            raft_peer.raft_peer_state.peer_state = peer_state
+        return raft_peer
+
+    yield create_raft_peer
+    for raft_peer in raft_peers:
+        raft_peer.socket.close()
+        raft_peer.user_socket.close()
+
+
+@pytest.fixture
+def replicate():
+    def replicate_until_idle(leader, follower_state):
+        """
+
+        deliver the append entries the leader sends to its only follower and the replies,
+        through the binary codec, until nothing is left
+
+        :return: (list of the append entries delivered, list of the rejected replies)
+        """
+        append_entries_list, rejected_replies = [], []
+        while len(leader.json_message_send_queue) > 0:
+            append_entries = send(leader.json_message_send_queue.pop(0))
+            append_entries_list.append(append_entries)
+            reply = send(AppendEntriesFollower(append_entries, follower_state, Queue()).process_append_entries())
+            if not reply["append_entries_result"]:
+                rejected_replies.append(reply)
+            leader.process_append_entries_follower_reply(reply)
+        return append_entries_list, rejected_replies
+    return replicate_until_idle
@@ -0,0 +1,58 @@
+"""
+
+
+Tests of the size-bounded append entries, a batch stops at
+max_entries_per_append logs or max_bytes_per_append bytes, and followers
+with every log only get an empty heartbeat.
+
+
+"""
+
+
+def sent_entries(raft_peer):
+    return [[one_log.log_index for one_log in one_message["new_entries"]]
+            for one_message in raft_peer.json_message_send_queue]
+
+
+def test_follower_with_every_log_gets_heartbeat(raft_peer_factory, followers):
+    raft_peer = raft_peer_factory([1, 1, 1, 1, 1], 1, "leader")
+    raft_peer.raft_peer_state.peers_match_index[followers[0]] = 4
+    raft_peer.raft_peer_state.peers_next_index[followers[0]] = 3
+    raft_peer.put_sent_to_all_peer_append_entries_heart_beat()
+    # its match index already covers the log, nothing is sent again
+    assert [[]] == sent_entries(raft_peer)
+
+
+def replicate_all(raft_peer, peer_state_factory, replicate, follower_addr_port_tuple):
+    # an empty follower of the same term, probed from the end of the leader's log
+    follower_state = peer_state_factory([], raft_peer.raft_peer_state.current_term, follower_addr_port_tuple, "peer2")
+    raft_peer.put_sent_to_all_peer_append_entries_heart_beat()
+    append_entries_list, _ = replicate(raft_peer, follower_state)
+    return [len(append_entries["new_entries"]) for append_entries in append_entries_list], follower_state
+
+
+def test_batches_bounded_by_entries(raft_peer_factory, peer_state_factory, replicate, followers):
+    raft_peer = raft_peer_factory([1] * 150, 1, "leader")
+    batch_sizes, follower_state = replicate_all(raft_peer, peer_state_factory, replicate, followers[0])
+    # a heart beat probe, then batches of at most max_entries_per_append logs
+    assert [0, 64, 64, 22] == batch_sizes
+    assert 150 == follower_state.log_length()
+    assert 149 == raft_peer.raft_peer_state.peers_match_index[followers[0]]
+
+
+def test_batches_bounded_by_bytes(raft_peer_factory, peer_state_factory, replicate, followers):
+    raft_peer = raft_peer_factory([1] * 20, 1, "leader")
+    log_size = raft_peer.raft_peer_state.state_log[0].estimate_encoded_size()
+    raft_peer.max_bytes_per_append = 6 * log_size
+    batch_sizes, follower_state = replicate_all(raft_peer, peer_state_factory, replicate, followers[0])
+    assert [0, 6, 6, 6, 2] == batch_sizes
+    assert 20 == follower_state.log_length()
+
+
+def test_log_bigger_than_max_bytes_still_sent(raft_peer_factory, followers):
+    raft_peer = raft_peer_factory([1, 1, 1], 1, "leader")
+    raft_peer.max_bytes_per_append = 1
+    raft_peer.raft_peer_state.peers_next_index[followers[0]] = 0
+    append_entries = raft_peer.create_append_entries(followers[0], "append")
+    # one log per append entries, otherwise it could never be sent
+    assert [0] == [one_log.log_index for one_log in append_entries["new_entries"]]
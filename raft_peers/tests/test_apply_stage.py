@@ -0,0 +1,100 @@
+"""
+
+
+Tests of the apply stage, the commit thread takes the committed logs in
+passes of at most max_logs_per_apply, applies them to the remote_var in
+log order with the snapshots installed from the leader, and takes its own
+snapshot every snapshot_threshold logs for the state loop to compact.
+
+
+"""
+
+import pytest
+
+from LogData import LogData
+from RemoteVar import RemoteVar
+from Snapshot import Snapshot
+
+
+def committed_logs(raft_peer, request_command_lists):
+    for request_command_list in request_command_lists:
+        log_index = raft_peer.raft_peer_state.log_length()
+        raft_peer.raft_peer_state.append_log(LogData(log_index, 1, request_command_list))
+    raft_peer.raft_peer_state.commit_index = raft_peer.raft_peer_state.log_length() - 1
+    return list(raft_peer.raft_peer_state.state_log)
+
+
+def applied_results(logs_applied):
+    return [(one_log.log_index, command_result) for one_log, command_result in logs_applied["applied_logs"]]
+
+
+@pytest.fixture
+def raft_peer(raft_peer_factory):
+    return raft_peer_factory([], 1, "follower")
+
+
+def test_pass_takes_at_most_max_logs(raft_peer):
+    one_pass_logs = committed_logs(raft_peer, [["x", "add", 1]] * 4)
+    raft_peer.max_logs_per_apply = 3
+    for one_log in one_pass_logs[1:]:
+        raft_peer.json_message_commit_queue.put(one_log)
+    assert [0, 1, 2] == [one_log.log_index for one_log in raft_peer.take_waiting_logs(one_pass_logs[0])]
+    # the rest waits for the next pass
+    assert 1 == raft_peer.json_message_commit_queue.qsize()
+
+
+def test_logs_applied_once_in_order(raft_peer):
+    one_pass_logs = committed_logs(raft_peer, [["x", "add", 1], ["x", "time", 3], ["y", "add", 2]])
+    logs_applied = raft_peer.apply_committed_logs(one_pass_logs[:2])
+    assert [(0, 1.0), (1, 3.0)] == applied_results(logs_applied)
+    # handed again after a leader change, only the new one is applied
+    logs_applied = raft_peer.apply_committed_logs(one_pass_logs)
+    assert [(2, 2.0)] == applied_results(logs_applied)
+    assert (2, None) == (logs_applied["applied_index"], logs_applied["snapshot"])
+    assert 3.0 == raft_peer.raft_peer_state.remote_var.read_var("x")
+    # the state loop moves it
+    assert -1 == raft_peer.raft_peer_state.last_apply
+
+
+def test_failing_command_does_not_stop_pass(raft_peer):
+    logs_applied = raft_peer.apply_committed_logs(committed_logs(raft_peer, [["x", "add", 1], ["x", "div", 0],
+                                                                             ["x", "add", 1]]))
+    command_results = [command_result for one_log, command_result in logs_applied["applied_logs"]]
+    assert command_results[1].startswith(RemoteVar.command_error)
+    assert [1.0, 2.0] == [command_results[0], command_results[2]]
+
+
+def test_installed_snapshot_applied_in_turn(raft_peer):
+    one_pass_logs = committed_logs(raft_peer, [["x", "add", 1]] * 4)
+    leader_remote_var = RemoteVar()
+    leader_remote_var.perform_action(["x", "add", 10], 2)
+    installed_snapshot = Snapshot(2, 1, leader_remote_var.take_snapshot())
+    logs_applied = raft_peer.apply_committed_logs([one_pass_logs[0], installed_snapshot] + one_pass_logs[1:])
+    # the logs included in the snapshot are skipped, the ones after it are applied on top
+    assert [(0, 1.0), (3, 11.0)] == applied_results(logs_applied)
+    assert (3, 2) == (raft_peer.applied_index, raft_peer.applied_snapshot_index)
+
+
+def test_snapshot_taken_at_threshold_compacts_log(raft_peer):
+    raft_peer.snapshot_threshold = 3
+    logs_applied = raft_peer.apply_committed_logs(committed_logs(raft_peer, [["x", "add", 1]] * 5))
+    taken_snapshot = logs_applied["snapshot"]
+    assert 2 == taken_snapshot.last_included_index
+    # taken before the logs after it changed the remote_var
+    restored_remote_var = RemoteVar()
+    restored_remote_var.restore_snapshot(taken_snapshot.snapshot_vars)
+    assert 3.0 == restored_remote_var.read_var("x")
+    assert 5.0 == raft_peer.raft_peer_state.remote_var.read_var("x")
+
+    raft_peer.process_logs_applied(logs_applied)
+    assert (4, 2) == (raft_peer.raft_peer_state.last_apply, raft_peer.raft_peer_state.snapshot_last_index)
+    assert [3, 4] == [one_log.log_index for one_log in raft_peer.raft_peer_state.state_log]
+
+
+def test_older_snapshot_not_compacted(raft_peer):
+    raft_peer.snapshot_threshold = 2
+    logs_applied = raft_peer.apply_committed_logs(committed_logs(raft_peer, [["x", "add", 1]] * 4))
+    # the leader installed a newer one while this pass was applied
+    raft_peer.raft_peer_state.install_snapshot(Snapshot(3, 1, RemoteVar().take_snapshot()))
+    raft_peer.process_logs_applied(logs_applied)
+    assert 3 == raft_peer.raft_peer_state.snapshot_last_index
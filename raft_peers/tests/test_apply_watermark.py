@@ -0,0 +1,62 @@
+"""
+
+
+Tests of the commit index watermark of followers, every committed log is
+handed to the commit thread exactly once and a heartbeat that does not move
+the commit index hands nothing.
+
+
+"""
+
+from queue import Queue
+
+from AppendEntriesFollower import AppendEntriesFollower
+from LogData import LogData
+from Snapshot import Snapshot
+
+
+def append_entries(prev_log_index, prev_log_term, leader_commit_index, new_entries=(), sender_term=1):
+    return {"msg_type": "append_entries_leader", "sender_term": sender_term, "peer_id": "peer1",
+            "prev_log_index": prev_log_index, "prev_log_term": prev_log_term,
+            "leader_commit_index": leader_commit_index, "read_round": 0,
+            "new_entries": [{"log_index": one_log.log_index, "log_term": one_log.log_term,
+                             "request_command_action_list": one_log.request_command_action_list}
+                            for one_log in new_entries],
+            "send_from": ["localhost", 20001], "send_to": ["localhost", 20002]}
+
+
+def handed_logs(follower_state, json_data_dict):
+    commit_queue = Queue()
+    AppendEntriesFollower(json_data_dict, follower_state, commit_queue).process_append_entries()
+    return [commit_queue.get_nowait().log_index for _ in range(commit_queue.qsize())]
+
+
+def test_heartbeats_hand_each_log_once(peer_state_factory):
+    follower_state = peer_state_factory([1, 1, 1, 1], 1, ("localhost", 20002), "peer2")
+    assert [0, 1] == handed_logs(follower_state, append_entries(3, 1, 1))
+    # the commit index did not move, nothing is scanned or handed again
+    for _ in range(3):
+        assert [] == handed_logs(follower_state, append_entries(3, 1, 1))
+    assert [2, 3] == handed_logs(follower_state, append_entries(3, 1, 3))
+    assert 3 == follower_state.commit_index
+
+
+def test_heartbeat_commits_only_matching_logs(peer_state_factory):
+    follower_state = peer_state_factory([1, 1, 1, 1], 1, ("localhost", 20002), "peer2")
+    # only the logs up to prev log are known to be the leader's
+    assert [0, 1] == handed_logs(follower_state, append_entries(1, 1, 3))
+    assert 1 == follower_state.commit_index
+
+
+def test_new_entries_committed_with_leader_commit_index(peer_state_factory):
+    follower_state = peer_state_factory([1, 1], 1, ("localhost", 20002), "peer2")
+    new_entries = [LogData(2, 1, ["x", "add", 1]), LogData(3, 1, ["x", "add", 1])]
+    # the leader committed further than this batch, the follower stops at its last log
+    assert [0, 1, 2, 3] == handed_logs(follower_state, append_entries(1, 1, 10, new_entries))
+    assert 3 == follower_state.commit_index
+
+
+def test_logs_in_snapshot_never_handed(peer_state_factory):
+    follower_state = peer_state_factory([1, 1, 1, 1, 1], 1, ("localhost", 20002), "peer2")
+    follower_state.install_snapshot(Snapshot(2, 1, {"vars": {}, "sessions": {}}))
+    assert [3, 4] == handed_logs(follower_state, append_entries(4, 1, 4))
@@ -0,0 +1,159 @@
+"""
+
+
+Tests of the asyncio engine, the Raft handlers of RaftPeer run on one event
+loop: messages read in one loop pass are handled in one batch, events of
+other threads join it, and the timer and commit coroutines replicate, apply
+and reply to a command without any thread of the threaded engine.
+
+
+"""
+
+import asyncio
+import threading
+
+import pytest
+
+from AsyncRaftPeer import AsyncRaftPeer
+from LoopQueue import LoopQueue
+from StateEvent import StateEvent
+
+from .conftest import SentMessages
+
+
+class QuietAsyncRaftPeer(AsyncRaftPeer):
+    # the test runs the coroutines it needs on its own event loop, everything sent is kept
+    def start_processing_threads(self):
+        super().start_processing_threads()
+        self.json_message_send_queue = SentMessages()
+
+
+@pytest.fixture
+def async_raft_peer_factory(raft_peer_factory):
+    def create_async_raft_peer(log_terms=(), current_term=0, peer_state="follower"):
+        return raft_peer_factory(log_terms, current_term, peer_state, raft_peer_class=QuietAsyncRaftPeer)
+    return create_async_raft_peer
+
+
+async def wait_until(condition, timeout=2):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline
+        await asyncio.sleep(0.01)
+
+
+def test_loop_queue_keeps_items_put_before_bind():
+    loop_queue = LoopQueue()
+    loop_queue.put(1)
+    loop_queue.put(2)
+    assert 2 == loop_queue.qsize()
+
+    async def get_all():
+        loop_queue.bind(asyncio.get_running_loop())
+        # put by another thread, handed to the loop
+        put_thread = threading.Thread(target=loop_queue.put, args=(3,))
+        put_thread.start()
+        put_thread.join()
+        return [await loop_queue.get() for _ in range(3)]
+
+    assert [1, 2, 3] == asyncio.run(get_all())
+
+
+def test_calls_before_loop_kept_until_it_runs(async_raft_peer_factory):
+    raft_peer = async_raft_peer_factory()
+    called = []
+    raft_peer.call_in_loop(called.append, 1)
+    assert [] == called
+    assert [(called.append, (1,))] == raft_peer.pending_loop_calls
+
+
+def test_messages_of_one_loop_pass_handled_together(async_raft_peer_factory):
+    raft_peer = async_raft_peer_factory()
+    handled_batches = []
+    raft_peer.process_recv_json_messages = handled_batches.append
+
+    async def put_messages():
+        raft_peer.loop = asyncio.get_running_loop()
+        for message_number in range(3):
+            raft_peer.put_recv_batch({"msg_type": "append_entries_leader", "message_number": message_number})
+        await asyncio.sleep(0)
+        raft_peer.put_recv_batch({"msg_type": "append_entries_leader", "message_number": 3})
+        await asyncio.sleep(0)
+
+    asyncio.run(put_messages())
+    assert [[0, 1, 2], [3]] == [[one_message["message_number"] for one_message in one_batch]
+                                for one_batch in handled_batches]
+
+
+def test_batch_handled_when_full(async_raft_peer_factory):
+    raft_peer = async_raft_peer_factory()
+    raft_peer.max_recv_batch = 2
+    handled_batches = []
+    raft_peer.process_recv_json_messages = handled_batches.append
+
+    async def put_messages():
+        raft_peer.loop = asyncio.get_running_loop()
+        for message_number in range(3):
+            raft_peer.put_recv_batch({"msg_type": "append_entries_leader", "message_number": message_number})
+        # the full batch did not wait for the loop
+        assert 1 == len(handled_batches)
+        await asyncio.sleep(0)
+
+    asyncio.run(put_messages())
+    assert [2, 1] == [len(one_batch) for one_batch in handled_batches]
+
+
+def test_state_event_of_other_thread_handled_on_loop(async_raft_peer_factory):
+    raft_peer = async_raft_peer_factory()
+    handled_threads = []
+
+    def record_batch(recv_json_messages):
+        handled_threads.append((threading.get_ident(), [one_message.event_type for one_message in recv_json_messages]))
+    raft_peer.process_recv_json_messages = record_batch
+
+    async def put_from_thread():
+        raft_peer.loop = asyncio.get_running_loop()
+        put_thread = threading.Thread(target=raft_peer.put_state_event, args=(StateEvent.timer_fired,))
+        put_thread.start()
+        put_thread.join()
+        await wait_until(lambda: len(handled_threads) > 0)
+        return threading.get_ident()
+
+    event_loop_thread = asyncio.run(put_from_thread())
+    assert [(event_loop_thread, [StateEvent.timer_fired])] == handled_threads
+
+
+def test_command_replicated_applied_and_replied(async_raft_peer_factory, followers):
+    raft_peer = async_raft_peer_factory([], 1, "leader")
+    user_addr_port_tuple = ["localhost", 30001]
+
+    def sent(msg_type):
+        return [one_message for one_message in raft_peer.json_message_send_queue
+                if one_message["msg_type"] == msg_type]
+
+    async def request_command():
+        raft_peer.loop = asyncio.get_running_loop()
+        raft_peer.json_message_commit_queue.bind(raft_peer.loop)
+        coroutines = [asyncio.ensure_future(raft_peer.async_start_time_counter()),
+                      asyncio.ensure_future(raft_peer.async_start_processing_commits())]
+        raft_peer.put_recv_batch({"msg_type": "request_command", "request_command_list": ["x", "add", 5],
+                                  "request_id": 7, "send_from": user_addr_port_tuple})
+        # the timer wakes up for the coalescing window instead of the heart beat
+        await wait_until(lambda: len(sent("append_entries_leader")) > 0, timeout=0.5)
+        append_entries = sent("append_entries_leader")[0]
+        assert [0] == [one_log.log_index for one_log in append_entries["new_entries"]]
+        raft_peer.put_recv_batch({"msg_type": "append_entries_follower_reply", "sender_term": 1,
+                                  "log_index_start": 0, "log_index_end": 0, "prev_log_index": -1,
+                                  "read_round": 0, "append_entries_result": True,
+                                  "send_from": list(followers[0]), "send_to": list(raft_peer.my_addr_port_tuple)})
+        await wait_until(lambda: len(sent("request_command_reply")) > 0)
+        for coroutine in coroutines:
+            coroutine.cancel()
+        await asyncio.gather(*coroutines, return_exceptions=True)
+
+    asyncio.run(request_command())
+    reply = sent("request_command_reply")[0]
+    assert 5.0 == reply["command_result"]
+    assert 7 == reply["request_id"]
+    assert user_addr_port_tuple == reply["send_to"]
+    assert 0 == raft_peer.raft_peer_state.last_apply
@@ -0,0 +1,97 @@
+"""
+
+
+Tests of the client sessions, a command retried after it was applied is
+answered from its session instead of being applied twice, results the
+client acknowledged are dropped, and idle sessions expire at the same log
+on every peer.
+
+
+"""
+
+import pytest
+
+from RemoteVar import RemoteVar
+from Snapshot import Snapshot
+
+
+def session_command(client_seq, client_ack_seq=0, client_id="c1"):
+    return ["x", "add", 1, [client_id, client_seq, client_ack_seq]]
+
+
+@pytest.fixture
+def remote_var():
+    return RemoteVar()
+
+
+def test_retried_command_applied_once(remote_var):
+    assert 1.0 == remote_var.perform_action(session_command(1), 0)
+    # the retry got a new log, the session answers it
+    assert 1.0 == remote_var.perform_action(session_command(1), 1)
+    assert 1.0 == remote_var.read_var("x")
+    assert 2.0 == remote_var.perform_action(session_command(2), 2)
+    assert (True, 1.0) == remote_var.session_result("c1", 1)
+
+
+def test_acknowledged_results_dropped(remote_var):
+    for log_index, client_seq in enumerate((1, 2, 3)):
+        remote_var.perform_action(session_command(client_seq), log_index)
+    remote_var.perform_action(session_command(4, client_ack_seq=2), 3)
+    assert [3, 4] == list(remote_var.sessions["c1"]["results"])
+    # the client got the reply of 1, a late copy of it is not applied again
+    assert remote_var.perform_action(session_command(1, client_ack_seq=2), 4) is None
+    assert 4.0 == remote_var.read_var("x")
+
+
+def test_failed_command_result_kept(remote_var):
+    result = remote_var.perform_action(["x", "div", 0, ["c1", 1, 0]], 0)
+    assert result.startswith(RemoteVar.command_error)
+    assert result == remote_var.perform_action(["x", "div", 0, ["c1", 1, 0]], 1)
+
+
+def test_idle_session_expires(remote_var, monkeypatch):
+    monkeypatch.setattr(RemoteVar, "session_expiry_logs", 5)
+    monkeypatch.setattr(RemoteVar, "session_expiry_check_logs", 4)
+    remote_var.perform_action(session_command(1), 1)
+    remote_var.perform_action(session_command(1, client_id="c2"), 6)
+    # only looked for at the multiples of session_expiry_check_logs
+    remote_var.perform_action(["y", "add", 1], 7)
+    assert {"c1", "c2"} == set(remote_var.sessions)
+    remote_var.perform_action(["y", "add", 1], 8)
+    assert {"c2"} == set(remote_var.sessions)
+    # the client still waits for commands after the ones it acknowledged
+    assert "session_expired" == remote_var.perform_action(session_command(2, client_ack_seq=1), 9)
+    # only the first command of c1 and c2 were applied
+    assert 2.0 == remote_var.read_var("x")
+
+
+def test_sessions_restored_from_snapshot(remote_var):
+    remote_var.perform_action(session_command(1), 0)
+    remote_var.perform_action(session_command(2, client_ack_seq=1), 1)
+    snapshot = Snapshot(1, 1, remote_var.take_snapshot())
+    received_snapshot = Snapshot(1, 1)
+    # as a follower gets it from the leader
+    received_snapshot.add_chunk(0, snapshot.get_chunk(0, 1024 * 1024)[0])
+    received_snapshot.finish_receiving()
+
+    restored_remote_var = RemoteVar()
+    restored_remote_var.restore_snapshot(received_snapshot.snapshot_vars)
+    assert 2.0 == restored_remote_var.perform_action(session_command(2, client_ack_seq=1), 2)
+    assert 2.0 == restored_remote_var.read_var("x")
+    assert 1 == restored_remote_var.sessions["c1"]["ack_seq"]
+
+
+def test_leader_answers_applied_retry_without_log(raft_peer_factory):
+    raft_peer = raft_peer_factory([], 1, "leader")
+    request_command = {"msg_type": "request_command", "request_command_list": ["x", "add", 1], "client_id": "c1",
+                       "client_seq": 1, "client_ack_seq": 0, "request_id": 1, "send_from": ["localhost", 30001]}
+    raft_peer.process_request_command(request_command)
+    # the session goes with the command in the log
+    assert ["x", "add", 1, ["c1", 1, 0]] == raft_peer.raft_peer_state.state_log[0].request_command_action_list
+    raft_peer.raft_peer_state.remote_var.perform_action(
+        raft_peer.raft_peer_state.state_log[0].request_command_action_list, 0)
+
+    raft_peer.process_request_command(dict(request_command, request_id=2))
+    assert 1 == raft_peer.raft_peer_state.log_length()
+    assert [(1.0, 2)] == [(one_reply["command_result"], one_reply["request_id"])
+                          for one_reply in raft_peer.json_message_send_queue]
@@ -0,0 +1,72 @@
+"""
+
+
+Tests of advance_leader_commit_index, the leader commit index follows the
+match index of the majority and only counts logs of its current term.
+
+
+"""
+
+from LogData import LogData
+from Snapshot import Snapshot
+
+
+def committed_indexes(logs):
+    return [one_log.log_index for one_log in logs]
+
+
+def test_majority_match_index(leader_state_factory, followers):
+    raft_peer_state = leader_state_factory([1, 1, 1, 1, 1], 1, 5)
+    raft_peer_state.peers_match_index[followers[0]] = 3
+    # leader and one follower are not the majority of five
+    assert [] == raft_peer_state.advance_leader_commit_index(5)
+    raft_peer_state.peers_match_index[followers[1]] = 1
+    assert [0, 1] == committed_indexes(raft_peer_state.advance_leader_commit_index(5))
+    raft_peer_state.peers_match_index[followers[2]] = 4
+    assert [2, 3] == committed_indexes(raft_peer_state.advance_leader_commit_index(5))
+    assert 3 == raft_peer_state.commit_index
+    # nothing new is committed twice
+    assert [] == raft_peer_state.advance_leader_commit_index(5)
+
+
+def test_peers_not_connected_count_as_nothing(leader_state_factory, followers):
+    raft_peer_state = leader_state_factory([1, 1], 1, 3)
+    del raft_peer_state.peers_match_index[followers[1]]
+    assert [] == raft_peer_state.advance_leader_commit_index(3)
+    raft_peer_state.peers_match_index[followers[0]] = 1
+    assert [0, 1] == committed_indexes(raft_peer_state.advance_leader_commit_index(3))
+
+
+def test_only_current_term_is_counted(leader_state_factory, followers):
+    # figure 8 of the Raft paper, logs of older terms are committed with a log of the current term
+    raft_peer_state = leader_state_factory([1, 2, 2, 4], 4, 3)
+    raft_peer_state.peers_match_index[followers[0]] = 2
+    assert [] == raft_peer_state.advance_leader_commit_index(3)
+    raft_peer_state.peers_match_index[followers[0]] = 3
+    assert [0, 1, 2, 3] == committed_indexes(raft_peer_state.advance_leader_commit_index(3))
+
+
+def test_after_snapshot(leader_state_factory, followers):
+    raft_peer_state = leader_state_factory([1, 1, 2, 2, 2, 3, 3], 3, 3)
+    raft_peer_state.commit_index = 4
+    raft_peer_state.compact_log(Snapshot(4, 2, {"vars": {}, "sessions": {}}))
+    # lagging followers point into the compacted logs, there is no term to look up there
+    raft_peer_state.peers_match_index[followers[0]] = 1
+    raft_peer_state.peers_match_index[followers[1]] = 2
+    assert [] == raft_peer_state.advance_leader_commit_index(3)
+    assert 4 == raft_peer_state.commit_index
+    # exactly at the snapshot
+    raft_peer_state.peers_match_index[followers[0]] = 4
+    assert [] == raft_peer_state.advance_leader_commit_index(3)
+    raft_peer_state.peers_match_index[followers[1]] = 6
+    assert [5, 6] == committed_indexes(raft_peer_state.advance_leader_commit_index(3))
+    assert 6 == raft_peer_state.commit_index
+
+
+def test_snapshot_ahead_of_commit_index(leader_state_factory, followers):
+    # installed from an earlier leader, commit index is moved to the snapshot with it
+    raft_peer_state = leader_state_factory([1, 1, 2], 3, 3)
+    raft_peer_state.install_snapshot(Snapshot(5, 2, {"vars": {}, "sessions": {}}))
+    raft_peer_state.append_log(LogData(6, 3, ["x", "add", 1]))
+    raft_peer_state.peers_match_index[followers[0]] = 6
+    assert [6] == committed_indexes(raft_peer_state.advance_leader_commit_index(3))
@@ -0,0 +1,101 @@
+"""
+
+
+Tests of the conflict_term/conflict_index backtracking of next index, a
+leader RaftPeer (its threads not started) replicates to an
+AppendEntriesFollower through the binary codec until their logs match.
+
+
+"""
+
+from queue import Queue
+
+import pytest
+
+from AppendEntriesFollower import AppendEntriesFollower
+from Snapshot import Snapshot
+
+
+def log_terms(raft_peer_state):
+    return [raft_peer_state.get_log_term(log_index) for log_index in range(raft_peer_state.log_length())]
+
+
+def rejected_reply(leader, follower_addr_port_tuple, prev_log_index, conflict_term, conflict_index):
+    return {"msg_type": "append_entries_follower_reply", "sender_term": leader.raft_peer_state.current_term,
+            "log_index_start": -1, "log_index_end": -1, "prev_log_index": prev_log_index,
+            "conflict_term": conflict_term, "conflict_index": conflict_index, "read_round": 0,
+            "append_entries_result": False, "send_from": list(follower_addr_port_tuple),
+            "send_to": list(leader.my_addr_port_tuple)}
+
+
+@pytest.fixture
+def follower_addr_port_tuple(followers):
+    return followers[0]
+
+
+def test_follower_with_extra_terms(raft_peer_factory, peer_state_factory, replicate, follower_addr_port_tuple):
+    # figure 7 (f) of the Raft paper
+    leader = raft_peer_factory([1, 1, 1, 4, 4, 5, 5, 6, 6, 6], 8, "leader")
+    follower_state = peer_state_factory([1, 1, 1, 2, 2, 2, 3, 3, 3, 3, 3], 8, follower_addr_port_tuple, "peer2")
+    leader.put_append_entries(follower_addr_port_tuple, "append")
+    _, rejected_replies = replicate(leader, follower_state)
+
+    # one reply skips each conflicting term instead of one log
+    assert [(3, 6), (2, 3)] == [(reply["conflict_term"], reply["conflict_index"]) for reply in rejected_replies]
+    assert log_terms(leader.raft_peer_state) == log_terms(follower_state)
+    assert 9 == leader.raft_peer_state.peers_match_index[follower_addr_port_tuple]
+    assert 10 == leader.raft_peer_state.peers_next_index[follower_addr_port_tuple]
+
+
+def test_leader_has_conflict_term(raft_peer_factory, peer_state_factory, replicate, follower_addr_port_tuple):
+    # follower's term 4 logs go further than leader's, next index jumps to the end of term 4 in leader's log
+    leader = raft_peer_factory([1, 1, 1, 4, 4, 5, 5, 6, 6, 6], 8, "leader")
+    follower_state = peer_state_factory([1, 1, 1, 4, 4, 4, 4], 8, follower_addr_port_tuple, "peer2")
+    leader.put_append_entries(follower_addr_port_tuple, "append")
+    _, rejected_replies = replicate(leader, follower_state)
+
+    assert [(-1, 7), (4, 3)] == [(reply["conflict_term"], reply["conflict_index"]) for reply in rejected_replies]
+    assert log_terms(leader.raft_peer_state) == log_terms(follower_state)
+
+
+def test_shorter_follower(raft_peer_factory, peer_state_factory, replicate, follower_addr_port_tuple):
+    leader = raft_peer_factory([1, 1, 2, 2, 2, 2, 2, 2], 3, "leader")
+    follower_state = peer_state_factory([1, 1, 2], 3, follower_addr_port_tuple, "peer2")
+    leader.put_append_entries(follower_addr_port_tuple, "append")
+    _, rejected_replies = replicate(leader, follower_state)
+
+    # continue from the end of the follower's log
+    assert [(-1, 3)] == [(reply["conflict_term"], reply["conflict_index"]) for reply in rejected_replies]
+    assert log_terms(leader.raft_peer_state) == log_terms(follower_state)
+
+
+def test_conflict_index_after_follower_snapshot(peer_state_factory, follower_addr_port_tuple):
+    follower_state = peer_state_factory([1, 1, 2, 2, 2, 2], 3, follower_addr_port_tuple, "peer2")
+    follower_state.take_snapshot(3)
+    append_entries = {"sender_term": 3, "peer_id": "peer1", "prev_log_index": 5, "prev_log_term": 3,
+                      "new_entries": [], "leader_commit_index": 3, "read_round": 0,
+                      "send_from": ["localhost", 20001], "send_to": list(follower_addr_port_tuple)}
+    reply = AppendEntriesFollower(append_entries, follower_state, Queue()).process_append_entries()
+
+    # the first log of term 2 is in the snapshot, only the logs after it could conflict
+    assert not reply["append_entries_result"]
+    assert 2 == reply["conflict_term"]
+    assert 4 == reply["conflict_index"]
+
+
+def test_next_index_never_moves_before_match_index(raft_peer_factory, follower_addr_port_tuple):
+    leader = raft_peer_factory([1, 1, 1, 4, 4, 5, 5, 6, 6, 6], 8, "leader")
+    leader.raft_peer_state.peers_match_index[follower_addr_port_tuple] = 4
+    leader.process_append_entries_follower_reply(rejected_reply(leader, follower_addr_port_tuple, 9, 2, 1))
+
+    assert 5 == leader.raft_peer_state.peers_next_index[follower_addr_port_tuple]
+    # probes again from there right away
+    assert 4 == leader.json_message_send_queue[-1]["prev_log_index"]
+
+
+def test_snapshot_sent_when_next_index_is_compacted(raft_peer_factory, follower_addr_port_tuple):
+    leader = raft_peer_factory([1, 1, 2, 2, 2, 3, 3], 3, "leader")
+    leader.raft_peer_state.compact_log(Snapshot(4, 2, {"vars": {}, "sessions": {}}))
+    leader.process_append_entries_follower_reply(rejected_reply(leader, follower_addr_port_tuple, 6, 1, 0))
+
+    assert "install_snapshot" == leader.json_message_send_queue[-1]["msg_type"]
@@ -0,0 +1,76 @@
+"""
+
+
+Tests of the entries encoded once by the leader, the append entries of every
+follower reuse the same encoded entries and they are dropped from the cache
+once every follower has them.
+
+
+"""
+
+import json
+from unittest import mock
+
+import pytest
+
+from BinaryCodec import BinaryCodec
+from Snapshot import Snapshot
+
+
+def cached_log_indexes(raft_peer):
+    return sorted(log_index for log_index, log_term in raft_peer.wire_codecs[BinaryCodec.codec_name].entry_cache)
+
+
+@pytest.fixture
+def leader_of_three(raft_peer_factory, followers):
+    # three followers without any log
+    raft_peer = raft_peer_factory([1] * 5, 1, "leader", max_peer_number=4)
+    for follower_addr_port_tuple in followers[:3]:
+        raft_peer.raft_peer_state.peers_next_index[follower_addr_port_tuple] = 0
+    return raft_peer
+
+
+def encode_sent_frames(raft_peer):
+    codec = raft_peer.wire_codecs[BinaryCodec.codec_name]
+    return [codec.encode_frame(one_message) for one_message in raft_peer.json_message_send_queue]
+
+
+def test_entries_encoded_once_for_every_follower(leader_of_three):
+    leader_of_three.put_sent_to_all_peer_append_entries_heart_beat()
+    with mock.patch("BinaryCodec.json.dumps", wraps=json.dumps) as dumps:
+        frames = encode_sent_frames(leader_of_three)
+    assert 3 == len(frames)
+    # one action list for every log, not for every follower
+    assert 5 == dumps.call_count
+    assert [0, 1, 2, 3, 4] == cached_log_indexes(leader_of_three)
+
+
+def test_entries_released_once_every_follower_has_them(leader_of_three, followers):
+    leader_of_three.put_sent_to_all_peer_append_entries_heart_beat()
+    encode_sent_frames(leader_of_three)
+    for follower_addr_port_tuple, match_index in zip(followers[:3], (2, 4, 4)):
+        leader_of_three.raft_peer_state.peers_match_index[follower_addr_port_tuple] = match_index
+    leader_of_three.release_encoded_entries()
+    # the slowest follower still needs 3 and 4
+    assert [3, 4] == cached_log_indexes(leader_of_three)
+
+
+def test_accepted_reply_releases_entries(leader_of_three, followers):
+    leader_of_three.put_sent_to_all_peer_append_entries_heart_beat()
+    encode_sent_frames(leader_of_three)
+    for follower_addr_port_tuple in followers[:3]:
+        leader_of_three.process_append_entries_follower_reply(
+            {"msg_type": "append_entries_follower_reply", "sender_term": 1, "log_index_start": 0,
+             "log_index_end": 1, "prev_log_index": -1, "read_round": 0, "append_entries_result": True,
+             "send_from": list(follower_addr_port_tuple), "send_to": list(leader_of_three.my_addr_port_tuple)})
+    assert [2, 3, 4] == cached_log_indexes(leader_of_three)
+
+
+def test_follower_releases_compacted_entries(raft_peer_factory):
+    raft_peer = raft_peer_factory([1] * 5, 1, "follower")
+    codec = raft_peer.wire_codecs[BinaryCodec.codec_name]
+    for one_log in raft_peer.raft_peer_state.state_log:
+        codec.encode_entry(one_log)
+    raft_peer.raft_peer_state.compact_log(Snapshot(2, 1, {"vars": {}, "sessions": {}}))
+    raft_peer.release_encoded_entries()
+    assert [3, 4] == cached_log_indexes(raft_peer)
@@ -0,0 +1,68 @@
+"""
+
+
+Tests of the reads answered by followers, a read with max_staleness_index
+or max_staleness_ms is answered from the follower's remote_var when it is
+within those bounds, and never goes back before min_applied_index.
+
+
+"""
+
+import pytest
+
+
+def read_reply(raft_peer, **staleness):
+    read_command = {"msg_type": "read_command", "read_command_list": ["x"], "send_from": ["localhost", 30001]}
+    read_command.update(staleness)
+    del raft_peer.json_message_send_queue[:]
+    raft_peer.process_one_recv_json_message(read_command)
+    return raft_peer.json_message_send_queue[-1]
+
+
+@pytest.fixture
+def follower(raft_peer_factory, followers):
+    # applied x = 2 of the leader's 4 committed logs, heard from the leader just now
+    raft_peer = raft_peer_factory([1, 1], 1, "follower")
+    raft_peer.raft_peer_state.commit_index = 1
+    raft_peer.raft_peer_state.last_apply = 1
+    for log_index in range(2):
+        raft_peer.raft_peer_state.remote_var.perform_action(["x", "add", 1], log_index)
+    raft_peer.process_one_recv_json_message(
+        {"msg_type": "append_entries_leader", "sender_term": 1, "peer_id": "peer2", "prev_log_index": 1,
+         "prev_log_term": 1, "leader_commit_index": 3, "read_round": 0, "new_entries": [],
+         "leader_user_addr": ["localhost", 21002], "send_from": list(followers[0]),
+         "send_to": list(raft_peer.my_addr_port_tuple)})
+    return raft_peer
+
+
+def test_read_without_bounds_goes_to_leader(follower):
+    reply = read_reply(follower)
+    assert "not_leader" == reply["command_result"]
+    assert ["localhost", 21002] == reply["leader_hint"]
+
+
+def test_read_within_staleness_index(follower):
+    reply = read_reply(follower, max_staleness_index=2)
+    assert 2.0 == reply["command_result"]
+    assert 1 == reply["applied_index"]
+    # the leader committed two logs more than applied here
+    assert "not_leader" == read_reply(follower, max_staleness_index=1)["command_result"]
+
+
+def test_read_within_staleness_ms(follower):
+    assert 2.0 == read_reply(follower, max_staleness_ms=1000)["command_result"]
+    follower.last_leader_contact_time -= 2
+    assert "not_leader" == read_reply(follower, max_staleness_ms=1000)["command_result"]
+
+
+def test_read_never_goes_back(follower):
+    assert 2.0 == read_reply(follower, max_staleness_index=10, min_applied_index=1)["command_result"]
+    # an earlier reply was from a peer that applied more
+    assert "not_leader" == read_reply(follower, max_staleness_index=10, min_applied_index=2)["command_result"]
+
+
+def test_follower_never_heard_from_leader(raft_peer_factory):
+    raft_peer = raft_peer_factory([1], 1, "follower")
+    reply = read_reply(raft_peer, max_staleness_index=10)
+    assert "not_leader" == reply["command_result"]
+    assert reply["leader_hint"] is None
@@ -0,0 +1,136 @@
+"""
+
+
+Tests of FrameReader, frames split over many receives, frames bigger than
+the buffer and the switch from newline to length prefix framing.
+
+
+"""
+
+import struct
+import unittest
+
+from FrameReader import FrameReader
+
+
+class ChunkSocket:
+    # gives the received bytes in the chunks it is made of, at most as many as fit
+    def __init__(self, chunks):
+        self.chunks = [bytes(chunk) for chunk in chunks]
+
+    def recv_into(self, buffer_view):
+        if len(self.chunks) == 0:
+            return 0
+        chunk = self.chunks[0]
+        received_size = min(len(chunk), len(buffer_view))
+        buffer_view[0:received_size] = chunk[0:received_size]
+        if received_size == len(chunk):
+            self.chunks.pop(0)
+        else:
+            self.chunks[0] = chunk[received_size:]
+        return received_size
+
+
+def length_prefixed(payload):
+    return struct.pack("!I", len(payload)) + payload
+
+
+def split_every(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+class FrameReaderTest(unittest.TestCase):
+    def read_all(self, frame_reader, frame_count):
+        """
+
+        receive until frame_count frames came, copying them out since they are only valid until the next receive
+
+        :return: list of bytes
+        """
+        frames = []
+        while len(frames) < frame_count:
+            frames.extend(bytes(payload) for payload in frame_reader.read_frames())
+        return frames
+
+    def test_newline_frames_split_everywhere(self):
+        frames = [b'{"a": 1}', b"", b'{"b": "' + b"x" * 100 + b'"}']
+        data = b"".join(frame + b"\n" for frame in frames)
+        for chunk_size in (1, 2, 3, 7, len(data)):
+            frame_reader = FrameReader(ChunkSocket(split_every(data, chunk_size)))
+            self.assertEqual(frames, self.read_all(frame_reader, len(frames)), chunk_size)
+
+    def test_newline_scan_does_not_restart(self):
+        frame_reader = FrameReader(ChunkSocket([b"abc", b"def", b"g\nh"]))
+        self.assertEqual([], list(frame_reader.read_frames()))
+        self.assertEqual(3, frame_reader.scan_position)
+        self.assertEqual([], list(frame_reader.read_frames()))
+        self.assertEqual(6, frame_reader.scan_position)
+        self.assertEqual([b"abcdefg"], [bytes(payload) for payload in frame_reader.read_frames()])
+        # the incomplete tail is kept
+        self.assertEqual(b"h", bytes(frame_reader.buffer[frame_reader.frame_start:frame_reader.data_end]))
+
+    def test_length_prefix_frames_split_everywhere(self):
+        frames = [b"\x00\x01\n", b"", b"binary" * 50]
+        data = b"".join(length_prefixed(frame) for frame in frames)
+        for chunk_size in (1, 2, 3, 5, len(data)):
+            frame_reader = FrameReader(ChunkSocket(split_every(data, chunk_size)), "length_prefix")
+            self.assertEqual(frames, self.read_all(frame_reader, len(frames)), chunk_size)
+
+    def test_length_prefix_frame_bigger_than_buffer(self):
+        big_frame = bytes(range(256)) * 100
+        frame_reader = FrameReader(ChunkSocket(split_every(length_prefixed(big_frame) + length_prefixed(b"next"), 5000)),
+                                   "length_prefix", buffer_size=1024)
+        self.assertEqual([big_frame, b"next"], self.read_all(frame_reader, 2))
+        self.assertGreaterEqual(len(frame_reader.buffer), len(big_frame) + 4)
+
+    def test_newline_frame_bigger_than_buffer(self):
+        big_frame = b"y" * 50000
+        frame_reader = FrameReader(ChunkSocket([big_frame + b"\nz\n"]), buffer_size=1024)
+        self.assertEqual([big_frame, b"z"], self.read_all(frame_reader, 2))
+        self.assertGreater(len(frame_reader.buffer), len(big_frame))
+
+    def test_buffer_grows_when_socket_fills_it(self):
+        frames = [b"m" * 100] * 200
+        frame_reader = FrameReader(ChunkSocket([b"".join(frame + b"\n" for frame in frames)]), buffer_size=8192)
+        received_frames = list(bytes(payload) for payload in frame_reader.read_frames())
+        self.assertEqual(8192, frame_reader.data_end)
+        received_frames += self.read_all(frame_reader, len(frames) - len(received_frames))
+        self.assertEqual(frames, received_frames)
+        self.assertEqual(16384, len(frame_reader.buffer))
+
+    def test_tail_moved_to_front(self):
+        frame_reader = FrameReader(ChunkSocket([b"a" * 8000 + b"\n" + b"tail", b"!\n"]), buffer_size=8192)
+        self.assertEqual([b"a" * 8000], [bytes(payload) for payload in frame_reader.read_frames()])
+        self.assertEqual([b"tail!"], [bytes(payload) for payload in frame_reader.read_frames()])
+        # not enough room left after the first frame, so the tail was moved instead of growing the buffer
+        self.assertEqual(8192, len(frame_reader.buffer))
+
+    def test_frames_handed_out_survive_growth(self):
+        frame_reader = FrameReader(ChunkSocket([b"first\n" + b"p" * 2000, b"p" * 5000 + b"\n"]), buffer_size=4096)
+        first_frames = list(frame_reader.read_frames())
+        self.assertEqual([b"p" * 7000], [bytes(payload) for payload in frame_reader.read_frames()])
+        # the old buffer was replaced, not resized
+        self.assertEqual(b"first", bytes(first_frames[0]))
+
+    def test_switch_framing_between_frames(self):
+        data = b'{"msg_type": "codec_hello_reply"}\n' + length_prefixed(b"\x01\x02binary\n") + length_prefixed(b"again")
+        for chunk_size in (1, 4, len(data)):
+            frame_reader = FrameReader(ChunkSocket(split_every(data, chunk_size)))
+            frames = []
+            while len(frames) < 3:
+                for payload in frame_reader.read_frames():
+                    frames.append(bytes(payload))
+                    # like the receive thread after codec_hello, the rest follows the new framing
+                    if len(frames) == 1:
+                        frame_reader.set_framing("length_prefix")
+            self.assertEqual([b'{"msg_type": "codec_hello_reply"}', b"\x01\x02binary\n", b"again"], frames)
+
+    def test_connection_closed(self):
+        frame_reader = FrameReader(ChunkSocket([b"half"]))
+        self.assertEqual([], list(frame_reader.read_frames()))
+        with self.assertRaises(ConnectionResetError):
+            list(frame_reader.read_frames())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+"""
+
+
+Tests of the replication of user commands without waiting for the heart
+beat, commands within the coalescing window share one append entries and
+followers that just got logs are not sent an empty heartbeat.
+
+
+"""
+
+import time
+
+
+def request_command(raft_peer, request_id):
+    raft_peer.process_request_command({"msg_type": "request_command", "request_command_list": ["x", "add", 1],
+                                       "request_id": request_id, "send_from": ["localhost", 30001]})
+
+
+def test_commands_in_window_share_one_append_entries(raft_peer_factory, followers):
+    raft_peer = raft_peer_factory([], 1, "leader")
+    raft_peer.raft_peer_state.start_replicating(followers[0])
+    request_command(raft_peer, 1)
+    replication_deadline = raft_peer.timeout_counter.replication_deadline
+    assert replication_deadline is not None
+    assert replication_deadline - time.monotonic() <= raft_peer.replication_coalescing_window
+    # the second command does not move the window
+    request_command(raft_peer, 2)
+    assert replication_deadline == raft_peer.timeout_counter.replication_deadline
+    assert [] == raft_peer.json_message_send_queue
+
+    time.sleep(raft_peer.replication_coalescing_window)
+    raft_peer.timeout_counter.fire_if_due(raft_peer)
+    assert [[0, 1]] == [[one_log.log_index for one_log in one_message["new_entries"]]
+                        for one_message in raft_peer.json_message_send_queue]
+    assert raft_peer.timeout_counter.replication_deadline is None
+
+
+def test_follower_does_not_schedule_replication(raft_peer_factory):
+    raft_peer = raft_peer_factory([], 1, "follower")
+    request_command(raft_peer, 1)
+    assert raft_peer.timeout_counter.replication_deadline is None
+    assert ["not_leader"] == [one_message["command_result"] for one_message in raft_peer.json_message_send_queue]
+
+
+def test_heartbeat_skipped_after_recent_logs(raft_peer_factory, followers):
+    raft_peer = raft_peer_factory([1], 1, "leader")
+    raft_peer.raft_peer_state.peers_match_index[followers[0]] = 0
+    raft_peer.raft_peer_state.peers_next_index[followers[0]] = 1
+    raft_peer.peers_last_append_time[followers[0]] = time.monotonic()
+    raft_peer.put_sent_to_all_peer_append_entries_heart_beat()
+    assert [] == raft_peer.json_message_send_queue
+
+    # nothing sent within the heart beat interval, the follower needs to hear from the leader
+    raft_peer.peers_last_append_time[followers[0]] -= raft_peer.append_entries_heart_beat_time_out
+    raft_peer.put_sent_to_all_peer_append_entries_heart_beat()
+    assert [[]] == [one_message["new_entries"] for one_message in raft_peer.json_message_send_queue]
+
+
+def test_new_entries_skip_up_to_date_followers(raft_peer_factory, followers):
+    raft_peer = raft_peer_factory([1], 1, "leader")
+    raft_peer.raft_peer_state.peers_next_index[followers[0]] = 1
+    raft_peer.put_sent_to_all_peer_new_entries()
+    assert [] == raft_peer.json_message_send_queue
+    # unless a read round waits for them
+    raft_peer.read_round_requested = True
+    raft_peer.put_sent_to_all_peer_new_entries()
+    assert [1] == [one_message["read_round"] for one_message in raft_peer.json_message_send_queue]
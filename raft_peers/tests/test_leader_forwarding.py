@@ -0,0 +1,184 @@
+"""
+
+
+Tests of the leader hints and the forwarding of user commands, followers
+learn the leader's user port from its append entries and either tell the
+user where it is or forward the command and relay the leader's reply.
+
+
+"""
+
+import json
+import socket
+import threading
+from queue import Queue
+
+import pytest
+
+from LeaderForwarder import LeaderForwarder
+from StateEvent import StateEvent
+
+
+def append_entries(raft_peer, sender_term, leader_addr_port_tuple):
+    return {"msg_type": "append_entries_leader", "sender_term": sender_term, "peer_id": "peer2",
+            "prev_log_index": -1, "prev_log_term": -1, "leader_commit_index": -1, "read_round": 0,
+            "new_entries": [], "leader_user_addr": [leader_addr_port_tuple[0], leader_addr_port_tuple[1] + 1000],
+            "send_from": list(leader_addr_port_tuple), "send_to": list(raft_peer.my_addr_port_tuple)}
+
+
+def request_command(request_id, send_from=("localhost", 30001), **extra):
+    json_data_dict = {"msg_type": "request_command", "request_command_list": ["x", "add", 1],
+                      "request_id": request_id, "send_from": list(send_from)}
+    json_data_dict.update(extra)
+    return json_data_dict
+
+
+def test_not_leader_reply_has_leader_hint(raft_peer_factory, followers):
+    raft_peer = raft_peer_factory([], 1, "follower")
+    raft_peer.process_one_recv_json_message(append_entries(raft_peer, 1, followers[0]))
+    del raft_peer.json_message_send_queue[:]
+    raft_peer.process_one_recv_json_message(request_command(1))
+    assert [("not_leader", ["localhost", 21002], 1)] == \
+        [(one_reply["command_result"], one_reply["leader_hint"], one_reply["request_id"])
+         for one_reply in raft_peer.json_message_send_queue]
+
+
+def test_leader_hint_forgotten_in_new_term(raft_peer_factory, followers):
+    raft_peer = raft_peer_factory([], 1, "follower")
+    raft_peer.process_one_recv_json_message(append_entries(raft_peer, 1, followers[0]))
+    # a vote of the next term, its leader is not known yet
+    raft_peer.process_one_recv_json_message(
+        {"msg_type": "request_vote", "sender_term": 2, "last_log_index": -1, "last_log_term": -1,
+         "peer_id": "peer3", "send_from": list(followers[1]), "send_to": list(raft_peer.my_addr_port_tuple)})
+    assert raft_peer.leader_hint() is None
+
+
+def test_leader_hint_of_leader_is_itself(raft_peer_factory):
+    raft_peer = raft_peer_factory([], 1, "leader")
+    assert list(raft_peer.raft_peer_state.my_user_addr_port_tuple) == raft_peer.leader_hint()
+
+
+class RecordingForwarder:
+    # stands for the LeaderForwarder, keeps what the follower forwards
+    def __init__(self):
+        self.forwards = []
+
+    def forward(self, json_data_dict, user_addr_port_tuple, leader_addr_port_tuple):
+        self.forwards.append((json_data_dict["request_id"], user_addr_port_tuple, leader_addr_port_tuple))
+
+
+@pytest.fixture
+def forwarding_follower(raft_peer_factory, followers):
+    raft_peer = raft_peer_factory([], 1, "follower")
+    raft_peer.leader_forwarder = RecordingForwarder()
+    raft_peer.process_one_recv_json_message(append_entries(raft_peer, 1, followers[0]))
+    del raft_peer.json_message_send_queue[:]
+    return raft_peer
+
+
+def test_follower_forwards_to_known_leader(forwarding_follower):
+    forwarding_follower.process_one_recv_json_message(request_command(1))
+    assert [] == forwarding_follower.json_message_send_queue
+    assert [(1, ("localhost", 30001), ("localhost", 21002))] == forwarding_follower.leader_forwarder.forwards
+
+
+def test_forwarded_command_never_forwarded_again(forwarding_follower):
+    # the leader it was forwarded to is no longer the leader
+    forwarding_follower.process_one_recv_json_message(request_command(1, forwarded=True))
+    assert [] == forwarding_follower.leader_forwarder.forwards
+    assert ["not_leader"] == [one_reply["command_result"] for one_reply in forwarding_follower.json_message_send_queue]
+
+
+def test_relayed_reply_goes_to_user(forwarding_follower):
+    forwarding_follower.relay_forwarded_reply(("localhost", 30001), {"msg_type": "request_command_reply",
+                                                                     "command_result": "not_leader"})
+    # the state loop fills in where it goes and the leader it knows
+    state_event = forwarding_follower.json_message_recv_queue.get_nowait()
+    assert StateEvent.forwarded_reply == state_event.event_type
+    forwarding_follower.process_recv_json_messages([state_event])
+    reply = forwarding_follower.json_message_send_queue[-1]
+    assert ["localhost", 30001] == reply["send_to"]
+    assert ["localhost", 21002] == reply["leader_hint"]
+
+
+@pytest.fixture
+def leader_forwarder():
+    relayed_replies = Queue()
+    leader_forwarder = LeaderForwarder(lambda user_addr_port_tuple, reply_dict:
+                                       relayed_replies.put((user_addr_port_tuple, reply_dict)),
+                                       {"host": "localhost", "port": "20002", "peer_id": "peer2"})
+    yield leader_forwarder, relayed_replies
+    leader_forwarder.close_leader_socket()
+
+
+@pytest.fixture
+def fake_leader():
+    """
+
+    user port of a leader which reads the given number of forwarded messages and
+    answers them with one reply made from all of them
+
+    """
+    leader_socket = socket.socket()
+    leader_socket.bind(("localhost", 0))
+    leader_socket.listen(1)
+    accepted_sockets = []
+
+    def answer(forward_number, create_reply):
+        def accept_and_answer():
+            accepted_socket, _ = leader_socket.accept()
+            accepted_sockets.append(accepted_socket)
+            reader = accepted_socket.makefile("rb")
+            forwarded_dicts = [json.loads(reader.readline()) for _ in range(forward_number)]
+            accepted_socket.sendall(str.encode(json.dumps(create_reply(forwarded_dicts)) + "\n", "utf-8"))
+        thread_answer = threading.Thread(target=accept_and_answer)
+        thread_answer.daemon = True
+        thread_answer.start()
+        return leader_socket.getsockname()
+
+    yield answer
+    for accepted_socket in accepted_sockets:
+        accepted_socket.close()
+    leader_socket.close()
+
+
+def test_reply_relayed_with_users_request_id(leader_forwarder, fake_leader):
+    leader_forwarder, relayed_replies = leader_forwarder
+    leader_addr_port_tuple = fake_leader(1, lambda forwarded_dicts: {
+        "msg_type": "request_command_reply", "command_result": 1.0,
+        "request_id": forwarded_dicts[0]["request_id"], "forwarded": forwarded_dicts[0]["forwarded"]})
+    leader_forwarder.forward(request_command("user-7"), ("localhost", 30001), leader_addr_port_tuple)
+
+    user_addr_port_tuple, reply_dict = relayed_replies.get(timeout=2)
+    assert ("localhost", 30001) == user_addr_port_tuple
+    assert "user-7" == reply_dict["request_id"]
+    assert reply_dict["forwarded"]
+    assert {} == leader_forwarder.pending_forwards
+
+
+def test_reply_batch_split_by_user(leader_forwarder, fake_leader):
+    leader_forwarder, relayed_replies = leader_forwarder
+    leader_addr_port_tuple = fake_leader(3, lambda forwarded_dicts: {
+        "msg_type": "request_command_reply_batch",
+        "replies": [{"msg_type": "request_command_reply", "command_result": 1.0,
+                     "request_id": one_forwarded_dict["request_id"]} for one_forwarded_dict in forwarded_dicts]})
+    leader_forwarder.forward(request_command(1), ("localhost", 30001), leader_addr_port_tuple)
+    leader_forwarder.forward(request_command(2), ("localhost", 30001), leader_addr_port_tuple)
+    leader_forwarder.forward(request_command(1), ("localhost", 30002), leader_addr_port_tuple)
+
+    relayed = dict(relayed_replies.get(timeout=2) for _ in range(2))
+    assert [1, 2] == [one_reply["request_id"] for one_reply in relayed[("localhost", 30001)]["replies"]]
+    assert 1 == relayed[("localhost", 30002)]["request_id"]
+
+
+def test_unreachable_leader_answers_not_leader(leader_forwarder):
+    leader_forwarder, relayed_replies = leader_forwarder
+    closed_socket = socket.socket()
+    closed_socket.bind(("localhost", 0))
+    leader_addr_port_tuple = closed_socket.getsockname()
+    closed_socket.close()
+    leader_forwarder.forward({"msg_type": "read_command", "read_command_list": ["x"], "send_from": ["localhost", 30001]},
+                             ("localhost", 30001), leader_addr_port_tuple)
+
+    user_addr_port_tuple, reply_dict = relayed_replies.get(timeout=2)
+    assert {"msg_type": "read_command_reply", "command_result": "not_leader"} == reply_dict
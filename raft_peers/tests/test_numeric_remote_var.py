@@ -0,0 +1,125 @@
+"""
+
+
+Tests of NumericRemoteVar, the same commands applied in passes must give
+exactly the results and snapshots of RemoteVar applying them one by one.
+
+
+"""
+
+import random
+import unittest
+
+from NumericRemoteVar import NumericRemoteVar, numpy
+from RemoteVar import RemoteVar
+
+
+@unittest.skipIf(numpy is None, "numpy is not installed")
+class NumericRemoteVarTest(unittest.TestCase):
+    def assert_same_as_remote_var(self, passes):
+        """
+
+        apply every pass of (action_param_lists, log_indexes) to both state machines
+
+        :return: NumericRemoteVar
+        """
+        remote_var, numeric_remote_var = RemoteVar(), NumericRemoteVar()
+        for action_param_lists, log_indexes in passes:
+            expected_results = [remote_var.perform_action(action_param_list, log_index)
+                                for action_param_list, log_index in zip(action_param_lists, log_indexes)]
+            self.assertEqual(expected_results, numeric_remote_var.perform_actions(action_param_lists, log_indexes))
+            self.assertEqual(remote_var.take_snapshot(), numeric_remote_var.take_snapshot())
+            for var_name in ("x", "y", "skill", "missing"):
+                self.assertEqual(remote_var.read_var(var_name), numeric_remote_var.read_var(var_name))
+        return numeric_remote_var
+
+    def create_pass(self, action_param_lists, first_log_index=1):
+        return action_param_lists, list(range(first_log_index, first_log_index + len(action_param_lists)))
+
+    def test_float_order_kept(self):
+        # a different order or a pairwise sum would change the last bits
+        action_param_lists = [["x", "add", 0.1], ["x", "add", 1e16], ["x", "sub", 1e16], ["x", "time", 3.3],
+                              ["y", "add", 1 / 3], ["x", "div", 7], ["y", "time", 1e-300], ["y", "time", 1e-300]]
+        self.assert_same_as_remote_var([self.create_pass(action_param_lists * 20)])
+
+    def test_div_by_zero(self):
+        numeric_remote_var = self.assert_same_as_remote_var([self.create_pass(
+            [["x", "add", 5], ["x", "div", 0], ["x", "div", "0.0"], ["y", "div", 0], ["x", "add", 1]])])
+        self.assertEqual(6.0, numeric_remote_var.read_var("x"))
+        # a div by zero on a new variable still adds it, like RemoteVar
+        self.assertEqual(0.0, numeric_remote_var.read_var("y"))
+
+    def test_div_by_zero_outside_pass(self):
+        remote_var, numeric_remote_var = RemoteVar(), NumericRemoteVar()
+        for action_param_list in (["x", "add", 2], ["x", "div", 0], ["x", "div", 4]):
+            self.assertEqual(remote_var.perform_action(action_param_list), numeric_remote_var.perform_action(action_param_list))
+        self.assertEqual(0.5, numeric_remote_var.read_var("x"))
+
+    def test_bad_commands(self):
+        self.assert_same_as_remote_var([self.create_pass(
+            [["x", "add", "abc"], ["x", "add", None], ["x", "fly", 1], ["x"], ["x", "add", "2.5"],
+             ["skill", "learn_skill", "sword"], ["skill", "add", 1], ["skill", "time", 2], ["y", "learn_skill", 3],
+             ["y", "add", 1], ["y", "learn_skill", 1], ["x", "noop", None], ["x", "add", float("inf")]])])
+
+    def test_failed_command_keeps_learnt_skill(self):
+        action_param_lists = [["y", "learn_skill", True], ["y", "add", "abc"], ["z", "learn_skill", 3],
+                              ["z", "div", 0], ["z", "time", None], ["w", "sub", "abc"]]
+        numeric_remote_var = self.assert_same_as_remote_var([self.create_pass(action_param_lists)])
+        self.assertIs(True, numeric_remote_var.read_var("y"))
+        self.assertEqual(3, numeric_remote_var.read_var("z"))
+        # a missing variable is still added before its param fails
+        self.assertEqual(0.0, numeric_remote_var.read_var("w"))
+        # and the same one command at a time
+        remote_var, numeric_remote_var = RemoteVar(), NumericRemoteVar()
+        for action_param_list in action_param_lists:
+            self.assertEqual(remote_var.perform_action(action_param_list), numeric_remote_var.perform_action(action_param_list))
+        self.assertEqual(remote_var.take_snapshot(), numeric_remote_var.take_snapshot())
+
+    def test_client_sessions(self):
+        first_pass = self.create_pass(
+            [["x", "add", 1, ["c1", 1, 0]], ["x", "add", 2, ["c1", 2, 0]], ["x", "div", 0, ["c1", 3, 0]],
+             # retried in the same pass, answered from the session
+             ["x", "add", 1, ["c1", 1, 0]], ["y", "add", 1, ["c2", 1, 0]], ["x", "time", 10, ["c1", 4, 2]]])
+        second_pass = self.create_pass(
+            [["x", "add", 2, ["c1", 2, 0]], ["x", "add", 1, ["c1", 1, 4]], ["y", "add", 1, ["c3", 5, 2]],
+             ["x", "add", 1, ["c1", 5, 4]]], first_pass[1][-1] + 1)
+        self.assert_same_as_remote_var([first_pass, second_pass])
+
+    def test_session_expiry_log(self):
+        # the log checking for expired sessions goes through perform_action
+        check_logs = RemoteVar.session_expiry_check_logs
+        self.assert_same_as_remote_var([self.create_pass(
+            [["x", "add", 1, ["c1", 1, 0]], ["x", "add", 1], ["x", "add", 1, ["c1", 2, 1]]], check_logs - 1)])
+
+    def test_restore_snapshot(self):
+        remote_var = RemoteVar()
+        remote_var.perform_actions([["x", "add", 1.5], ["skill", "learn_skill", True], ["y", "sub", 2]], [1, 2, 3])
+        numeric_remote_var = NumericRemoteVar()
+        numeric_remote_var.restore_snapshot(remote_var.take_snapshot())
+        self.assertEqual(remote_var.take_snapshot(), numeric_remote_var.take_snapshot())
+        action_param_lists = [["x", "time", 3], ["y", "add", 1], ["skill", "add", 1]]
+        self.assertEqual(remote_var.perform_actions(action_param_lists, [4, 5, 6]),
+                         numeric_remote_var.perform_actions(action_param_lists, [4, 5, 6]))
+
+    def test_random_passes(self):
+        for seed in range(20):
+            random_generator = random.Random(seed)
+            passes = []
+            log_index = 1
+            for pass_number in range(10):
+                action_param_lists = []
+                for i in range(random_generator.randint(1, 80)):
+                    action_param_list = [random_generator.choice(["x", "y", "skill", "z" + str(i % 5)]),
+                                         random_generator.choice(["add", "sub", "time", "div", "learn_skill", "fly"]),
+                                         random_generator.choice([0, 0.0, 1.5, -2, 3, "x", None, "7", 0.1])]
+                    if random_generator.random() < 0.3:
+                        action_param_list.append(["c" + str(random_generator.randint(0, 2)),
+                                                  random_generator.randint(1, 30), random_generator.randint(0, 3)])
+                    action_param_lists.append(action_param_list)
+                passes.append(self.create_pass(action_param_lists, log_index))
+                log_index += len(action_param_lists)
+            self.assert_same_as_remote_var(passes)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+"""
+
+
+Tests of OutboundQueue, only superseded heartbeats and heartbeat replies
+are dropped when it is full, everything else is kept in order.
+
+
+"""
+
+import threading
+import unittest
+
+from OutboundQueue import OutboundQueue
+
+
+def heartbeat(term, leader_commit_index=0):
+    return {"msg_type": "append_entries_leader", "sender_term": term, "leader_commit_index": leader_commit_index,
+            "new_entries": []}
+
+
+def append_entries(term, log_index):
+    return {"msg_type": "append_entries_leader", "sender_term": term, "leader_commit_index": 0,
+            "new_entries": [{"log_index": log_index, "log_term": term, "request_command_action_list": ["x", "add", 1]}]}
+
+
+def reply(term, result=True, log_index_end=-1, read_round=0):
+    return {"msg_type": "append_entries_follower_reply", "sender_term": term, "append_entries_result": result,
+            "log_index_end": log_index_end, "read_round": read_round}
+
+
+def vote(term):
+    return {"msg_type": "request_vote", "sender_term": term}
+
+
+def drain(outbound_queue):
+    messages = []
+    while outbound_queue.qsize() > 0:
+        messages.append(outbound_queue.get_nowait())
+    return messages
+
+
+class OutboundQueueTest(unittest.TestCase):
+    def test_nothing_dropped_below_max_size(self):
+        outbound_queue = OutboundQueue(4)
+        messages = [heartbeat(1), heartbeat(1), reply(1), vote(2)]
+        for one_message in messages:
+            self.assertEqual(0, outbound_queue.put(one_message))
+        self.assertEqual(messages, drain(outbound_queue))
+
+    def test_full_queue_drops_queued_heartbeats(self):
+        outbound_queue = OutboundQueue(3)
+        outbound_queue.put(heartbeat(1, 0))
+        outbound_queue.put(append_entries(1, 0))
+        outbound_queue.put(heartbeat(1, 0))
+        # the newest heartbeat carries the same information
+        self.assertEqual(2, outbound_queue.put(heartbeat(1, 1)))
+        self.assertEqual([append_entries(1, 0), heartbeat(1, 1)], drain(outbound_queue))
+        self.assertEqual(2, outbound_queue.dropped_count)
+
+    def test_new_heartbeat_dropped_when_nothing_else_could_go(self):
+        outbound_queue = OutboundQueue(2)
+        outbound_queue.put(append_entries(1, 0))
+        outbound_queue.put(append_entries(1, 1))
+        self.assertEqual(1, outbound_queue.put(heartbeat(1)))
+        self.assertEqual([append_entries(1, 0), append_entries(1, 1)], drain(outbound_queue))
+
+    def test_other_messages_grow_the_queue(self):
+        outbound_queue = OutboundQueue(2)
+        messages = [append_entries(1, 0), vote(2), reply(1, False), reply(1, True, 5),
+                    {"msg_type": "install_snapshot", "sender_term": 1},
+                    {"msg_type": "request_command_reply", "request_command_action_list": ["x"]}]
+        for one_message in messages:
+            self.assertEqual(0, outbound_queue.put(one_message))
+        # never dropped, the queue goes past max_size instead of blocking the state loop
+        self.assertEqual(len(messages), outbound_queue.qsize())
+        self.assertEqual(messages, drain(outbound_queue))
+
+    def test_heartbeat_replies_of_same_term_superseded(self):
+        outbound_queue = OutboundQueue(3)
+        outbound_queue.put(reply(1, read_round=1))
+        outbound_queue.put(reply(2, read_round=2))
+        outbound_queue.put(reply(2, read_round=3))
+        self.assertEqual(2, outbound_queue.put(reply(2, read_round=4)))
+        # a reply of an older term is not superseded by this one
+        self.assertEqual([reply(1, read_round=1), reply(2, read_round=4)], drain(outbound_queue))
+
+    def test_heartbeat_reply_does_not_drop_rejections_or_log_replies(self):
+        outbound_queue = OutboundQueue(2)
+        outbound_queue.put(reply(2, False))
+        outbound_queue.put(reply(2, True, 7))
+        self.assertEqual(0, outbound_queue.put(reply(2)))
+        self.assertEqual([reply(2, False), reply(2, True, 7), reply(2)], drain(outbound_queue))
+
+    def test_wakeup_and_blocking_get(self):
+        wakeups = []
+        outbound_queue = OutboundQueue(2, lambda: wakeups.append(True))
+        self.assertIsNone(outbound_queue.get(timeout=0.01))
+        got_messages = []
+        getter_thread = threading.Thread(target=lambda: got_messages.append(outbound_queue.get(timeout=5)))
+        getter_thread.start()
+        outbound_queue.put(vote(1))
+        getter_thread.join()
+        self.assertEqual([vote(1)], got_messages)
+        self.assertEqual(1, len(wakeups))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+"""
+
+
+Tests of the pipelined append entries, a follower in replicate mode gets
+batches until its in flight window is full, a follower in probe mode gets
+one batch at a time, and a rejected or lost batch falls back to probe mode.
+
+
+"""
+
+import pytest
+
+
+def sent_entries(raft_peer):
+    return [[one_log.log_index for one_log in one_message["new_entries"]]
+            for one_message in raft_peer.json_message_send_queue]
+
+
+def accepted_reply(raft_peer, follower_addr_port_tuple, log_index_start, log_index_end):
+    return {"msg_type": "append_entries_follower_reply", "sender_term": raft_peer.raft_peer_state.current_term,
+            "log_index_start": log_index_start, "log_index_end": log_index_end, "prev_log_index": log_index_start - 1,
+            "read_round": 0, "append_entries_result": True, "send_from": list(follower_addr_port_tuple),
+            "send_to": list(raft_peer.my_addr_port_tuple)}
+
+
+@pytest.fixture
+def pipelining_leader(raft_peer_factory, followers):
+    # batches of 10 logs, at most 3 of them in flight, the follower has the first 10 logs
+    raft_peer = raft_peer_factory([1] * 100, 1, "leader")
+    raft_peer.max_entries_per_append = 10
+    raft_peer.max_in_flight_appends = 3
+    raft_peer.raft_peer_state.peers_match_index[followers[0]] = 9
+    raft_peer.raft_peer_state.peers_next_index[followers[0]] = 10
+    return raft_peer
+
+
+def test_probe_mode_sends_one_batch(pipelining_leader, followers):
+    pipelining_leader.put_pipelined_append_entries(followers[0])
+    pipelining_leader.put_pipelined_append_entries(followers[0])
+    # the next index only moves with the reply
+    assert [list(range(10, 20))] * 2 == sent_entries(pipelining_leader)
+
+
+def test_replicate_mode_fills_window(pipelining_leader, followers):
+    pipelining_leader.raft_peer_state.start_replicating(followers[0])
+    pipelining_leader.put_pipelined_append_entries(followers[0])
+    assert [list(range(10, 20)), list(range(20, 30)), list(range(30, 40))] == sent_entries(pipelining_leader)
+    assert 40 == pipelining_leader.raft_peer_state.peers_next_index[followers[0]]
+
+    # every acknowledged batch makes room for the next one
+    del pipelining_leader.json_message_send_queue[:]
+    pipelining_leader.process_append_entries_follower_reply(accepted_reply(pipelining_leader, followers[0], 10, 19))
+    assert [list(range(40, 50))] == sent_entries(pipelining_leader)
+    assert 19 == pipelining_leader.raft_peer_state.peers_match_index[followers[0]]
+
+
+def test_window_bounded_by_bytes(pipelining_leader, followers):
+    log_size = pipelining_leader.raft_peer_state.state_log[0].estimate_encoded_size()
+    pipelining_leader.max_in_flight_bytes = 15 * log_size
+    pipelining_leader.raft_peer_state.start_replicating(followers[0])
+    pipelining_leader.put_pipelined_append_entries(followers[0])
+    assert [list(range(10, 20)), list(range(20, 30))] == sent_entries(pipelining_leader)
+
+
+def test_accepted_probe_starts_pipelining(pipelining_leader, followers):
+    pipelining_leader.put_pipelined_append_entries(followers[0])
+    pipelining_leader.process_append_entries_follower_reply(accepted_reply(pipelining_leader, followers[0], 10, 19))
+    assert pipelining_leader.raft_peer_state.peers_replicating[followers[0]]
+    assert [list(range(10, 20)), list(range(20, 30)), list(range(30, 40)), list(range(40, 50))] == \
+        sent_entries(pipelining_leader)
+
+
+def test_rejected_batch_falls_back_to_probe(pipelining_leader, followers):
+    pipelining_leader.raft_peer_state.start_replicating(followers[0])
+    pipelining_leader.put_pipelined_append_entries(followers[0])
+    del pipelining_leader.json_message_send_queue[:]
+    pipelining_leader.process_append_entries_follower_reply(
+        {"msg_type": "append_entries_follower_reply", "sender_term": 1, "log_index_start": -1,
+         "log_index_end": -1, "prev_log_index": 9, "conflict_term": -1, "conflict_index": 10, "read_round": 0,
+         "append_entries_result": False, "send_from": list(followers[0]),
+         "send_to": list(pipelining_leader.my_addr_port_tuple)})
+
+    assert not pipelining_leader.raft_peer_state.peers_replicating[followers[0]]
+    assert 10 == pipelining_leader.raft_peer_state.peers_next_index[followers[0]]
+    # probes again from the end of the follower's log, one batch only
+    assert [list(range(10, 20))] == sent_entries(pipelining_leader)
+
+
+def test_lost_batch_probed_again_by_heart_beat(pipelining_leader, followers):
+    pipelining_leader.raft_peer_state.start_replicating(followers[0])
+    pipelining_leader.put_pipelined_append_entries(followers[0])
+    del pipelining_leader.json_message_send_queue[:]
+    for one_batch in pipelining_leader.raft_peer_state.peers_in_flight[followers[0]]:
+        one_batch[2] -= 2 * pipelining_leader.append_entries_heart_beat_time_out
+    pipelining_leader.put_sent_to_all_peer_append_entries_heart_beat()
+
+    assert not pipelining_leader.raft_peer_state.peers_replicating[followers[0]]
+    assert [list(range(10, 20))] == sent_entries(pipelining_leader)
+
+
+def test_pipelined_follower_gets_every_log(pipelining_leader, peer_state_factory, replicate, followers):
+    follower_state = peer_state_factory([1] * 10, 1, followers[0], "peer2")
+    pipelining_leader.put_pipelined_append_entries(followers[0])
+    _, rejected_replies = replicate(pipelining_leader, follower_state)
+    assert [] == rejected_replies
+    assert 100 == follower_state.log_length()
+    assert 99 == pipelining_leader.raft_peer_state.peers_match_index[followers[0]]
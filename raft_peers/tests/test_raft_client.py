@@ -0,0 +1,207 @@
+"""
+
+
+Tests of RaftClient and AsyncRaftClient against fake peers on localhost,
+commands are sent without waiting for the earlier ones, replies are matched
+by request_id in any order, and commands not answered are sent again in the
+same client session to the hinted leader or the next peer.
+
+
+"""
+
+import asyncio
+import json
+import socket
+import threading
+
+import pytest
+
+from AsyncRaftClient import AsyncRaftClient
+from RaftClient import RaftClient
+
+
+class FakePeer:
+    # user port of a peer, every message gets the replies handle_message returns, None closes the connection
+    def __init__(self, handle_message):
+        self.handle_message = handle_message
+        self.received_messages = []
+        self.accepted_sockets = []
+        self.listen_socket = socket.socket()
+        self.listen_socket.bind(("localhost", 0))
+        self.listen_socket.listen(8)
+        self.addr_port_tuple = self.listen_socket.getsockname()
+        thread_accept = threading.Thread(target=self.accept)
+        thread_accept.daemon = True
+        thread_accept.start()
+
+    def accept(self):
+        while True:
+            try:
+                accepted_socket, _ = self.listen_socket.accept()
+            except OSError:
+                return
+            self.accepted_sockets.append(accepted_socket)
+            thread_serve = threading.Thread(target=self.serve, args=(accepted_socket,))
+            thread_serve.daemon = True
+            thread_serve.start()
+
+    def serve(self, accepted_socket):
+        try:
+            for one_line in accepted_socket.makefile("rb"):
+                one_message = json.loads(one_line)
+                self.received_messages.append(one_message)
+                replies = self.handle_message(one_message)
+                if replies is None:
+                    accepted_socket.shutdown(socket.SHUT_RDWR)
+                    return
+                if len(replies) > 0:
+                    accepted_socket.sendall(str.encode("".join(json.dumps(one_reply) + "\n"
+                                                               for one_reply in replies), "utf-8"))
+        except OSError:
+            pass
+
+    def close(self):
+        self.listen_socket.close()
+        for accepted_socket in self.accepted_sockets:
+            accepted_socket.close()
+
+
+def reply(one_message, command_result):
+    return {"msg_type": one_message["msg_type"] + "_reply", "command_result": command_result,
+            "request_id": one_message["request_id"]}
+
+
+def answer_leader(one_message):
+    # the leader answers every command with its request_id times ten
+    return [reply(one_message, one_message["request_id"] * 10)]
+
+
+@pytest.fixture
+def fake_peer_factory():
+    fake_peers = []
+
+    def create_fake_peer(handle_message):
+        fake_peers.append(FakePeer(handle_message))
+        return fake_peers[-1]
+
+    yield create_fake_peer
+    for fake_peer in fake_peers:
+        fake_peer.close()
+
+
+@pytest.fixture
+def raft_client_factory():
+    raft_clients = []
+
+    def create_raft_client(fake_peers):
+        raft_clients.append(RaftClient([fake_peer.addr_port_tuple for fake_peer in fake_peers]))
+        return raft_clients[-1]
+
+    yield create_raft_client
+    for raft_client in raft_clients:
+        raft_client.close()
+
+
+@pytest.fixture
+def hinting_follower(fake_peer_factory):
+    # knows the leader and tells the client where it is
+    def create_hinting_follower(leader):
+        return fake_peer_factory(lambda one_message: [dict(reply(one_message, "not_leader"),
+                                                           leader_hint=list(leader.addr_port_tuple))])
+    return create_hinting_follower
+
+
+def session_of(one_message):
+    return one_message["client_id"], one_message["client_seq"]
+
+
+def test_replies_matched_in_any_order(fake_peer_factory, raft_client_factory):
+    waiting_messages = []
+
+    def answer_three_in_reverse(one_message):
+        waiting_messages.append(one_message)
+        if len(waiting_messages) < 3:
+            return []
+        # the three commands were on the wire together, answered in one batch
+        return [{"msg_type": "request_command_reply_batch",
+                 "replies": [reply(one_waiting_message, one_waiting_message["request_id"] * 10)
+                             for one_waiting_message in reversed(waiting_messages)]}]
+
+    raft_client = raft_client_factory([fake_peer_factory(answer_three_in_reverse)])
+    futures = [raft_client.request_command(["x", "add", 1]) for _ in range(3)]
+    assert [10, 20, 30] == [future.result(timeout=2) for future in futures]
+
+
+def test_not_leader_follows_hint(fake_peer_factory, hinting_follower, raft_client_factory):
+    leader = fake_peer_factory(answer_leader)
+    follower = hinting_follower(leader)
+    raft_client = raft_client_factory([follower, leader])
+    assert 10 == raft_client.request_command(["x", "add", 1]).result(timeout=2)
+    assert 20 == raft_client.read_command("x").result(timeout=2)
+    # the command sent again is the same command of the session
+    assert session_of(follower.received_messages[0]) == session_of(leader.received_messages[0])
+    assert ["x"] == leader.received_messages[1]["read_command_list"]
+
+
+def test_lost_connection_resends_to_next_peer(fake_peer_factory, raft_client_factory):
+    crashing_leader = fake_peer_factory(lambda one_message: None)
+    new_leader = fake_peer_factory(answer_leader)
+    raft_client = raft_client_factory([crashing_leader, new_leader])
+    assert 10 == raft_client.request_command(["x", "add", 1]).result(timeout=2)
+    assert session_of(crashing_leader.received_messages[0]) == session_of(new_leader.received_messages[0])
+
+
+def test_close_fails_pending_commands(fake_peer_factory, raft_client_factory):
+    raft_client = raft_client_factory([fake_peer_factory(lambda one_message: [])])
+    future = raft_client.request_command(["x", "add", 1])
+    raft_client.close()
+    with pytest.raises(ConnectionError):
+        future.result(timeout=2)
+    with pytest.raises(ConnectionError):
+        raft_client.request_command(["x", "add", 1])
+
+
+def test_async_client_follows_hint(fake_peer_factory, hinting_follower):
+    leader = fake_peer_factory(answer_leader)
+    follower = hinting_follower(leader)
+
+    async def request_commands():
+        raft_client = AsyncRaftClient([follower.addr_port_tuple, leader.addr_port_tuple])
+        try:
+            return await asyncio.wait_for(asyncio.gather(
+                *[raft_client.request_command(["x", "add", 1]) for _ in range(3)]), 2)
+        finally:
+            raft_client.close()
+
+    assert [10, 20, 30] == asyncio.run(request_commands())
+    assert sorted(session_of(one_message) for one_message in leader.received_messages) == \
+        sorted(session_of(one_message) for one_message in follower.received_messages)
+
+
+def test_async_client_close_fails_pending_commands(fake_peer_factory):
+    silent_leader = fake_peer_factory(lambda one_message: [])
+
+    async def close_while_pending():
+        raft_client = AsyncRaftClient([silent_leader.addr_port_tuple])
+        future = raft_client.request_command(["x", "add", 1])
+        await asyncio.sleep(0.1)
+        raft_client.close()
+        with pytest.raises(ConnectionError):
+            await future
+
+    asyncio.run(close_while_pending())
+
+
+def test_async_client_lost_connection_resends_to_next_peer(fake_peer_factory):
+    crashing_leader = fake_peer_factory(lambda one_message: None)
+    new_leader = fake_peer_factory(answer_leader)
+
+    async def request_command():
+        raft_client = AsyncRaftClient([crashing_leader.addr_port_tuple, new_leader.addr_port_tuple])
+        try:
+            return await asyncio.wait_for(raft_client.request_command(["x", "add", 1]), 2)
+        finally:
+            raft_client.close()
+
+    assert 10 == asyncio.run(request_command())
+    assert session_of(crashing_leader.received_messages[0]) == session_of(new_leader.received_messages[0])
@@ -0,0 +1,115 @@
+"""
+
+
+Tests of the reads answered without a log, the leader waits until the
+majority echoes a read round started after the read arrived and its read
+index is applied, or answers alone while its lease is valid.
+
+
+"""
+
+import time
+
+import pytest
+
+
+def read_command(raft_peer, request_id):
+    raft_peer.process_one_recv_json_message({"msg_type": "read_command", "read_command_list": ["x"],
+                                             "request_id": request_id, "send_from": ["localhost", 30001]})
+
+
+def heartbeat_reply(raft_peer, follower_addr_port_tuple, read_round):
+    return {"msg_type": "append_entries_follower_reply", "sender_term": raft_peer.raft_peer_state.current_term,
+            "log_index_start": -1, "log_index_end": -1, "prev_log_index": raft_peer.raft_peer_state.log_length() - 1,
+            "read_round": read_round, "append_entries_result": True, "send_from": list(follower_addr_port_tuple),
+            "send_to": list(raft_peer.my_addr_port_tuple)}
+
+
+def sent_messages(raft_peer, msg_type):
+    return [one_message for one_message in raft_peer.json_message_send_queue if one_message["msg_type"] == msg_type]
+
+
+@pytest.fixture
+def read_leader(raft_peer_factory):
+    # leader of three peers, x = 1 is committed and applied in its own term
+    raft_peer = raft_peer_factory([1], 1, "leader", max_peer_number=3)
+    raft_peer.raft_peer_state.commit_index = 0
+    raft_peer.raft_peer_state.last_apply = 0
+    raft_peer.raft_peer_state.remote_var.perform_action(["x", "add", 1], 0)
+    return raft_peer
+
+
+def test_read_answered_after_majority_echoes_round(read_leader, followers):
+    read_command(read_leader, 1)
+    read_command(read_leader, 2)
+    assert [] == sent_messages(read_leader, "read_command_reply")
+    # both reads share the round sent once the coalescing window is over
+    read_leader.put_sent_to_all_peer_new_entries()
+    assert [1, 1] == [one_message["read_round"] for one_message in sent_messages(read_leader, "append_entries_leader")]
+
+    read_leader.process_append_entries_follower_reply(heartbeat_reply(read_leader, followers[0], 0))
+    assert [] == sent_messages(read_leader, "read_command_reply")
+    # one follower and the leader are the majority of three
+    read_leader.process_append_entries_follower_reply(heartbeat_reply(read_leader, followers[0], 1))
+    # the user gets both replies in one frame
+    replies = sent_messages(read_leader, "request_command_reply_batch")[0]["replies"]
+    assert [("read_command_reply", 1.0, 1), ("read_command_reply", 1.0, 2)] == \
+        [(one_reply["msg_type"], one_reply["command_result"], one_reply["request_id"]) for one_reply in replies]
+
+
+def test_new_leader_commits_noop_before_read(raft_peer_factory, followers):
+    raft_peer = raft_peer_factory([1], 2, "leader", max_peer_number=3)
+    raft_peer.raft_peer_state.commit_index = 0
+    raft_peer.raft_peer_state.last_apply = 0
+    raft_peer.raft_peer_state.remote_var.perform_action(["x", "add", 1], 0)
+    read_command(raft_peer, 1)
+    assert ["", "noop", 0] == raft_peer.raft_peer_state.state_log[-1].request_command_action_list
+    raft_peer.put_sent_to_all_peer_new_entries()
+    raft_peer.process_append_entries_follower_reply(heartbeat_reply(raft_peer, followers[0], 1))
+    # the round is confirmed but the noop log is not applied yet
+    assert [] == sent_messages(raft_peer, "read_command_reply")
+
+    raft_peer.process_logs_applied({"applied_index": 1, "applied_logs": [], "snapshot": None})
+    assert [1.0] == [one_message["command_result"] for one_message in sent_messages(raft_peer, "read_command_reply")]
+
+
+def test_pending_reads_told_to_find_new_leader(read_leader, followers):
+    read_command(read_leader, 1)
+    read_leader.process_one_recv_json_message(dict(heartbeat_reply(read_leader, followers[0], 0), sender_term=2))
+    assert ["not_leader"] == [one_message["command_result"]
+                              for one_message in sent_messages(read_leader, "read_command_reply")]
+    assert [] == read_leader.pending_reads
+
+
+def test_lease_answers_reads_alone(read_leader, followers):
+    read_leader.set_read_lease(0.5)
+    # every heart beat starts a round
+    read_leader.put_sent_to_all_peer_append_entries_heart_beat()
+    read_leader.process_append_entries_follower_reply(heartbeat_reply(read_leader, followers[0], 1))
+    del read_leader.json_message_send_queue[:]
+
+    read_command(read_leader, 1)
+    assert [1.0] == [one_message["command_result"] for one_message in sent_messages(read_leader, "read_command_reply")]
+    assert not read_leader.read_round_requested
+
+    # the lease ran out, the next read needs a round again
+    read_leader.raft_peer_state.read_round_start_time[1] -= 0.5
+    read_command(read_leader, 2)
+    assert 1 == len(sent_messages(read_leader, "read_command_reply"))
+    assert read_leader.read_round_requested
+
+
+def test_follower_ignores_votes_within_lease(raft_peer_factory, followers):
+    raft_peer = raft_peer_factory([1], 1, "follower", max_peer_number=3)
+    raft_peer.set_read_lease(0.5)
+    raft_peer.last_leader_contact_time = time.monotonic()
+    request_vote = {"msg_type": "request_vote", "sender_term": 2, "last_log_index": 0, "last_log_term": 1,
+                    "peer_id": "peer2", "send_from": list(followers[0]), "send_to": list(raft_peer.my_addr_port_tuple)}
+    raft_peer.process_one_recv_json_message(request_vote)
+    # the leader could still be answering reads alone
+    assert 1 == raft_peer.raft_peer_state.current_term
+    assert [] == raft_peer.json_message_send_queue
+
+    raft_peer.last_leader_contact_time -= raft_peer.min_leader_election_timeout
+    raft_peer.process_one_recv_json_message(request_vote)
+    assert 2 == raft_peer.raft_peer_state.current_term
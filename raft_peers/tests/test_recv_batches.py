@@ -0,0 +1,96 @@
+"""
+
+
+Tests of the receive loop, the messages already queued are taken together
+up to max_recv_batch, and within a batch only the last heartbeat and the
+last successful heartbeat reply of a sender and term are handled.
+
+
+"""
+
+import threading
+import time
+
+import pytest
+
+from StateEvent import StateEvent
+
+
+def heartbeat(send_from, sender_term, leader_commit_index):
+    return {"msg_type": "append_entries_leader", "send_from": list(send_from), "sender_term": sender_term,
+            "new_entries": [], "leader_commit_index": leader_commit_index}
+
+
+def heartbeat_reply(send_from, sender_term, append_entries_result=True, log_index_end=-1):
+    return {"msg_type": "append_entries_follower_reply", "send_from": list(send_from), "sender_term": sender_term,
+            "append_entries_result": append_entries_result, "log_index_end": log_index_end}
+
+
+@pytest.fixture
+def raft_peer(raft_peer_factory):
+    return raft_peer_factory([], 1, "leader")
+
+
+def test_last_heartbeat_of_sender_and_term_kept(raft_peer, followers):
+    recv_json_messages = [heartbeat(followers[0], 1, 0), heartbeat(followers[1], 1, 0),
+                          heartbeat(followers[0], 2, 1), heartbeat(followers[0], 1, 2)]
+    # the one of the other sender and the one of the other term stay where they were
+    assert [recv_json_messages[1], recv_json_messages[2], recv_json_messages[3]] == \
+        raft_peer.coalesce_recv_json_messages(recv_json_messages)
+
+
+def test_only_successful_heartbeat_replies_coalesced(raft_peer, followers):
+    recv_json_messages = [heartbeat_reply(followers[0], 1), heartbeat_reply(followers[0], 1, False),
+                          heartbeat_reply(followers[0], 1, log_index_end=3), heartbeat_reply(followers[0], 1)]
+    assert recv_json_messages[1:] == raft_peer.coalesce_recv_json_messages(recv_json_messages)
+
+
+def test_messages_with_entries_never_dropped(raft_peer, followers):
+    append_entries = dict(heartbeat(followers[0], 1, 0), new_entries=[{"log_index": 0}])
+    state_event = StateEvent("timer_fired")
+    recv_json_messages = [append_entries, dict(append_entries), state_event, state_event]
+    assert recv_json_messages == raft_peer.coalesce_recv_json_messages(recv_json_messages)
+
+
+def test_queued_messages_taken_together(raft_peer):
+    handled_batches = []
+    all_handled = threading.Event()
+
+    def record_batch(recv_json_messages):
+        handled_batches.append(recv_json_messages)
+        if sum(len(one_batch) for one_batch in handled_batches) == 5:
+            all_handled.set()
+
+    raft_peer.max_recv_batch = 3
+    raft_peer.process_recv_json_messages = record_batch
+    for request_id in range(5):
+        raft_peer.json_message_recv_queue.put(request_id)
+    thread_recv = threading.Thread(target=raft_peer.process_json_message_recv_queue)
+    thread_recv.daemon = True
+    thread_recv.start()
+    assert all_handled.wait(2)
+    assert [[0, 1, 2], [3, 4]] == handled_batches
+
+
+def test_failed_message_does_not_stop_batch(raft_peer):
+    request_command = {"msg_type": "request_command", "request_command_list": ["x", "add", 1],
+                       "send_from": ["localhost", 30001]}
+    # no request_command_list, its handler fails
+    raft_peer.process_recv_json_messages([{"msg_type": "request_command", "send_from": ["localhost", 30001]},
+                                          request_command])
+    assert 1 == raft_peer.raft_peer_state.log_length()
+
+
+def test_follower_answers_last_heartbeat_only(raft_peer_factory, followers):
+    leader = raft_peer_factory([1, 1], 1, "leader")
+    follower = raft_peer_factory([1, 1], 1, "follower")
+    for leader_commit_index in (0, 1):
+        leader.raft_peer_state.commit_index = leader_commit_index
+        leader.peers_last_append_time[followers[0]] = time.monotonic() - leader.append_entries_heart_beat_time_out
+        leader.put_sent_to_all_peer_append_entries_heart_beat()
+    heartbeats = list(leader.json_message_send_queue)
+    assert 2 == len(heartbeats)
+
+    follower.process_recv_json_messages(heartbeats)
+    assert 1 == len(follower.json_message_send_queue)
+    assert 1 == follower.raft_peer_state.commit_index
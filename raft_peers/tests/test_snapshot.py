@@ -0,0 +1,227 @@
+"""
+
+
+Tests of log compaction, the snapshot of RemoteVar is taken, sent in chunks,
+installed and written to the write-ahead log, a restarted peer starts from it.
+
+
+"""
+
+import os
+from unittest import mock
+
+import pytest
+
+from InstallSnapshotFollower import InstallSnapshotFollower
+from LogData import LogData
+from RaftPeerState import RaftPeerState
+from Snapshot import Snapshot
+from WriteAheadLog import WriteAheadLog
+
+
+def test_chunks_rebuild_snapshot():
+    snapshot = Snapshot(9, 2, {"vars": {"x": 10.0, "y": True}, "sessions": {}})
+    received_snapshot = Snapshot(9, 2)
+    offset = 0
+    done = False
+    while not done:
+        chunk, done = snapshot.get_chunk(offset, 7)
+        assert received_snapshot.add_chunk(offset, chunk)
+        offset += len(chunk)
+    # a resent chunk is ignored
+    assert not received_snapshot.add_chunk(0, snapshot.get_chunk(0, 7)[0])
+    received_snapshot.finish_receiving()
+    assert snapshot.snapshot_vars == received_snapshot.snapshot_vars
+
+
+def test_compact_log(peer_state_factory):
+    raft_peer_state = peer_state_factory([1, 1, 2, 2, 3])
+    for one_log in raft_peer_state.state_log[:4]:
+        raft_peer_state.remote_var.perform_action(one_log.request_command_action_list, one_log.log_index)
+    raft_peer_state.take_snapshot(3)
+
+    assert 3 == raft_peer_state.snapshot_last_index
+    assert 2 == raft_peer_state.snapshot_last_term
+    assert 5 == raft_peer_state.log_length()
+    assert [4] == [one_log.log_index for one_log in raft_peer_state.state_log]
+    assert 2 == raft_peer_state.get_log_term(3)
+    assert 3 == raft_peer_state.get_log_term(4)
+    assert {"x": 4.0} == raft_peer_state.snapshot.snapshot_vars["vars"]
+
+
+def test_install_snapshot_keeps_matching_logs(peer_state_factory):
+    raft_peer_state = peer_state_factory([1, 1, 2, 2, 3])
+    raft_peer_state.install_snapshot(Snapshot(2, 2, {"vars": {}, "sessions": {}}))
+    assert [3, 4] == [one_log.log_index for one_log in raft_peer_state.state_log]
+    assert 2 == raft_peer_state.commit_index
+
+
+def test_install_snapshot_drops_conflicting_logs(peer_state_factory):
+    raft_peer_state = peer_state_factory([1, 1, 2, 2, 3])
+    raft_peer_state.install_snapshot(Snapshot(2, 4, {"vars": {}, "sessions": {}}))
+    assert [] == raft_peer_state.state_log
+    assert 3 == raft_peer_state.log_length()
+    assert 4 == raft_peer_state.last_log_term()
+
+
+@pytest.fixture
+def start_peer(tmp_path):
+    # every call is a restart of peer1 on the same write-ahead log directory
+    write_ahead_logs = []
+
+    def start():
+        raft_peer_state = RaftPeerState(("localhost", 20001), "peer1")
+        write_ahead_log = WriteAheadLog(str(tmp_path), "peer1", segment_max_bytes=100)
+        write_ahead_logs.append(write_ahead_log)
+        raft_peer_state.attach_write_ahead_log(write_ahead_log)
+        return raft_peer_state, write_ahead_log
+
+    yield start
+    for write_ahead_log in write_ahead_logs:
+        write_ahead_log.close()
+
+
+def test_reload_from_snapshot(start_peer):
+    raft_peer_state, write_ahead_log = start_peer()
+    raft_peer_state.current_term = 2
+    raft_peer_state.persist_term_and_vote()
+    for log_index in range(6):
+        raft_peer_state.append_log(LogData(log_index, 1 if log_index < 3 else 2, ["x", "add", 1]))
+        raft_peer_state.sync_write_ahead_log()
+    for one_log in raft_peer_state.state_log[:4]:
+        raft_peer_state.remote_var.perform_action(one_log.request_command_action_list, one_log.log_index)
+    raft_peer_state.take_snapshot(3)
+    # the logs after the snapshot are rewritten into one segment and the others are removed
+    assert 1 == len(write_ahead_log.list_segment_numbers())
+    assert os.path.isfile(os.path.join(write_ahead_log.wal_dir, WriteAheadLog.snapshot_file_name))
+    raft_peer_state.append_log(LogData(6, 2, ["y", "add", 1]))
+    raft_peer_state.sync_write_ahead_log()
+
+    restarted_peer_state, _ = start_peer()
+    assert 3 == restarted_peer_state.snapshot_last_index
+    assert 2 == restarted_peer_state.snapshot_last_term
+    assert 3 == restarted_peer_state.commit_index
+    assert 3 == restarted_peer_state.last_apply
+    assert 2 == restarted_peer_state.current_term
+    assert [4, 5, 6] == [one_log.log_index for one_log in restarted_peer_state.state_log]
+    assert 4.0 == restarted_peer_state.remote_var.read_var("x")
+    assert [[2, 3]] == restarted_peer_state.term_start_indexes
+
+
+def test_snapshot_saved_after_pending_records_and_dir_synced(start_peer):
+    raft_peer_state, write_ahead_log = start_peer()
+    for log_index in range(4):
+        raft_peer_state.append_log(LogData(log_index, 1, ["x", "add", 1]))
+        raft_peer_state.remote_var.perform_action(["x", "add", 1], log_index)
+    # still pending when the snapshot is taken
+    raft_peer_state.append_log(LogData(4, 1, ["y", "add", 1]))
+    file_operations = []
+    save_to_file = Snapshot.save_to_file
+
+    def record_save_to_file(snapshot, file_path):
+        file_operations.append(("pending", write_ahead_log.has_pending_records()))
+        save_to_file(snapshot, file_path)
+        file_operations.append("replace")
+
+    def record_remove(file_path):
+        file_operations.append("remove")
+        os.unlink(file_path)
+
+    with mock.patch.object(Snapshot, "save_to_file", record_save_to_file), \
+            mock.patch.object(write_ahead_log, "sync_dir", lambda: file_operations.append("sync_dir")), \
+            mock.patch("WriteAheadLog.os.remove", record_remove):
+        raft_peer_state.take_snapshot(3)
+    # the old segment got every record (and the folder its first sync) before the snapshot replaced anything,
+    # the folder is fsynced after the snapshot file is renamed, after the new segment is created and after
+    # the old one is removed
+    assert ["sync_dir", ("pending", False), "replace", "sync_dir", "sync_dir", "remove", "sync_dir"] == \
+        file_operations
+    restarted_peer_state, _ = start_peer()
+    assert [4] == [one_log.log_index for one_log in restarted_peer_state.state_log]
+
+
+def install_snapshot_messages(raft_peer):
+    return [one_message for one_message in raft_peer.json_message_send_queue
+            if one_message["msg_type"] == "install_snapshot"]
+
+
+def snapshot_reply(raft_peer, follower_addr_port_tuple, next_offset, done=False):
+    return {"msg_type": "install_snapshot_reply", "sender_term": raft_peer.raft_peer_state.current_term,
+            "last_included_index": raft_peer.raft_peer_state.snapshot_last_index, "next_offset": next_offset,
+            "done": done, "send_from": list(follower_addr_port_tuple), "send_to": list(raft_peer.my_addr_port_tuple)}
+
+
+@pytest.fixture
+def leader_with_snapshot(raft_peer_factory, followers):
+    # the follower needs logs compacted into a snapshot sent in chunks of 8 characters
+    raft_peer = raft_peer_factory([1, 1, 2, 2, 2], 2, "leader")
+    raft_peer.raft_peer_state.compact_log(Snapshot(3, 2, {"vars": {"x": 4.0}, "sessions": {}}))
+    raft_peer.raft_peer_state.peers_next_index[followers[0]] = 1
+    raft_peer.snapshot_chunk_size = 8
+    return raft_peer
+
+
+def test_one_snapshot_chunk_outstanding(leader_with_snapshot):
+    for _ in range(3):
+        leader_with_snapshot.put_sent_to_all_peer_append_entries_heart_beat()
+    # the heart beats do not queue the chunk again while it waits for its reply
+    assert [0] == [one_message["offset"] for one_message in install_snapshot_messages(leader_with_snapshot)]
+
+
+def test_snapshot_chunk_resent_after_timeout(leader_with_snapshot, followers):
+    leader_with_snapshot.put_sent_to_all_peer_append_entries_heart_beat()
+    leader_with_snapshot.raft_peer_state.peers_snapshot_send_time[followers[0]] -= \
+        leader_with_snapshot.snapshot_chunk_timeout
+    leader_with_snapshot.put_sent_to_all_peer_append_entries_heart_beat()
+    assert [0, 0] == [one_message["offset"] for one_message in install_snapshot_messages(leader_with_snapshot)]
+
+
+def test_snapshot_reply_sends_next_chunk_once(leader_with_snapshot, followers):
+    leader_with_snapshot.put_sent_to_all_peer_append_entries_heart_beat()
+    leader_with_snapshot.process_install_snapshot_reply(snapshot_reply(leader_with_snapshot, followers[0], 8))
+    # the reply of the same chunk resent after the timeout, chunk 8 is already waiting for its reply
+    leader_with_snapshot.process_install_snapshot_reply(snapshot_reply(leader_with_snapshot, followers[0], 8))
+    leader_with_snapshot.put_sent_to_all_peer_append_entries_heart_beat()
+    assert [0, 8] == [one_message["offset"] for one_message in install_snapshot_messages(leader_with_snapshot)]
+
+    leader_with_snapshot.process_install_snapshot_reply(snapshot_reply(leader_with_snapshot, followers[0], 0, True))
+    assert 4 == leader_with_snapshot.raft_peer_state.peers_next_index[followers[0]]
+    assert followers[0] not in leader_with_snapshot.raft_peer_state.peers_snapshot_send_time
+
+
+def install_snapshot_chunk(snapshot, offset, sender_term, chunk_size=8):
+    data, done = snapshot.get_chunk(offset, chunk_size)
+    return {"msg_type": "install_snapshot", "sender_term": sender_term, "peer_id": "peer1",
+            "last_included_index": snapshot.last_included_index, "last_included_term": snapshot.last_included_term,
+            "offset": offset, "data": data, "done": done, "send_from": ["localhost", 20001],
+            "send_to": ["localhost", 20002]}
+
+
+def receive_chunk(follower_state, snapshot, offset, sender_term):
+    return InstallSnapshotFollower(install_snapshot_chunk(snapshot, offset, sender_term),
+                                   follower_state).process_install_snapshot()
+
+
+def test_follower_ignores_resent_first_chunk(peer_state_factory):
+    follower_state = peer_state_factory([1], 2, ("localhost", 20002), "peer2")
+    snapshot = Snapshot(3, 2, {"vars": {"x": 4.0}, "sessions": {}})
+    for offset in (0, 8, 0):
+        reply = receive_chunk(follower_state, snapshot, offset, 2)
+    # the duplicate first chunk keeps the two chunks received
+    assert 16 == reply["next_offset"]
+    assert 16 == follower_state.incoming_snapshot.received_size
+    offset = reply["next_offset"]
+    while not reply["done"]:
+        reply = receive_chunk(follower_state, snapshot, offset, 2)
+        offset = reply["next_offset"]
+    assert 3 == follower_state.snapshot_last_index
+    assert snapshot.snapshot_vars == follower_state.snapshot.snapshot_vars
+
+
+def test_follower_restarts_transfer_of_new_leader(peer_state_factory):
+    follower_state = peer_state_factory([1], 2, ("localhost", 20002), "peer2")
+    snapshot = Snapshot(3, 2, {"vars": {"x": 4.0}, "sessions": {}})
+    receive_chunk(follower_state, snapshot, 0, 2)
+    # the new leader of term 3 could have encoded the same snapshot differently
+    reply = receive_chunk(follower_state, snapshot, 8, 3)
+    assert 0 == reply["next_offset"]
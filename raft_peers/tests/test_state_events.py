@@ -0,0 +1,95 @@
+"""
+
+
+Tests of the state loop, the timer, the commit thread and the leader
+forwarder only put StateEvent into the queue of the received messages and
+the loop changes the Raft state when it gets to them, in the order they
+were queued.
+
+
+"""
+
+import threading
+import time
+
+import pytest
+
+from StateEvent import StateEvent
+
+
+def request_command(request_id):
+    return {"msg_type": "request_command", "request_command_list": ["x", "add", 1], "request_id": request_id,
+            "send_from": ["localhost", 30001]}
+
+
+def queued_state_events(raft_peer):
+    state_events = []
+    while raft_peer.json_message_recv_queue.qsize() > 0:
+        state_events.append(raft_peer.json_message_recv_queue.get_nowait())
+    return state_events
+
+
+@pytest.fixture
+def leader(raft_peer_factory):
+    return raft_peer_factory([], 1, "leader")
+
+
+def test_events_handled_in_turn_with_messages(leader):
+    forwarded_reply = StateEvent(StateEvent.forwarded_reply, (("localhost", 30002), {
+        "msg_type": "request_command_reply", "command_result": 3.0, "request_id": 7}))
+    leader.process_recv_json_messages([forwarded_reply, request_command(1)])
+    assert [("request_command_reply", ["localhost", 30002])] == \
+        [(one_message["msg_type"], one_message["send_to"]) for one_message in leader.json_message_send_queue]
+    assert 1 == leader.raft_peer_state.log_length()
+
+
+def test_timer_fired_starts_election_in_state_loop(raft_peer_factory):
+    raft_peer = raft_peer_factory([], 1, "follower")
+    raft_peer.timeout_counter.deadline = time.monotonic()
+    raft_peer.timeout_counter.fire_pending = True
+    raft_peer.process_recv_json_messages([StateEvent(StateEvent.timer_fired)])
+    assert ("candidate", 2) == (raft_peer.raft_peer_state.peer_state, raft_peer.raft_peer_state.current_term)
+    assert ["request_vote"] == [one_message["msg_type"] for one_message in raft_peer.json_message_send_queue]
+    # the timer may put the next one
+    assert not raft_peer.timeout_counter.fire_pending
+
+
+def test_commit_thread_leaves_state_to_loop(leader):
+    for request_id in (1, 2):
+        leader.process_request_command(request_command(request_id))
+    leader.raft_peer_state.commit_index = 1
+    for one_log in leader.raft_peer_state.state_log:
+        leader.json_message_commit_queue.put(one_log)
+    thread_commit = threading.Thread(target=leader.start_processing_commits_thread)
+    thread_commit.daemon = True
+    thread_commit.start()
+
+    deadline = time.monotonic() + 2
+    while leader.json_message_recv_queue.qsize() == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    logs_applied_event = queued_state_events(leader)[0]
+    assert StateEvent.logs_applied == logs_applied_event.event_type
+    assert 1 == logs_applied_event.payload["applied_index"]
+    # nobody was answered and last_apply did not move until the loop handles the event
+    assert (-1, []) == (leader.raft_peer_state.last_apply, leader.json_message_send_queue)
+
+    leader.process_recv_json_messages([logs_applied_event])
+    assert 1 == leader.raft_peer_state.last_apply
+    assert "request_command_reply_batch" == leader.json_message_send_queue[0]["msg_type"]
+
+
+def test_event_from_other_thread_handled_by_loop(leader):
+    handled_threads = []
+    handled = threading.Event()
+
+    def process_forwarded_reply(payload):
+        handled_threads.append((threading.current_thread(), payload))
+        handled.set()
+
+    leader.state_event_functions[StateEvent.forwarded_reply] = process_forwarded_reply
+    thread_recv = threading.Thread(target=leader.process_json_message_recv_queue)
+    thread_recv.daemon = True
+    thread_recv.start()
+    leader.put_state_event(StateEvent.forwarded_reply, "reply")
+    assert handled.wait(2)
+    assert [(thread_recv, "reply")] == handled_threads
@@ -0,0 +1,113 @@
+"""
+
+
+Tests of the deadline timer, resets only move the deadline, nothing fires
+before it and the timer thread hands one timer_fired event at a time to
+the state loop.
+
+
+"""
+
+import threading
+import time
+
+import pytest
+
+from StateEvent import StateEvent
+from TimeoutCounter import TimeoutCounter
+
+
+class RecordingRaftPeer:
+    # stands for the RaftPeer called by the timer
+    def __init__(self):
+        self.calls = []
+        self.state_events = []
+        self.state_event_put = threading.Event()
+
+    def put_sent_to_all_peer_request_vote(self):
+        self.calls.append("request_vote")
+
+    def put_sent_to_all_peer_append_entries_heart_beat(self):
+        self.calls.append("heart_beat")
+
+    def put_sent_to_all_peer_new_entries(self):
+        self.calls.append("new_entries")
+
+    def put_state_event(self, event_type, payload=None):
+        self.state_events.append(event_type)
+        self.state_event_put.set()
+
+
+@pytest.fixture
+def raft_peer_state(peer_state_factory):
+    return peer_state_factory([])
+
+
+@pytest.fixture
+def timeout_counter(raft_peer_state):
+    return TimeoutCounter(1, ("localhost", 20001), "peer1", raft_peer_state, 0.1)
+
+
+def test_nothing_fires_before_deadline(timeout_counter):
+    raft_peer = RecordingRaftPeer()
+    remaining = timeout_counter.fire_if_due(raft_peer)
+    assert [] == raft_peer.calls
+    assert 0.9 < remaining <= 1
+
+
+def test_election_fires_once_per_timeout(timeout_counter):
+    raft_peer = RecordingRaftPeer()
+    timeout_counter.deadline = time.monotonic()
+    remaining = timeout_counter.fire_if_due(raft_peer)
+    assert ["request_vote"] == raft_peer.calls
+    # the next election is one whole timeout away
+    assert 0.9 < remaining <= 1
+    timeout_counter.fire_if_due(raft_peer)
+    assert ["request_vote"] == raft_peer.calls
+
+
+def test_leader_sends_heart_beat(timeout_counter, raft_peer_state):
+    raft_peer = RecordingRaftPeer()
+    raft_peer_state.peer_state = "leader"
+    timeout_counter.deadline = time.monotonic()
+    remaining = timeout_counter.fire_if_due(raft_peer)
+    assert ["heart_beat"] == raft_peer.calls
+    assert remaining <= 0.1
+
+
+def test_reset_moves_deadline(timeout_counter):
+    timeout_counter.deadline = time.monotonic()
+    timeout_counter.reset_timeout()
+    raft_peer = RecordingRaftPeer()
+    timeout_counter.fire_if_due(raft_peer)
+    assert [] == raft_peer.calls
+
+
+def test_wakeup_only_when_deadline_moves_earlier(timeout_counter):
+    wakeups = []
+    timeout_counter.wakeup = lambda: wakeups.append(True)
+    timeout_counter.move_deadline(5)
+    assert [] == wakeups
+    timeout_counter.reset_timeout_append_entries()
+    assert [True] == wakeups
+
+
+def test_timer_thread_waits_for_state_loop(timeout_counter):
+    raft_peer = RecordingRaftPeer()
+    timeout_counter.time_out_const = 0.01
+    timer_thread = threading.Thread(target=timeout_counter.start_time_counter, args=(raft_peer,))
+    timer_thread.daemon = True
+    timer_thread.start()
+
+    assert raft_peer.state_event_put.wait(1)
+    raft_peer.state_event_put.clear()
+    # still due, but the event already put is not handled yet
+    assert not raft_peer.state_event_put.wait(0.1)
+    assert [StateEvent.timer_fired] == raft_peer.state_events
+    assert [] == raft_peer.calls
+
+    # the state loop handles it, the timer waits for the next deadline
+    timeout_counter.fire_if_due(raft_peer)
+    assert ["request_vote"] == raft_peer.calls
+    assert raft_peer.state_event_put.wait(1)
+    assert [StateEvent.timer_fired, StateEvent.timer_fired] == raft_peer.state_events
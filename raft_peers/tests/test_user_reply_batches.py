@@ -0,0 +1,69 @@
+"""
+
+
+Tests of the replies of the logs applied together, a user with several of
+them gets one request_command_reply_batch and a user with one gets the
+plain request_command_reply.
+
+
+"""
+
+import pytest
+
+from LogData import LogData
+
+
+def applied_logs(raft_peer, user_request_ids):
+    """
+
+    logs of the current term applied in one pass, one for every (user port, request_id), None is a log
+    no user waits for
+
+    :return: dict, the payload of the logs_applied event
+    """
+    applied_logs = []
+    for log_index, user_request_id in enumerate(user_request_ids):
+        if user_request_id is None:
+            one_log = LogData(log_index, 1, ["", "noop", 0])
+        else:
+            user_port, request_id = user_request_id
+            one_log = LogData(log_index, 1, ["x", "add", 1], ["localhost", user_port], request_id=request_id)
+        raft_peer.raft_peer_state.append_log(one_log)
+        applied_logs.append((one_log, float(log_index + 1)))
+    return {"applied_index": len(user_request_ids) - 1, "applied_logs": applied_logs, "snapshot": None}
+
+
+@pytest.fixture
+def leader(raft_peer_factory):
+    return raft_peer_factory([], 1, "leader")
+
+
+def test_replies_of_one_user_batched(leader):
+    leader.process_logs_applied(applied_logs(leader, [(30001, 1), (30002, 1), None, (30001, 2)]))
+    replies = {tuple(one_message["send_to"]): one_message for one_message in leader.json_message_send_queue}
+    assert 2 == len(replies)
+
+    batch = replies[("localhost", 30001)]
+    assert "request_command_reply_batch" == batch["msg_type"]
+    # in log order, each with its request_id, the addresses are only on the batch
+    assert [{"msg_type": "request_command_reply", "command_result": 1.0, "request_id": 1},
+            {"msg_type": "request_command_reply", "command_result": 4.0, "request_id": 2}] == batch["replies"]
+
+    one_reply = replies[("localhost", 30002)]
+    assert "request_command_reply" == one_reply["msg_type"]
+    assert (2.0, 1) == (one_reply["command_result"], one_reply["request_id"])
+    assert 3 == leader.raft_peer_state.last_apply
+
+
+def test_replies_sent_right_away_outside_batch(leader):
+    leader.put_user_reply("request_command_reply", ["localhost", 30001], "is_leader", 1)
+    leader.put_user_reply("request_command_reply", ["localhost", 30001], "is_leader", 2)
+    assert ["request_command_reply"] * 2 == [one_message["msg_type"] for one_message in leader.json_message_send_queue]
+    assert leader.user_reply_batches is None
+
+
+def test_follower_does_not_reply(raft_peer_factory):
+    raft_peer = raft_peer_factory([], 1, "follower")
+    raft_peer.process_logs_applied(applied_logs(raft_peer, [(30001, 1), (30001, 2)]))
+    assert [] == raft_peer.json_message_send_queue
+    assert 1 == raft_peer.raft_peer_state.last_apply
@@ -0,0 +1,114 @@
+"""
+
+
+Tests of the VisualizationTap, recording never waits for the game, the
+oldest events are dropped when the buffer is full, only the frequent
+events are sampled, and a failing publish does not stop the publisher.
+
+
+"""
+
+import threading
+import time
+from queue import Queue
+
+import pytest
+
+from VisualizationTap import VisualizationTap
+
+
+@pytest.fixture
+def tap_factory():
+    def create_tap(publish, **options):
+        return VisualizationTap(publish, ["localhost", 20001], ["localhost", 8888],
+                                {"host": "localhost", "port": "20001", "peer_id": "peer1"}, **options)
+    return create_tap
+
+
+def test_events_published_in_order(tap_factory):
+    published = Queue()
+    tap = tap_factory(published.put)
+    tap.record("request_vote", peer_id="peer1", sender_term=2)
+    tap.record("commit_index", index=4, skill_name="x")
+    assert {"msg_type": "request_vote", "send_from": ["localhost", 20001], "send_to": ["localhost", 8888],
+            "peer_id": "peer1", "sender_term": 2} == published.get(timeout=2)
+    one_message = published.get(timeout=2)
+    assert ("commit_index", 4) == (one_message["msg_type"], one_message["index"])
+
+
+def test_full_buffer_drops_oldest(tap_factory):
+    publish_started = threading.Event()
+    game_ready = threading.Event()
+    published = []
+
+    def slow_publish(json_data_dict):
+        publish_started.set()
+        game_ready.wait()
+        published.append(json_data_dict["index"])
+
+    tap = tap_factory(slow_publish, buffer_size=3)
+    tap.record("commit_index", index=0)
+    assert publish_started.wait(2)
+    # the game is stuck, recording still returns right away
+    record_start = time.monotonic()
+    for index in range(1, 6):
+        tap.record("commit_index", index=index)
+    assert time.monotonic() - record_start < 0.5
+    assert 2 == tap.dropped_count
+
+    game_ready.set()
+    deadline = time.monotonic() + 2
+    while len(published) < 4 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert [0, 3, 4, 5] == published
+
+
+def test_only_frequent_events_sampled(tap_factory):
+    published = Queue()
+    tap = tap_factory(published.put, sample_rate=0.0)
+    tap.record("append_entries_leader", new_entries=[])
+    tap.record("append_entries_follower_reply", append_entries_result=True)
+    tap.record("leadership", sender_term=3)
+    assert "leadership" == published.get(timeout=2)["msg_type"]
+    assert published.empty()
+
+
+def test_backlog_not_delayed_again(tap_factory):
+    published = Queue()
+    tap = tap_factory(published.put, max_delay=0.2)
+    tap.record("commit_index", index=0)
+    published.get(timeout=2)
+    with tap.condition:
+        # recorded long before the publisher got to them
+        for index in range(1, 4):
+            tap.events.append((time.monotonic() - 1, "commit_index", {"index": index}))
+        tap.condition.notify()
+    publish_start = time.monotonic()
+    assert [1, 2, 3] == [published.get(timeout=2)["index"] for _ in range(3)]
+    assert time.monotonic() - publish_start < 0.2
+
+
+def test_failed_publish_keeps_publisher(tap_factory):
+    published = Queue()
+
+    def publish(json_data_dict):
+        if json_data_dict["index"] == 0:
+            raise ConnectionError("game closed")
+        published.put(json_data_dict)
+
+    tap = tap_factory(publish)
+    tap.record("commit_index", index=0)
+    tap.record("commit_index", index=1)
+    assert 1 == published.get(timeout=2)["index"]
+
+
+def test_raft_peer_records_acknowledged_command(raft_peer_factory):
+    raft_peer = raft_peer_factory([], 1, "leader")
+    recorded = []
+    raft_peer.visualizaiton_on = True
+    raft_peer.visualization_tap = type("RecordingTap", (), {
+        "record": lambda tap, msg_type, **fields: recorded.append((msg_type, fields))})()
+    raft_peer.process_request_command({"msg_type": "request_command", "request_command_list": ["x", "add", 1],
+                                       "send_from": ["localhost", 30001]})
+    assert [("request_command_ack", {"request_command_list": ["x", "add", 1], "sender_term": 1, "index": 0})] == \
+        recorded
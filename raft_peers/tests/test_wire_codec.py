@@ -0,0 +1,225 @@
+"""
+
+
+Tests of the wire codecs, every message type is encoded and decoded by
+BinaryCodec, messages outside the schemas go as JSON, and codec_hello
+picks the codec of a connection.
+
+
+"""
+
+import socket
+import threading
+import unittest
+
+from AppendEntriesLeader import AppendEntriesLeader
+from BinaryCodec import BinaryCodec
+from FrameReader import FrameReader
+from JsonCodec import JsonCodec
+from LogData import LogData
+from RaftPeer import RaftPeer
+from RaftPeerState import RaftPeerState
+
+peer1 = ["localhost", 20001]
+peer2 = ["127.0.0.1", 20002]
+
+# one message of every type in BinaryCodec.message_schemas
+messages = {
+    "append_entries_leader": {"msg_type": "append_entries_leader", "sender_term": 7, "prev_log_index": 41,
+                              "prev_log_term": 6, "leader_commit_index": 40, "read_round": 3, "peer_id": "peer1",
+                              "leader_user_addr": ["localhost", 21001], "send_from": peer1, "send_to": peer2,
+                              "new_entries": [{"log_index": 42, "log_term": 7,
+                                               "request_command_action_list": ["x", "add", 1.5]},
+                                              {"log_index": 43, "log_term": 7,
+                                               "request_command_action_list": ["x", "sub", "2", ["c1", 4, 3]]}]},
+    "append_entries_follower_reply": {"msg_type": "append_entries_follower_reply", "sender_term": 7,
+                                      "log_index_start": -1, "log_index_end": -1, "prev_log_index": 41,
+                                      "conflict_term": 5, "conflict_index": 30, "read_round": 3,
+                                      "append_entries_result": False, "send_from": peer2, "send_to": peer1},
+    "request_vote": {"msg_type": "request_vote", "sender_term": 8, "last_log_index": 43, "last_log_term": 7,
+                     "peer_id": "peer2", "send_from": peer2, "send_to": peer1},
+    "request_vote_reply": {"msg_type": "request_vote_reply", "sender_term": 8, "vote_granted": True,
+                           "peer_id": "peer1", "vote_peer_id": "peer2", "send_from": peer1, "send_to": peer2},
+    "install_snapshot": {"msg_type": "install_snapshot", "sender_term": 8, "last_included_index": 1000,
+                         "last_included_term": 7, "offset": 65536, "done": False, "peer_id": "peer1",
+                         "send_from": peer1, "send_to": peer2, "data": '{"vars": {"x": 1.0, "ü": true}}'},
+    "install_snapshot_reply": {"msg_type": "install_snapshot_reply", "sender_term": 8, "last_included_index": 1000,
+                               "next_offset": 131072, "done": True, "send_from": peer2, "send_to": peer1},
+}
+
+
+def decode_frame(codec, frame):
+    # the frame without its 4 bytes length
+    length = BinaryCodec.frame_length_struct.unpack_from(frame, 0)[0]
+    payload = frame[BinaryCodec.frame_length_struct.size:]
+    assert len(payload) == length
+    return codec.decode(memoryview(payload))
+
+
+def create_peer(preferred_wire_codec):
+    # only what the codec negotiation uses, no sockets are opened
+    raft_peer = RaftPeer.__new__(RaftPeer)
+    raft_peer.my_addr_port_tuple = ("localhost", 20001)
+    raft_peer.my_detail = {"host": "localhost", "port": "20001", "peer_id": "peer1"}
+    raft_peer.json_codec = JsonCodec()
+    raft_peer.wire_codecs = {BinaryCodec.codec_name: BinaryCodec(), JsonCodec.codec_name: raft_peer.json_codec}
+    raft_peer.preferred_wire_codec = preferred_wire_codec
+    raft_peer.codec_hello_timeout = 0.2
+    return raft_peer
+
+
+class BinaryCodecTest(unittest.TestCase):
+    def setUp(self):
+        self.codec = BinaryCodec()
+
+    def test_every_message_type_round_trip(self):
+        for msg_type, json_data_dict in messages.items():
+            frame = self.codec.encode_frame(json_data_dict)
+            # encoded by its schema, not as JSON
+            self.assertNotEqual(BinaryCodec.json_type_id, frame[BinaryCodec.frame_length_struct.size + 1], msg_type)
+            self.assertEqual(json_data_dict, decode_frame(self.codec, frame), msg_type)
+
+    def test_decoded_by_another_codec(self):
+        # the caches of the sender are never needed by the receiver
+        frame = self.codec.encode_frame(messages["append_entries_leader"])
+        self.assertEqual(messages["append_entries_leader"], decode_frame(BinaryCodec(), frame))
+
+    def test_log_data_entries(self):
+        raft_peer_state = RaftPeerState(tuple(peer1), "peer1", ("localhost", 21001))
+        raft_peer_state.current_term = 2
+        for log_index in range(3):
+            raft_peer_state.append_log(LogData(log_index, 2, ["x", "time", log_index], ("localhost", 5000)))
+        raft_peer_state.initialize_peers_next_and_match_index([tuple(peer2)])
+        raft_peer_state.peers_next_index[tuple(peer2)] = 1
+        append_entries = AppendEntriesLeader(raft_peer_state, tuple(peer2)).return_instance_vars_in_dict()
+
+        decoded_append_entries = decode_frame(self.codec, self.codec.encode_frame(append_entries))
+        self.assertEqual(0, decoded_append_entries["prev_log_index"])
+        self.assertEqual([{"log_index": 1, "log_term": 2, "request_command_action_list": ["x", "time", 1]},
+                          {"log_index": 2, "log_term": 2, "request_command_action_list": ["x", "time", 2]}],
+                         decoded_append_entries["new_entries"])
+
+    def test_broadcast_shares_prefix(self):
+        heartbeat = dict(messages["append_entries_leader"], new_entries=[])
+        self.codec.encode_frame(heartbeat)
+        for send_to in (["localhost", 20003], ["another.host", 20004]):
+            one_heartbeat = dict(heartbeat, send_to=send_to)
+            self.assertEqual(one_heartbeat, decode_frame(self.codec, self.codec.encode_frame(one_heartbeat)))
+        # a changed field before send_to is not taken from the cache
+        one_heartbeat = dict(heartbeat, leader_commit_index=41)
+        self.assertEqual(one_heartbeat, decode_frame(self.codec, self.codec.encode_frame(one_heartbeat)))
+
+    def test_released_entries_are_encoded_again(self):
+        self.codec.encode_frame(messages["append_entries_leader"])
+        self.assertIn((42, 7), self.codec.entry_cache)
+        self.codec.release_entries(42)
+        self.assertNotIn((42, 7), self.codec.entry_cache)
+        self.assertIn((43, 7), self.codec.entry_cache)
+        frame = self.codec.encode_frame(messages["append_entries_leader"])
+        self.assertNotIn((42, 7), self.codec.entry_cache)
+        self.assertEqual(messages["append_entries_leader"], decode_frame(self.codec, frame))
+
+    def test_json_fallback(self):
+        fallback_messages = [
+            # not in the schemas
+            {"msg_type": "request_command", "request_command_action_list": ["x", "add", 1], "request_id": 9},
+            # extra key
+            dict(messages["request_vote"], extra=True),
+            # missing key
+            {key: value for key, value in messages["request_vote"].items() if key != "peer_id"},
+            # does not fit the struct
+            dict(messages["request_vote"], sender_term=2 ** 64),
+            dict(messages["request_vote"], last_log_index="12"),
+        ]
+        for json_data_dict in fallback_messages:
+            frame = self.codec.encode_frame(json_data_dict)
+            self.assertEqual(BinaryCodec.json_type_id, frame[BinaryCodec.frame_length_struct.size + 1])
+            self.assertEqual(json_data_dict, decode_frame(self.codec, frame))
+
+    def test_json_fallback_log_data(self):
+        json_data_dict = {"msg_type": "forwarded", "log": LogData(3, 1, ["x", "add", 1]), "send_from": ("h", 1)}
+        decoded_dict = decode_frame(self.codec, self.codec.encode_frame(json_data_dict))
+        self.assertEqual({"msg_type": "forwarded",
+                          "log": {"log_index": 3, "log_term": 1, "request_command_action_list": ["x", "add", 1]},
+                          "send_from": ["h", 1]}, decoded_dict)
+
+    def test_unsupported_version(self):
+        frame = bytearray(self.codec.encode_frame(messages["request_vote"]))
+        frame[BinaryCodec.frame_length_struct.size] = BinaryCodec.codec_version + 1
+        with self.assertRaises(ValueError):
+            decode_frame(self.codec, bytes(frame))
+
+
+class JsonCodecTest(unittest.TestCase):
+    def test_round_trip(self):
+        codec = JsonCodec()
+        for json_data_dict in messages.values():
+            frame = codec.encode_frame(json_data_dict)
+            self.assertEqual(b"\n", frame[-1:])
+            self.assertEqual(json_data_dict, codec.decode(memoryview(frame)[:-1]))
+
+
+class CodecHelloTest(unittest.TestCase):
+    def negotiate(self, connecting_peer, accepting_peer, answer=True):
+        """
+
+        connecting_peer sends codec_hello on one end of a socket pair, accepting_peer answers it
+        from the other end like the receive thread does
+
+        :return: (codec picked by connecting_peer, codec picked by accepting_peer)
+        """
+        client_socket, peer_socket = socket.socketpair()
+        accepted_codec = []
+
+        def accept():
+            frame_reader = FrameReader(peer_socket)
+            for payload in frame_reader.read_frames():
+                codec_hello = accepting_peer.json_codec.decode(payload)
+                self.assertEqual("codec_hello", codec_hello["msg_type"])
+                if answer:
+                    accepted_codec.append(accepting_peer.reply_codec_hello(peer_socket, codec_hello))
+                return
+
+        accept_thread = threading.Thread(target=accept)
+        accept_thread.start()
+        try:
+            connected_codec = connecting_peer.negotiate_wire_codec(client_socket)
+            accept_thread.join()
+        finally:
+            client_socket.close()
+            peer_socket.close()
+        return connected_codec, accepted_codec[0] if answer else None
+
+    def test_both_binary(self):
+        connected_codec, accepted_codec = self.negotiate(create_peer(BinaryCodec.codec_name),
+                                                         create_peer(BinaryCodec.codec_name))
+        self.assertEqual(BinaryCodec.codec_name, connected_codec.codec_name)
+        self.assertEqual(BinaryCodec.codec_name, accepted_codec.codec_name)
+
+    def test_accepting_peer_wants_json(self):
+        connected_codec, accepted_codec = self.negotiate(create_peer(BinaryCodec.codec_name),
+                                                         create_peer(JsonCodec.codec_name))
+        self.assertEqual(JsonCodec.codec_name, connected_codec.codec_name)
+        self.assertEqual(JsonCodec.codec_name, accepted_codec.codec_name)
+
+    def test_connecting_peer_wants_json(self):
+        accepting_peer = create_peer(BinaryCodec.codec_name)
+        connecting_peer = create_peer(JsonCodec.codec_name)
+        self.assertEqual([JsonCodec.codec_name, JsonCodec.codec_name],
+                         connecting_peer.create_codec_hello()["codecs"])
+        connected_codec, accepted_codec = self.negotiate(connecting_peer, accepting_peer)
+        self.assertEqual(JsonCodec.codec_name, connected_codec.codec_name)
+        self.assertEqual(JsonCodec.codec_name, accepted_codec.codec_name)
+
+    def test_old_peer_never_answers(self):
+        connected_codec, accepted_codec = self.negotiate(create_peer(BinaryCodec.codec_name),
+                                                         create_peer(BinaryCodec.codec_name), answer=False)
+        self.assertEqual(JsonCodec.codec_name, connected_codec.codec_name)
+
+    def test_codec_hello_is_ignored_by_old_peers(self):
+        # lower than any real term, so an old peer handling it as a message changes nothing
+        self.assertLess(create_peer(BinaryCodec.codec_name).create_codec_hello()["sender_term"], -1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,177 @@
+"""
+
+
+Tests of WriteAheadLog, a RaftPeerState is written through it and then
+rebuilt by a fresh RaftPeerState from the same folder like a restarted peer.
+
+cd raft_peers
+python3 -m unittest discover tests
+
+
+"""
+
+import asyncio
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import WriteAheadLog as write_ahead_log_module
+from AsyncRaftPeer import AsyncRaftPeer
+from LogData import LogData
+from RaftPeerState import RaftPeerState
+from WriteAheadLog import WriteAheadLog
+
+
+class WriteAheadLogTest(unittest.TestCase):
+    def setUp(self):
+        self.wal_dir = tempfile.mkdtemp()
+        self.write_ahead_logs = []
+
+    def tearDown(self):
+        for write_ahead_log in self.write_ahead_logs:
+            write_ahead_log.close()
+        shutil.rmtree(self.wal_dir)
+
+    def start_peer(self, segment_max_bytes=4 * 1024 * 1024):
+        # a peer attached to the folder, it loads whatever was written before
+        raft_peer_state = RaftPeerState(("localhost", 20001), "peer1")
+        write_ahead_log = WriteAheadLog(self.wal_dir, "peer1", segment_max_bytes)
+        self.write_ahead_logs.append(write_ahead_log)
+        raft_peer_state.attach_write_ahead_log(write_ahead_log)
+        return raft_peer_state
+
+    def append_logs(self, raft_peer_state, log_term, count):
+        for i in range(count):
+            log_index = raft_peer_state.log_length()
+            raft_peer_state.append_log(LogData(log_index, log_term, ["x", "add", log_index]))
+
+    def log_entries(self, raft_peer_state):
+        return [(one_log.log_index, one_log.log_term, one_log.request_command_action_list)
+                for one_log in raft_peer_state.state_log]
+
+    def test_reload_logs_term_and_vote(self):
+        raft_peer_state = self.start_peer()
+        raft_peer_state.current_term = 3
+        raft_peer_state.vote_for = ("localhost", 20002)
+        raft_peer_state.persist_term_and_vote()
+        self.append_logs(raft_peer_state, 2, 3)
+        self.append_logs(raft_peer_state, 3, 2)
+        raft_peer_state.sync_write_ahead_log()
+
+        restarted_peer_state = self.start_peer()
+        self.assertEqual(self.log_entries(raft_peer_state), self.log_entries(restarted_peer_state))
+        self.assertEqual(3, restarted_peer_state.current_term)
+        self.assertEqual(("localhost", 20002), restarted_peer_state.vote_for)
+        self.assertEqual([[2, 0], [3, 3]], restarted_peer_state.term_start_indexes)
+
+    def test_records_are_only_durable_after_sync(self):
+        raft_peer_state = self.start_peer()
+        self.append_logs(raft_peer_state, 1, 2)
+        raft_peer_state.sync_write_ahead_log()
+        # buffered but never synced
+        self.append_logs(raft_peer_state, 1, 2)
+
+        restarted_peer_state = self.start_peer()
+        self.assertEqual(2, restarted_peer_state.log_length())
+
+    def test_reload_truncated_log(self):
+        raft_peer_state = self.start_peer()
+        self.append_logs(raft_peer_state, 1, 4)
+        raft_peer_state.sync_write_ahead_log()
+        # a new leader replaces the logs from index 2
+        raft_peer_state.truncate_log(2)
+        self.append_logs(raft_peer_state, 2, 1)
+        raft_peer_state.sync_write_ahead_log()
+
+        restarted_peer_state = self.start_peer()
+        self.assertEqual([(0, 1, ["x", "add", 0]), (1, 1, ["x", "add", 1]), (2, 2, ["x", "add", 2])],
+                         self.log_entries(restarted_peer_state))
+
+    def test_reload_across_segments(self):
+        raft_peer_state = self.start_peer(segment_max_bytes=100)
+        raft_peer_state.current_term = 1
+        raft_peer_state.persist_term_and_vote()
+        for i in range(5):
+            self.append_logs(raft_peer_state, 1, 2)
+            raft_peer_state.sync_write_ahead_log()
+        self.assertGreater(len(self.write_ahead_logs[-1].list_segment_numbers()), 2)
+
+        restarted_peer_state = self.start_peer(segment_max_bytes=100)
+        self.assertEqual(self.log_entries(raft_peer_state), self.log_entries(restarted_peer_state))
+        self.assertEqual(1, restarted_peer_state.current_term)
+
+    def test_torn_tail_is_ignored(self):
+        raft_peer_state = self.start_peer()
+        self.append_logs(raft_peer_state, 1, 3)
+        raft_peer_state.sync_write_ahead_log()
+        write_ahead_log = self.write_ahead_logs[-1]
+        # crash in the middle of writing a record
+        with open(write_ahead_log.segment_path(write_ahead_log.segment_number), "a", encoding="utf-8") as segment_file:
+            segment_file.write('{"record_type": "entry", "log_in')
+
+        restarted_peer_state = self.start_peer()
+        self.assertEqual(self.log_entries(raft_peer_state), self.log_entries(restarted_peer_state))
+        # appended to a new segment, not after the broken record
+        self.append_logs(restarted_peer_state, 1, 1)
+        restarted_peer_state.sync_write_ahead_log()
+        self.assertEqual(4, self.start_peer().log_length())
+
+
+    def test_records_added_during_fsync(self):
+        raft_peer_state = self.start_peer()
+        self.append_logs(raft_peer_state, 1, 2)
+        fsync_started, fsync_released = threading.Event(), threading.Event()
+
+        def slow_fsync(file_descriptor):
+            fsync_started.set()
+            fsync_released.wait(5)
+
+        with mock.patch.object(write_ahead_log_module.os, "fsync", slow_fsync):
+            sync_thread = threading.Thread(target=raft_peer_state.sync_write_ahead_log)
+            sync_thread.start()
+            self.assertTrue(fsync_started.wait(5))
+            # the state loop is not held up by the disk, its records go to the next sync
+            append_thread = threading.Thread(target=self.append_logs, args=(raft_peer_state, 1, 1))
+            append_thread.start()
+            append_thread.join(1)
+            self.assertFalse(append_thread.is_alive())
+            self.assertTrue(self.write_ahead_logs[-1].has_pending_records())
+            fsync_released.set()
+            sync_thread.join()
+        raft_peer_state.sync_write_ahead_log()
+        self.assertEqual(3, self.start_peer().log_length())
+
+    def test_async_sync_runs_off_the_event_loop(self):
+        raft_peer = AsyncRaftPeer.__new__(AsyncRaftPeer)
+        raft_peer.raft_peer_state = self.start_peer()
+        raft_peer.wal_sync_future = None
+        fsync_threads = []
+
+        def record_fsync(file_descriptor):
+            fsync_threads.append(threading.get_ident())
+
+        async def send_from_two_writers():
+            raft_peer.loop = asyncio.get_running_loop()
+            self.append_logs(raft_peer.raft_peer_state, 1, 3)
+            # both writers wait for the same sync
+            await asyncio.gather(raft_peer.async_sync_write_ahead_log(), raft_peer.async_sync_write_ahead_log())
+            self.assertFalse(raft_peer.raft_peer_state.write_ahead_log.has_pending_records())
+            # nothing pending, nothing to wait for
+            await raft_peer.async_sync_write_ahead_log()
+            return threading.get_ident()
+
+        write_ahead_log = raft_peer.raft_peer_state.write_ahead_log
+        with mock.patch.object(write_ahead_log_module.os, "fsync", record_fsync), \
+                mock.patch.object(write_ahead_log, "sync", wraps=write_ahead_log.sync) as sync:
+            event_loop_thread = asyncio.run(send_from_two_writers())
+        self.assertEqual(1, sync.call_count)
+        self.assertGreater(len(fsync_threads), 0)
+        self.assertNotIn(event_loop_thread, fsync_threads)
+        self.assertEqual(3, self.start_peer().log_length())
+
+
+if __name__ == "__main__":
+    unittest.main()